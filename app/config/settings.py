@@ -22,6 +22,14 @@ class Settings(BaseSettings):
     postgres_db: str = Field("ppna_db", validation_alias="POSTGRES_DB")
     postgres_host: str = Field("localhost", validation_alias="POSTGRES_HOST")
     postgres_port: int = Field(5432, validation_alias="POSTGRES_PORT")
+    db_pool_size: int = Field(20, validation_alias="DB_POOL_SIZE")
+    db_max_overflow: int = Field(20, validation_alias="DB_MAX_OVERFLOW")
+    db_pool_timeout: float = Field(10.0, validation_alias="DB_POOL_TIMEOUT")
+    api_threadpool_size: int = Field(
+        40,
+        validation_alias="API_THREADPOOL_SIZE",
+        description="执行同步接口的线程数，不应超过 db_pool_size + db_max_overflow",
+    )
 
     # Celery / Broker
     broker_url: str = Field("redis://localhost:6379/0", validation_alias="CELERY_BROKER_URL")
@@ -31,6 +39,26 @@ class Settings(BaseSettings):
     celery_task_default_queue: str = Field(
         "detection_queue", validation_alias="CELERY_DEFAULT_QUEUE"
     )
+    model_warmup_enabled: bool = Field(True, validation_alias="MODEL_WARMUP_ENABLED")
+    model_preload_in_parent: bool = Field(
+        False,
+        validation_alias="MODEL_PRELOAD_IN_PARENT",
+        description="在 prefork 之前于主进程加载模型，子进程以写时复制方式共享权重",
+    )
+    model_warmup_timeout: float = Field(120.0, validation_alias="MODEL_WARMUP_TIMEOUT")
+    celery_worker_concurrency: int = Field(0, validation_alias="CELERY_WORKER_CONCURRENCY")
+    fanout_min_chunks: int = Field(
+        80,
+        validation_alias="FANOUT_MIN_CHUNKS",
+        description="分块数达到该值时拆分为并行子任务，0 表示关闭",
+    )
+    fanout_batch_size: int = Field(16, validation_alias="FANOUT_BATCH_SIZE")
+    fanout_batch_max_retries: int = Field(2, validation_alias="FANOUT_BATCH_MAX_RETRIES")
+    dedup_inflight_ttl: int = Field(
+        3600,
+        validation_alias="DEDUP_INFLIGHT_TTL",
+        description="提交时间超过该秒数仍未完成的同内容任务不再被复用，避免挂到已失联的任务上",
+    )
 
     # Milvus
     milvus_host: str = Field("localhost", validation_alias="MILVUS_HOST")
@@ -38,6 +66,34 @@ class Settings(BaseSettings):
     milvus_collection: str = Field(
         "privacy_policy_knowledge", validation_alias="MILVUS_COLLECTION"
     )
+    milvus_health_check_interval: float = Field(
+        30.0, validation_alias="MILVUS_HEALTH_CHECK_INTERVAL"
+    )
+    milvus_reconnect_backoff: float = Field(
+        10.0, validation_alias="MILVUS_RECONNECT_BACKOFF"
+    )
+    local_index_enabled: bool = Field(True, validation_alias="LOCAL_INDEX_ENABLED")
+    local_index_dir: str = Field("cache/vector_index", validation_alias="LOCAL_INDEX_DIR")
+    local_index_refresh_interval: float = Field(
+        60.0, validation_alias="LOCAL_INDEX_REFRESH_INTERVAL"
+    )
+    kb_load_batch_size: int = Field(
+        256,
+        validation_alias="KB_LOAD_BATCH_SIZE",
+        description="知识库批量加载时每批嵌入与写入的条目数",
+    )
+    kb_load_checkpoint_dir: str = Field("cache/kb_load", validation_alias="KB_LOAD_CHECKPOINT_DIR")
+    kb_sync_interval: float = Field(
+        60.0,
+        validation_alias="KB_SYNC_INTERVAL",
+        description="Celery beat 触发知识库增量同步的间隔（秒），0 表示不调度",
+    )
+    kb_sync_settle_seconds: float = Field(
+        5.0,
+        validation_alias="KB_SYNC_SETTLE_SECONDS",
+        description="只同步 updated_at 早于当前时间该秒数的行，避免漏掉提交较晚的事务",
+    )
+    kb_sync_lag_warning: float = Field(600.0, validation_alias="KB_SYNC_LAG_WARNING")
 
     # 模型 & 推理配置
     dashscope_api_key: str = Field("", validation_alias="DASHSCOPE_API_KEY")
@@ -53,6 +109,38 @@ class Settings(BaseSettings):
         "qwen3-30b-a3b-instruct-2507",
         validation_alias="DASHSCOPE_MOE_MODEL",
     )
+    embedding_batch_size: int = Field(
+        10,
+        validation_alias="EMBEDDING_BATCH_SIZE",
+    )
+    embedding_batch_max_tokens: int = Field(
+        20000,
+        validation_alias="EMBEDDING_BATCH_MAX_TOKENS",
+    )
+    embedding_max_retries: int = Field(
+        3,
+        validation_alias="EMBEDDING_MAX_RETRIES",
+    )
+    embedding_retry_backoff: float = Field(
+        1.0,
+        validation_alias="EMBEDDING_RETRY_BACKOFF",
+    )
+    llm_max_concurrency: int = Field(
+        8,
+        validation_alias="LLM_MAX_CONCURRENCY",
+    )
+    llm_request_timeout: float = Field(
+        60.0,
+        validation_alias="LLM_REQUEST_TIMEOUT",
+    )
+    llm_retry_budget: int = Field(
+        6,
+        validation_alias="LLM_RETRY_BUDGET",
+    )
+    llm_retry_backoff: float = Field(
+        1.0,
+        validation_alias="LLM_RETRY_BACKOFF",
+    )
     bert_model_name: str = Field(
         "hfl/chinese-bert-wwm-ext",
         validation_alias="BERT_MODEL_NAME",
@@ -61,11 +149,122 @@ class Settings(BaseSettings):
         360,
         validation_alias="BERT_MAX_CHUNK_TOKENS",
     )
+    bert_chunk_stride: int = Field(
+        0,
+        validation_alias="BERT_CHUNK_STRIDE",
+    )
+    bert_batch_size: int = Field(
+        16,
+        validation_alias="BERT_BATCH_SIZE",
+    )
+    bert_inference_profile: str = Field(
+        "fp32",
+        validation_alias="BERT_INFERENCE_PROFILE",
+        description="fp32 / int8；int8 启用动态量化、inference_mode 与按进程划分线程",
+    )
+    torch_num_threads: int = Field(
+        0,
+        validation_alias="TORCH_NUM_THREADS",
+        description="0 表示按 CPU 核数 / worker 并发数自动计算",
+    )
     risk_model_path: str = Field(
         "models/risk_classifier.json",
         validation_alias="RISK_MODEL_PATH",
     )
 
+    # 文档上传
+    upload_max_bytes: int = Field(20 * 1024 * 1024, validation_alias="UPLOAD_MAX_BYTES")
+    upload_spool_dir: str = Field("cache/uploads", validation_alias="UPLOAD_SPOOL_DIR")
+    ingestion_workers: int = Field(
+        2,
+        validation_alias="INGESTION_WORKERS",
+        description="文本抽取进程数，0 表示在线程池中抽取",
+    )
+    ingestion_timeout: float = Field(60.0, validation_alias="INGESTION_TIMEOUT")
+
+    # 隐私政策抓取
+    fetch_cache_dir: str = Field("cache/policy_pages", validation_alias="FETCH_CACHE_DIR")
+    fetch_timeout: float = Field(20.0, validation_alias="FETCH_TIMEOUT")
+    fetch_max_connections: int = Field(50, validation_alias="FETCH_MAX_CONNECTIONS")
+    fetch_per_host_limit: int = Field(
+        4,
+        validation_alias="FETCH_PER_HOST_LIMIT",
+        description="同一站点的并发请求上限",
+    )
+    fetch_user_agent: str = Field("PPNA-PolicyFetcher/1.0", validation_alias="FETCH_USER_AGENT")
+    fetch_max_redirects: int = Field(5, validation_alias="FETCH_MAX_REDIRECTS")
+    fetch_allow_private_hosts: bool = Field(
+        False,
+        validation_alias="FETCH_ALLOW_PRIVATE_HOSTS",
+        description="允许抓取内网、回环等非公网地址，仅用于本地开发与测试",
+    )
+
+    # 任务进度
+    progress_backend: str = Field(
+        "redis",
+        validation_alias="PROGRESS_BACKEND",
+        description="redis 或 memory（仅单进程开发时使用）",
+    )
+    progress_redis_url: str = Field(
+        "redis://localhost:6379/2", validation_alias="PROGRESS_REDIS_URL"
+    )
+    progress_ttl: int = Field(24 * 3600, validation_alias="PROGRESS_TTL")
+    progress_event_poll_interval: float = Field(
+        1.0, validation_alias="PROGRESS_EVENT_POLL_INTERVAL"
+    )
+    progress_event_keepalive: float = Field(
+        15.0,
+        validation_alias="PROGRESS_EVENT_KEEPALIVE",
+        description="SSE 连接空闲时发送心跳注释的间隔（秒）",
+    )
+
+    # 缓存配置
+    cache_redis_url: str = Field("redis://localhost:6379/2", validation_alias="CACHE_REDIS_URL")
+    embedding_cache_backend: str = Field(
+        "sqlite",
+        validation_alias="EMBEDDING_CACHE_BACKEND",
+        description="redis / sqlite / none",
+    )
+    embedding_cache_sqlite_path: str = Field(
+        "cache/embeddings.sqlite3",
+        validation_alias="EMBEDDING_CACHE_SQLITE_PATH",
+    )
+    embedding_cache_memory_bytes: int = Field(
+        64 * 1024 * 1024,
+        validation_alias="EMBEDDING_CACHE_MEMORY_BYTES",
+    )
+    embedding_cache_max_entries: int = Field(
+        1000000,
+        validation_alias="EMBEDDING_CACHE_MAX_ENTRIES",
+        description="SQLite 持久层最多保留的向量条数，0 表示不限制",
+    )
+    embedding_cache_ttl: int = Field(
+        30 * 24 * 3600,
+        validation_alias="EMBEDDING_CACHE_TTL",
+        description="向量缓存过期时间（秒），0 表示不过期；Redis 与 SQLite 持久层均生效",
+    )
+    generation_cache_backend: str = Field(
+        "sqlite",
+        validation_alias="GENERATION_CACHE_BACKEND",
+        description="redis / sqlite / none",
+    )
+    generation_cache_sqlite_path: str = Field(
+        "cache/generations.sqlite3",
+        validation_alias="GENERATION_CACHE_SQLITE_PATH",
+    )
+    generation_cache_memory_bytes: int = Field(
+        16 * 1024 * 1024,
+        validation_alias="GENERATION_CACHE_MEMORY_BYTES",
+    )
+    generation_cache_max_entries: int = Field(
+        50000,
+        validation_alias="GENERATION_CACHE_MAX_ENTRIES",
+    )
+    generation_cache_ttl: int = Field(
+        7 * 24 * 3600,
+        validation_alias="GENERATION_CACHE_TTL",
+    )
+
     @property
     def sqlalchemy_database_uri(self) -> str:
         return (
@@ -0,0 +1,62 @@
+"""
+轻量的表结构升级：建出缺失的表，为已有表补齐新增的可空列和索引，
+并把历史报告的风险明细回填到 risk_details 表。
+运行方式：
+    python -m app.db.migrations
+"""
+
+import logging
+
+from sqlalchemy import inspect
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateIndex
+
+from app import models
+from app.services.risk_store import backfill_risk_details
+
+logger = logging.getLogger(__name__)
+
+
+def upgrade(engine: Engine) -> None:
+    models.Base.metadata.create_all(engine)
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in models.Base.metadata.sorted_tables:
+            existing = {column["name"]: column for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    # 模型中改为可空的列同步放开约束（SQLite 不支持修改列，跳过）
+                    if (
+                        column.nullable
+                        and not existing[column.name]["nullable"]
+                        and engine.dialect.name == "postgresql"
+                    ):
+                        conn.exec_driver_sql(
+                            f"ALTER TABLE {table.name} ALTER COLUMN {column.name} DROP NOT NULL"
+                        )
+                        logger.info("表 %s 的列 %s 改为可空", table.name, column.name)
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.exec_driver_sql(
+                    f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"
+                )
+                logger.info("表 %s 新增列 %s", table.name, column.name)
+
+            indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indexes:
+                    conn.execute(CreateIndex(index))
+                    logger.info("表 %s 新增索引 %s", table.name, index.name)
+
+    with Session(engine) as session:
+        backfill_risk_details(session)
+
+
+if __name__ == "__main__":
+    from app.config.logging_config import setup_logging
+    from app.db.session import engine
+
+    setup_logging()
+    upgrade(engine)
+    print("数据库结构已是最新。")
@@ -11,6 +11,9 @@ engine = create_engine(
     settings.sqlalchemy_database_uri,
     future=True,
     pool_pre_ping=True,
+    pool_size=settings.db_pool_size,
+    max_overflow=settings.db_max_overflow,
+    pool_timeout=settings.db_pool_timeout,
 )
 
 SessionLocal = sessionmaker(
@@ -30,6 +33,11 @@ def get_db():
         db.close()
 
 
+def get_session_factory() -> sessionmaker:
+    """供长连接接口按需开启短会话，不在整个请求期间占用连接池中的连接。"""
+    return SessionLocal
+
+
 @contextmanager
 def db_session() -> Session:
     session = SessionLocal()
@@ -1,10 +1,13 @@
+import uuid
 from datetime import datetime
 from typing import Optional
 
 from sqlalchemy import (
+    Boolean,
     Column,
     DateTime,
     ForeignKey,
+    Index,
     Integer,
     String,
     Text,
@@ -32,13 +35,23 @@ class Report(Base):
     __tablename__ = "reports"
 
     report_id = Column(String(255), primary_key=True, index=True)
-    detection_time = Column(DateTime, nullable=False, default=datetime.utcnow)
+    detection_time = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
+    app_name = Column(String(255), nullable=True, index=True)
     basic_info = Column(JSONBCompat, nullable=False)
     statistics = Column(JSONBCompat, nullable=False)
-    risk_details_json = Column(JSONBCompat, nullable=False)
+    # 旧版本整体存放的风险列表，现由 risk_details 表承载，仅为兼容历史数据保留
+    risk_details_json = Column(JSONBCompat, nullable=True)
     operation_logs_json = Column(JSONBCompat, nullable=False)
+    # 增量检测时相对基准报告的变化摘要，全量检测为空
+    delta_json = Column(JSONBCompat, nullable=True)
 
-    task = relationship("DetectionTask", back_populates="report", uselist=False)
+    # 内容相同的重复提交会复用同一份报告，因此一份报告可对应多个任务
+    tasks = relationship("DetectionTask", back_populates="report")
+    risks = relationship(
+        "RiskDetailRecord",
+        back_populates="report",
+        order_by="RiskDetailRecord.position",
+    )
 
 
 class DetectionTask(Base):
@@ -49,8 +62,81 @@ class DetectionTask(Base):
     status = Column(String(50), nullable=False, default="pending")
     progress = Column(Integer, nullable=False, default=0)
     report_id = Column(String(255), ForeignKey("reports.report_id"), nullable=True)
-
-    report = relationship("Report", back_populates="task")
+    app_name = Column(String(255), nullable=True)
+    content_hash = Column(String(64), nullable=True, index=True)
+    pipeline_version = Column(String(64), nullable=True)
+    source_task_id = Column(String(255), nullable=True, index=True)
+    # 仅原始任务保存提交的正文，供后续增量检测比对；引用上传文档时正文见 document
+    policy_text = Column(Text, nullable=True)
+    document_id = Column(String(36), ForeignKey("policy_documents.document_id"), nullable=True)
+
+    report = relationship("Report", back_populates="tasks")
+    document = relationship("PolicyDocument")
+
+
+class RiskDetailRecord(Base):
+    __tablename__ = "risk_details"
+    __table_args__ = (
+        Index("ix_risk_details_report_position", "report_id", "position"),
+        Index("ix_risk_details_level_category", "level", "category"),
+    )
+
+    detail_id = Column(String(36), primary_key=True)
+    report_id = Column(String(255), ForeignKey("reports.report_id"), nullable=False)
+    position = Column(Integer, nullable=False)
+    risk_id = Column(String(255), nullable=False)
+    category = Column(String(50), nullable=False)
+    level = Column(String(20), nullable=False)
+    policy_fragment = Column(Text, nullable=False)
+    start_index = Column(Integer, nullable=False)
+    end_index = Column(Integer, nullable=False)
+    risk_description = Column(Text, nullable=False)
+    rectification_suggestion = Column(Text, nullable=False)
+    handling_status = Column(String(20), nullable=False, default="untreated")
+
+    report = relationship("Report", back_populates="risks")
+    regulations = relationship("RiskRegulation", order_by="RiskRegulation.position")
+    cases = relationship("RiskCase", order_by="RiskCase.position")
+
+
+class RiskRegulation(Base):
+    __tablename__ = "risk_regulations"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    detail_id = Column(String(36), ForeignKey("risk_details.detail_id"), nullable=False, index=True)
+    position = Column(Integer, nullable=False)
+    kb_id = Column(String(255), nullable=False, index=True)
+    title = Column(String(255), nullable=False)
+    excerpt = Column(Text, nullable=False)
+
+
+class RiskCase(Base):
+    __tablename__ = "risk_cases"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    detail_id = Column(String(36), ForeignKey("risk_details.detail_id"), nullable=False, index=True)
+    position = Column(Integer, nullable=False)
+    kb_id = Column(String(255), nullable=False, index=True)
+    title = Column(String(255), nullable=False)
+    penalty = Column(Text, nullable=False)
+
+
+class PolicyDocument(Base):
+    """上传文件抽取出的正文，提交检测任务时通过 document_id 引用。"""
+
+    __tablename__ = "policy_documents"
+
+    document_id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    filename = Column(String(255), nullable=False)
+    content_type = Column(String(255), nullable=True)
+    format = Column(String(20), nullable=False)
+    encoding = Column(String(50), nullable=True)
+    page_count = Column(Integer, nullable=True)
+    size_bytes = Column(Integer, nullable=False)
+    char_count = Column(Integer, nullable=False)
+    content_hash = Column(String(64), nullable=False, index=True)
+    text = Column(Text, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
 
 
 class KnowledgeBaseItem(Base):
@@ -60,9 +146,38 @@ class KnowledgeBaseItem(Base):
     kb_type = Column(String(50), nullable=False)
     milvus_vector_id = Column(String(255), nullable=False)
     content_text = Column(Text, nullable=False)
+    # 软删除：置为 False 并刷新 updated_at，增量同步据此删除对应向量；旧数据为 NULL 视为有效
+    is_active = Column(Boolean, nullable=True, default=True)
     created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
-    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
+    # 批量加载器写入（或删除）向量后置为本次的 updated_at；两者相等说明向量已是最新，增量同步不再重复嵌入
+    vectors_synced_at = Column(DateTime, nullable=True)
 
     def update_timestamp(self) -> None:
         self.updated_at = datetime.utcnow()
 
+    def deactivate(self) -> None:
+        self.is_active = False
+        self.update_timestamp()
+
+
+class SubmissionLock(Base):
+    """串行化同内容重复提交的锁行，键为 (应用, 内容哈希, 流程版本) 的哈希。"""
+
+    __tablename__ = "submission_locks"
+
+    lock_key = Column(String(64), primary_key=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
+class SyncState(Base):
+    """增量同步的高水位线：已同步到 (watermark, last_key) 为止的行。"""
+
+    __tablename__ = "sync_state"
+
+    name = Column(String(64), primary_key=True)
+    watermark = Column(DateTime, nullable=True)
+    last_key = Column(String(255), nullable=True)
+    last_run_at = Column(DateTime, nullable=True)
+    last_synced = Column(Integer, nullable=False, default=0)
+
@@ -1,52 +1,254 @@
-from typing import Annotated
+import json
+import time
+from datetime import datetime
+from typing import Annotated, AsyncIterator, Literal, Optional
 
-from fastapi import APIRouter, Depends, File, HTTPException, UploadFile
+from fastapi import (
+    APIRouter,
+    Depends,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+)
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+
+from app.config.settings import get_settings
 
-from app.db.session import get_db
+from app.db.session import get_db, get_session_factory
 from app.schemas import (
+    DocumentUploadResponse,
+    RiskListResponse,
     TaskResultResponse,
     TaskStatusResponse,
     TaskSubmissionRequest,
     TaskSubmissionResponse,
 )
 from app.services.detection import DetectionService
+from app.services.fetcher import FetchError, get_policy_fetcher
+from app.services.ingestion import (
+    ExtractionError,
+    UploadTooLarge,
+    extract_in_pool,
+    save_document,
+    spool_multipart,
+)
+from app.services.progress import TERMINAL_STATUSES, etag_for, get_progress_store, read_status
+from app.services.risk_store import RiskStore
 from app.tasks.detection_task import detect_policy_task
 
 router = APIRouter(prefix="/detection", tags=["detection"])
 
+# 访问数据库的接口使用同步 def：FastAPI 会把它们放到线程池执行，
+# 同步 Session 的查询不会阻塞事件循环。线程池与连接池大小见 main.py。
+
 
 def get_service(db=Depends(get_db)) -> DetectionService:
     return DetectionService(db)
 
 
-@router.post("/upload")
-async def upload_policy(file: UploadFile = File(...)) -> dict:
-    contents = await file.read()
-    text = contents.decode("utf-8", errors="ignore")
-    if not text:
+def _reject_oversized_upload(request: Request) -> None:
+    # 声明了 Content-Length 的超大请求在读取请求体之前直接拒绝，其余情况在读取时按字节计数
+    limit = get_settings().upload_max_bytes
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > limit + 64 * 1024:
+        raise HTTPException(status_code=413, detail="上传文件过大")
+
+
+UPLOAD_REQUEST_BODY = {
+    "required": True,
+    "content": {
+        "multipart/form-data": {
+            "schema": {
+                "type": "object",
+                "properties": {"file": {"type": "string", "format": "binary"}},
+                "required": ["file"],
+            }
+        }
+    },
+}
+
+
+@router.post(
+    "/upload",
+    response_model=DocumentUploadResponse,
+    dependencies=[Depends(_reject_oversized_upload)],
+    openapi_extra={"requestBody": UPLOAD_REQUEST_BODY},
+)
+async def upload_policy(request: Request, db=Depends(get_db)) -> DocumentUploadResponse:
+    """上传 PDF/HTML/TXT：边接收边解析 multipart 并落盘，在进程池中抽取正文并保存，
+    返回可用于提交任务的 document_id。
+
+    不经过 FastAPI 的表单解析：文件只写一次磁盘，且请求体按实际字节数限制大小。
+    """
+    settings = get_settings()
+    try:
+        upload = await spool_multipart(
+            request.stream(), request.headers.get("content-type", ""), settings.upload_max_bytes
+        )
+    except UploadTooLarge as exc:
+        raise HTTPException(status_code=413, detail=str(exc))
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    try:
+        document = await extract_in_pool(upload.path, upload.filename, upload.content_type)
+    except ExtractionError as exc:
+        raise HTTPException(status_code=422, detail=str(exc))
+    finally:
+        upload.path.unlink(missing_ok=True)
+    if not document.text:
         raise HTTPException(status_code=400, detail="文件内容为空")
-    return {"filename": file.filename, "text_preview": text[:2000]}
+    record = await run_in_threadpool(
+        save_document, db, document, upload.filename or "upload", upload.content_type, upload.size
+    )
+    return DocumentUploadResponse(
+        document_id=record.document_id,
+        filename=record.filename,
+        format=record.format,  # type: ignore[arg-type]
+        encoding=record.encoding,
+        page_count=record.page_count,
+        char_count=record.char_count,
+        text_preview=record.text[:2000],
+    )
+
+
+async def fetch_policy_text(payload: TaskSubmissionRequest) -> TaskSubmissionRequest:
+    """只提供 policy_url 时先抓取页面正文，提交与去重都基于抓取到的文本。"""
+    if not payload.policy_text and not payload.document_id and payload.policy_url:
+        try:
+            fetched = await get_policy_fetcher().fetch(payload.policy_url)
+        except FetchError as exc:
+            raise HTTPException(status_code=502, detail=str(exc))
+        except ExtractionError as exc:
+            raise HTTPException(status_code=422, detail=str(exc))
+        if not fetched.text:
+            raise HTTPException(status_code=422, detail="抓取到的页面没有正文")
+        payload.policy_text = fetched.text
+    return payload
 
 
 @router.post("/tasks", response_model=TaskSubmissionResponse)
-async def create_detection_task(
-    payload: TaskSubmissionRequest,
+def create_detection_task(
+    payload: TaskSubmissionRequest = Depends(fetch_policy_text),
     service: DetectionService = Depends(get_service),
 ) -> TaskSubmissionResponse:
-    if not payload.policy_text and payload.policy_url:
-        payload.policy_text = f"模拟从 {payload.policy_url} 抓取的文本..."
-    response = service.submit_task(payload)
-    detect_policy_task.delay(
-        task_id=response.task_id,
-        app_name=payload.app_name,
-        policy_text=payload.policy_text or "",
-    )
+    try:
+        response = service.submit_task(payload)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    # 复用了同内容的已有任务时无需重复入队
+    if response.reused_task_id is None:
+        detect_policy_task.delay(
+            task_id=response.task_id,
+            app_name=payload.app_name,
+            policy_text=payload.policy_text or "",
+            force_regenerate=payload.force_regenerate,
+            incremental=payload.incremental,
+            document_id=payload.document_id,
+        )
     return response
 
 
+@router.get("/tasks/{task_id}/status", response_model=TaskStatusResponse)
+def get_detection_task_status(
+    task_id: str,
+    if_none_match: Optional[str] = Header(None),
+    db=Depends(get_db),
+) -> Response:
+    """轻量状态轮询：命中进度快照时只读一次 Redis，不访问数据库；内容未变时返回 304。"""
+    raw = read_status(db, task_id)
+    if raw is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    headers = {"ETag": etag_for(raw), "Cache-Control": "no-cache"}
+    if if_none_match == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    body = TaskStatusResponse.model_validate_json(raw).model_dump_json()
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@router.get("/tasks/{task_id}/events")
+async def stream_detection_task_events(
+    task_id: str, session_factory=Depends(get_session_factory)
+) -> StreamingResponse:
+    """SSE 推送任务进度（progress 事件）与生成阶段陆续产出的风险（risk 事件），
+    任务完成或失败后发送 end 事件并关闭连接。风险编号在增量检测时以最终报告为准。
+
+    推送可能持续整个检测过程，只在读取状态时开启短会话，读完立即归还连接。
+    """
+    settings = get_settings()
+
+    def read_snapshot(snapshot_task_id: str) -> Optional[bytes]:
+        with session_factory() as db:
+            return read_status(db, snapshot_task_id)
+
+    raw = await run_in_threadpool(read_snapshot, task_id)
+    if raw is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    snapshot = json.loads(raw)
+    # 重复提交在结束前订阅源任务的事件
+    channel_task_id = task_id
+    if snapshot["status"] not in TERMINAL_STATUSES and snapshot.get("source_task_id"):
+        channel_task_id = snapshot["source_task_id"]
+
+    async def event_stream() -> AsyncIterator[str]:
+        events = get_progress_store().events(
+            channel_task_id, settings.progress_event_poll_interval
+        )
+        try:
+            # 先完成订阅再读取快照，避免两者之间的事件丢失
+            await events.__anext__()
+            current = await run_in_threadpool(get_progress_store().get_raw, channel_task_id)
+            if current is None:
+                # 快照已过期时从 detection_tasks 回填
+                current = await run_in_threadpool(read_snapshot, channel_task_id)
+            payload = {**json.loads(current or raw), "task_id": task_id}
+            yield _sse("progress", payload)
+            if payload["status"] in TERMINAL_STATUSES:
+                yield _sse("end", {"status": payload["status"]})
+                return
+            last_sent = time.monotonic()
+            async for message in events:
+                if message is None:
+                    if time.monotonic() - last_sent >= settings.progress_event_keepalive:
+                        last_sent = time.monotonic()
+                        yield ": keepalive\n\n"
+                    continue
+                data = message["data"]
+                if message["event"] == "progress":
+                    data = {**data, "task_id": task_id}
+                yield _sse(message["event"], data)
+                last_sent = time.monotonic()
+                if message["event"] == "progress" and data["status"] in TERMINAL_STATUSES:
+                    yield _sse("end", {"status": data["status"]})
+                    return
+        finally:
+            await events.aclose()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.get("/tasks/{task_id}", response_model=TaskResultResponse)
-async def get_detection_task(task_id: str, service: DetectionService = Depends(get_service)):
-    result = service.get_task_result(task_id)
+def get_detection_task(
+    task_id: str,
+    level: Optional[Literal["high", "medium", "low"]] = None,
+    category: Optional[str] = None,
+    page: int = Query(1, ge=1),
+    page_size: Optional[int] = Query(None, ge=1, le=200, description="不传则返回全部风险项"),
+    service: DetectionService = Depends(get_service),
+):
+    result = service.get_task_result(
+        task_id, level=level, category=category, page=page, page_size=page_size
+    )
     if not result:
         raise HTTPException(status_code=404, detail="任务不存在")
     if result.status == "completed":
@@ -61,3 +263,27 @@ async def get_detection_task(task_id: str, service: DetectionService = Depends(g
         report=None,
     )
 
+
+@router.get("/risks", response_model=RiskListResponse)
+def list_risks(
+    level: Optional[Literal["high", "medium", "low"]] = None,
+    category: Optional[str] = None,
+    kb_id: Optional[str] = Query(None, description="引用了该法规或案例的风险"),
+    app_name: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    page: int = Query(1, ge=1),
+    page_size: int = Query(50, ge=1, le=200),
+    db=Depends(get_db),
+) -> RiskListResponse:
+    total, items = RiskStore(db).search(
+        level=level,
+        category=category,
+        kb_id=kb_id,
+        app_name=app_name,
+        since=since,
+        until=until,
+        offset=(page - 1) * page_size,
+        limit=page_size,
+    )
+    return RiskListResponse(total=total, page=page, page_size=page_size, items=items)
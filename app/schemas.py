@@ -29,21 +29,41 @@ class TaskSubmissionRequest(BaseModel):
     app_name: str
     policy_text: Optional[str] = None
     policy_url: Optional[str] = None
+    document_id: Optional[str] = Field(None, description="POST /detection/upload 返回的文档 ID")
+    force_regenerate: bool = Field(False, description="跳过生成缓存，强制重新调用大模型")
+    force: bool = Field(False, description="忽略已有的同内容任务与报告，强制重新检测")
+    incremental: bool = Field(
+        False, description="与该应用上一份报告比对，只重新检测新增或修改的段落"
+    )
 
     def validate_payload(self) -> None:
-        if not self.policy_text and not self.policy_url:
-            raise ValueError("policy_text 和 policy_url 至少提供一个。")
+        if not self.policy_text and not self.policy_url and not self.document_id:
+            raise ValueError("policy_text、policy_url 和 document_id 至少提供一个。")
+
+
+class DocumentUploadResponse(BaseModel):
+    document_id: str
+    filename: str
+    format: Literal["pdf", "html", "txt"]
+    encoding: Optional[str]
+    page_count: Optional[int]
+    char_count: int
+    text_preview: str
 
 
 class TaskSubmissionResponse(BaseModel):
     task_id: str
     status: str = "pending"
+    reused_task_id: Optional[str] = Field(
+        None, description="内容相同的已完成或进行中任务，非空时本次提交不会重新检测"
+    )
 
 
 class TaskStatusResponse(BaseModel):
     task_id: str
     status: Literal["pending", "processing", "completed", "failed"]
     progress: int = Field(0, ge=0, le=100)
+    stage: Optional[str] = None
 
 
 class FragmentPosition(BaseModel):
@@ -98,17 +118,42 @@ class OperationLog(BaseModel):
     action: str
 
 
+class ReportDelta(BaseModel):
+    base_report_id: str
+    added_risk_ids: List[str]
+    removed_risk_ids: List[str] = Field(description="基准报告中不再出现的风险编号")
+    unchanged_risk_ids: List[str]
+    reprocessed_chars: int = Field(description="重新检测的正文字符数")
+
+
 class ReportPayload(BaseModel):
     report_id: str
     basic_info: BasicInfo
     statistics: Statistics
     risk_details: List[RiskDetail]
     operation_logs: List[OperationLog]
+    delta: Optional[ReportDelta] = None
+    risk_detail_total: Optional[int] = Field(
+        None, description="按等级/类别筛选或分页时，符合条件的风险总数"
+    )
+
+
+class RiskListItem(RiskDetail):
+    report_id: str
+    app_name: Optional[str]
+    detection_time: datetime
+
+
+class RiskListResponse(BaseModel):
+    total: int
+    page: int
+    page_size: int
+    items: List[RiskListItem]
 
 
 class TaskResultResponse(BaseModel):
     task_id: str
-    status: Literal["completed", "failed"]
+    status: Literal["pending", "processing", "completed", "failed"]
     progress: int
     report: Optional[ReportPayload]
 
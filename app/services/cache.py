@@ -0,0 +1,340 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+import unicodedata
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+from threading import Lock
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.config.settings import get_settings
+
+try:
+    import redis
+
+    HAS_REDIS = True
+except Exception:  # pragma: no cover
+    redis = None
+    HAS_REDIS = False
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text: str) -> str:
+    """NFKC 归一化并压缩空白，使排版不同但内容相同的文本得到同一个键。"""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class LRUCache:
+    """进程内 LRU，按 value 的字节数之和淘汰，可为单个条目设置过期时间。"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._data: "OrderedDict[str, Tuple[bytes, Optional[float]]]" = OrderedDict()
+        self._size = 0
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._data[key]
+                self._size -= len(value)
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes, ttl: Optional[int] = None) -> None:
+        if len(value) > self.max_bytes:
+            return
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            previous = self._data.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous[0])
+            self._data[key] = (value, expires_at)
+            self._size += len(value)
+            while self._size > self.max_bytes:
+                _, (evicted, _) = self._data.popitem(last=False)
+                self._size -= len(evicted)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._size = 0
+
+    def incr(self, key: str, ttl: Optional[int] = None) -> int:
+        """把整数计数加一并返回新值，键不存在或已过期时从 0 开始。"""
+        with self._lock:
+            count = 0
+            previous = self._data.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous[0])
+                if previous[1] is None or previous[1] > time.time():
+                    count = int(previous[0])
+            count += 1
+            value = str(count).encode("ascii")
+            self._data[key] = (value, time.time() + ttl if ttl else None)
+            self._size += len(value)
+            while self._size > self.max_bytes:
+                _, (evicted, _) = self._data.popitem(last=False)
+                self._size -= len(evicted)
+        return count
+
+
+class RedisStore:
+    """基于 Redis 的共享存储，供所有 Celery worker 复用。
+
+    容量上限交给 Redis 的 maxmemory 策略（建议 volatile-lru / allkeys-lru）。
+    """
+
+    def __init__(self, url: str):
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            return self._client.get(key)
+        except redis.RedisError as exc:
+            logger.warning("读取 Redis 缓存失败：%s", exc)
+            return None
+
+    def set(self, key: str, value: bytes, ttl: Optional[int] = None) -> None:
+        try:
+            self._client.set(key, value, ex=ttl or None)
+        except redis.RedisError as exc:
+            logger.warning("写入 Redis 缓存失败：%s", exc)
+
+    def incr(self, key: str, ttl: Optional[int] = None) -> Optional[int]:
+        """原子计数，多个 worker 并发加一互不覆盖；Redis 不可用时返回 None。"""
+        try:
+            pipe = self._client.pipeline()
+            pipe.incr(key)
+            if ttl:
+                pipe.expire(key, ttl)
+            return int(pipe.execute()[0])
+        except redis.RedisError as exc:
+            logger.warning("更新 Redis 计数失败：%s", exc)
+            return None
+
+
+class SQLiteStore:
+    """本地 SQLite 文件存储，WAL 模式下可被同机的多个进程共享。
+
+    设置 `max_entries` 后每写入一定次数会清理过期条目，并按写入时间淘汰最旧的条目。
+    """
+
+    PRUNE_INTERVAL = 256
+
+    def __init__(self, path: str, max_entries: Optional[int] = None):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self._writes = 0
+        self._lock = Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        # prefork 之后连接不能跨进程复用，按 pid 重新建立
+        if self._conn is None or self._pid != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(
+                str(self.path),
+                timeout=5,
+                isolation_level=None,
+                check_same_thread=False,
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, created_at REAL NOT NULL, "
+                "expires_at REAL)"
+            )
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(cache)")}
+            if "expires_at" not in columns:
+                conn.execute("ALTER TABLE cache ADD COLUMN expires_at REAL")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_cache_created_at ON cache (created_at)")
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            with self._lock:
+                row = self._connect().execute(
+                    "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+                ).fetchone()
+        except sqlite3.Error as exc:
+            logger.warning("读取 SQLite 缓存失败：%s", exc)
+            return None
+        if not row:
+            return None
+        value, expires_at = row
+        if expires_at is not None and expires_at <= time.time():
+            return None
+        return value
+
+    def set(self, key: str, value: bytes, ttl: Optional[int] = None) -> None:
+        now = time.time()
+        try:
+            with self._lock:
+                conn = self._connect()
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache (key, value, created_at, expires_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    (key, value, now, now + ttl if ttl else None),
+                )
+                self._writes += 1
+                if self.max_entries and self._writes % self.PRUNE_INTERVAL == 0:
+                    self._prune(conn, now)
+        except sqlite3.Error as exc:
+            logger.warning("写入 SQLite 缓存失败：%s", exc)
+
+    def _prune(self, conn: sqlite3.Connection, now: float) -> None:
+        conn.execute("DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+        conn.execute(
+            "DELETE FROM cache WHERE key IN ("
+            "SELECT key FROM cache ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+
+class TieredCache:
+    """先查进程内 LRU，再查持久化存储；持久层命中会回填内存。"""
+
+    def __init__(self, memory: LRUCache, store=None):
+        self.memory = memory
+        self.store = store
+        self._counters = {"memory_hits": 0, "store_hits": 0, "misses": 0}
+        self._lock = Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        value = self.memory.get(key)
+        if value is not None:
+            self._count("memory_hits")
+            return value
+        if self.store is not None:
+            value = self.store.get(key)
+            if value is not None:
+                self._count("store_hits")
+                self.memory.set(key, value)
+                return value
+        self._count("misses")
+        return None
+
+    def set(self, key: str, value: bytes, ttl: Optional[int] = None) -> None:
+        self.memory.set(key, value, ttl)
+        if self.store is not None:
+            self.store.set(key, value, ttl)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self._counters)
+        stats["hits"] = stats["memory_hits"] + stats["store_hits"]
+        stats["memory_entries"] = len(self.memory)
+        return stats
+
+    def _count(self, name: str) -> None:
+        # 多个线程共用一个缓存实例，+= 不是原子操作
+        with self._lock:
+            self._counters[name] += 1
+
+
+class EmbeddingCache:
+    """以 (模型名, 归一化文本 sha256) 为键的向量缓存，向量以 float32 存储。"""
+
+    def __init__(self, cache: TieredCache, ttl: Optional[int] = None):
+        self.cache = cache
+        self.ttl = ttl
+
+    @staticmethod
+    def make_key(model: str, text: str) -> str:
+        return f"ppna:emb:{model}:{content_hash(text)}"
+
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        value = self.cache.get(self.make_key(model, text))
+        if value is None:
+            return None
+        return np.frombuffer(value, dtype=np.float32).tolist()
+
+    def set(self, model: str, text: str, vector: Sequence[float]) -> None:
+        payload = np.asarray(vector, dtype=np.float32).tobytes()
+        self.cache.set(self.make_key(model, text), payload, self.ttl)
+
+    def stats(self) -> Dict[str, int]:
+        return self.cache.stats()
+
+
+class GenerationCache:
+    """以 (模型, system prompt, prompt, temperature) 的哈希为键缓存 LLM 输出。"""
+
+    def __init__(self, cache: TieredCache, ttl: Optional[int] = None):
+        self.cache = cache
+        self.ttl = ttl
+
+    @staticmethod
+    def make_key(model: str, system_prompt: str, prompt: str, temperature: float) -> str:
+        fingerprint = json.dumps([model, system_prompt, prompt, temperature], ensure_ascii=False)
+        return f"ppna:gen:{hashlib.sha256(fingerprint.encode('utf-8')).hexdigest()}"
+
+    def get(self, model: str, system_prompt: str, prompt: str, temperature: float) -> Optional[str]:
+        value = self.cache.get(self.make_key(model, system_prompt, prompt, temperature))
+        return value.decode("utf-8") if value is not None else None
+
+    def set(self, model: str, system_prompt: str, prompt: str, temperature: float, text: str) -> None:
+        key = self.make_key(model, system_prompt, prompt, temperature)
+        self.cache.set(key, text.encode("utf-8"), self.ttl)
+
+    def stats(self) -> Dict[str, int]:
+        return self.cache.stats()
+
+
+def build_store(backend: str, sqlite_path: str, max_entries: Optional[int] = None):
+    settings = get_settings()
+    if backend == "redis":
+        if HAS_REDIS:
+            return RedisStore(settings.cache_redis_url)
+        logger.warning("未安装 redis，缓存退化为仅进程内 LRU。")
+        return None
+    if backend == "sqlite":
+        return SQLiteStore(sqlite_path, max_entries=max_entries)
+    return None
+
+
+@lru_cache
+def get_embedding_cache() -> EmbeddingCache:
+    settings = get_settings()
+    store = build_store(
+        settings.embedding_cache_backend,
+        settings.embedding_cache_sqlite_path,
+        max_entries=settings.embedding_cache_max_entries,
+    )
+    memory = LRUCache(settings.embedding_cache_memory_bytes)
+    return EmbeddingCache(TieredCache(memory, store), ttl=settings.embedding_cache_ttl)
+
+
+@lru_cache
+def get_generation_cache() -> GenerationCache:
+    settings = get_settings()
+    store = build_store(
+        settings.generation_cache_backend,
+        settings.generation_cache_sqlite_path,
+        max_entries=settings.generation_cache_max_entries,
+    )
+    memory = LRUCache(settings.generation_cache_memory_bytes)
+    return GenerationCache(TieredCache(memory, store), ttl=settings.generation_cache_ttl)
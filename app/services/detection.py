@@ -1,18 +1,27 @@
+import bisect
+import difflib
+import json
 import logging
 import random
+import re
 import uuid
-from datetime import datetime
-from typing import Any, Dict, List, Optional
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Set, Tuple
 
+import numpy as np
+from sqlalchemy import delete, func, or_, select
 from sqlalchemy.orm import Session
 
 from app import models
+from app.config.settings import get_settings
 from app.schemas import (
     BasicInfo,
     CaseItem,
     FragmentPosition,
     OperationLog,
     RegulationItem,
+    ReportDelta,
     ReportPayload,
     RiskDetail,
     TaskResultResponse,
@@ -20,11 +29,56 @@ from app.schemas import (
     TaskSubmissionRequest,
     TaskSubmissionResponse,
 )
-from app.services.model_manager import ModelManager
+from app.services.cache import content_hash
+from app.services.model_manager import SENTENCE_DELIMITERS, ModelManager, TextSpan
+from app.services.progress import get_progress_store, read_status
 from app.services.rag_retriever import RagRetriever
+from app.services.risk_store import RiskStore
 
 logger = logging.getLogger(__name__)
 
+RISK_SCORE_THRESHOLD = 0.25
+# 检测流程逻辑变化时递增，使旧版本生成的报告不再被复用
+PIPELINE_REVISION = "1"
+IN_FLIGHT_STATUSES = ("pending", "processing")
+
+
+class ScoredSpan(NamedTuple):
+    """分类阶段筛出的候选片段，index 为片段在全文中的序号（从 1 开始）。"""
+
+    index: int
+    span: TextSpan
+    score: float
+
+
+class RetrievedContext(NamedTuple):
+    regulations: List[Dict[str, str]]
+    cases: List[Dict[str, str]]
+
+
+class IncrementalPlan(NamedTuple):
+    """增量检测计划：只有 spans 需要重新走模型流水线，reused 已平移到新正文中的位置。"""
+
+    base_report_id: str
+    spans: List[TextSpan]
+    reused: List[RiskDetail]
+    removed_risk_ids: List[str]
+    reprocessed_chars: int
+
+
+_SENTENCE_PATTERN = re.compile(f"[^{SENTENCE_DELIMITERS}\\n]+[{SENTENCE_DELIMITERS}]*")
+
+
+def _split_sentences(text: str) -> List[TextSpan]:
+    """按句末标点和换行切句，去掉首尾空白后保留原文位置。"""
+    sentences = []
+    for match in _SENTENCE_PATTERN.finditer(text):
+        stripped = match.group().strip()
+        if stripped:
+            start = match.start() + match.group().index(stripped)
+            sentences.append(TextSpan(stripped, start, start + len(stripped)))
+    return sentences
+
 
 class MilvusClientStub:
     """简化的 Milvus 客户端，用于本地模拟检索。"""
@@ -50,44 +104,200 @@ class DetectionService:
         self.rag_retriever = RagRetriever(db)
 
     def submit_task(self, payload: TaskSubmissionRequest) -> TaskSubmissionResponse:
+        """创建任务；同一应用提交相同内容时复用已有结果。
+
+        已有同内容、同流程版本的已完成报告时直接关联该报告；同内容任务仍在执行时
+        挂到该任务上，等它完成后一并更新，调用方据 `reused_task_id` 决定是否入队。
+        `force` 或 `force_regenerate` 为真时跳过复用。
+        """
         payload.validate_payload()
         task_id = str(uuid.uuid4())
+        document_id = payload.document_id if not payload.policy_text else None
+        policy_text = self.document_text(document_id) if document_id else payload.policy_text
+        digest = content_hash(policy_text or "")
+        version = self.pipeline_version()
+        source = None
+        lock_key = None
+        if not (payload.force or payload.force_regenerate):
+            lock_key = self._lock_submission(payload.app_name, digest, version)
+            source = self._find_reusable_task(payload.app_name, digest, version)
+
         task = models.DetectionTask(
             task_id=task_id,
             status="pending",
             progress=0,
+            app_name=payload.app_name,
+            content_hash=digest,
+            pipeline_version=version,
+            document_id=document_id,
         )
+        if source is not None:
+            task.source_task_id = source.task_id
+            task.status = source.status
+            task.progress = source.progress
+            task.report_id = source.report_id
+        elif not document_id:
+            task.policy_text = payload.policy_text
         self.db.add(task)
+        if lock_key is not None:
+            # 锁行随任务一起提交删除：排队的提交在此之后继续，已能看到本任务，无需保留锁行
+            table = models.SubmissionLock.__table__
+            self.db.execute(delete(table).where(table.c.lock_key == lock_key))
         self.db.commit()
-        logger.info("提交检测任务 task_id=%s", task_id)
-        return TaskSubmissionResponse(task_id=task_id)
+        self._publish_status(task)
+        if source is not None:
+            logger.info("提交检测任务 task_id=%s，复用任务 %s（%s）", task_id, source.task_id, source.status)
+        else:
+            logger.info("提交检测任务 task_id=%s", task_id)
+        return TaskSubmissionResponse(
+            task_id=task_id,
+            status=task.status,
+            reused_task_id=source.task_id if source is not None else None,
+        )
+
+    def document_text(self, document_id: str) -> str:
+        document = self.db.get(models.PolicyDocument, document_id)
+        if document is None:
+            raise ValueError(f"文档 {document_id} 不存在")
+        return document.text
+
+    def pipeline_version(self) -> str:
+        """模型配置、风险模型文件与知识库状态的指纹，任一变化都会使旧报告失效。"""
+        settings = get_settings()
+        kb = models.KnowledgeBaseItem
+        kb_updated_at, kb_count = self.db.query(func.max(kb.updated_at), func.count(kb.kb_id)).one()
+        risk_model = Path(settings.risk_model_path)
+        parts = [
+            PIPELINE_REVISION,
+            settings.bert_model_name,
+            settings.bert_max_chunk_tokens,
+            settings.bert_chunk_stride,
+            settings.bert_inference_profile,
+            settings.dashscope_embedding_model,
+            settings.dashscope_moe_model,
+            risk_model.stat().st_mtime if risk_model.exists() else None,
+            kb_updated_at,
+            kb_count,
+        ]
+        return content_hash(json.dumps(parts, default=str))[:16]
+
+    def _lock_submission(self, app_name: str, digest: str, version: str) -> str:
+        """在当前事务中锁住该内容对应的锁行，持锁到创建任务的事务提交为止，返回锁键。
+
+        同内容的并发提交在此排队，后到者能看到先到者创建的任务并挂到它上面，
+        避免两者都判定为新任务而重复入队。PostgreSQL 依赖 SELECT ... FOR UPDATE；
+        SQLite 忽略 FOR UPDATE，但写入锁行时取得的数据库写锁同样会让其他提交等待。
+        锁行由 submit_task 在同一事务中删除，表中只留有正在提交的内容。
+        """
+        table = models.SubmissionLock.__table__
+        key = content_hash(json.dumps([app_name, digest, version], ensure_ascii=False))
+        dialect = self.db.get_bind().dialect.name
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        elif dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert
+        else:  # pragma: no cover
+            self.db.merge(models.SubmissionLock(lock_key=key))
+            self.db.flush()
+            return key
+        self.db.execute(
+            insert(table)
+            .values(lock_key=key, created_at=datetime.utcnow())
+            .on_conflict_do_nothing(index_elements=[table.c.lock_key])
+        )
+        self.db.execute(select(table.c.lock_key).where(table.c.lock_key == key).with_for_update())
+        return key
+
+    def _find_reusable_task(
+        self, app_name: str, digest: str, version: str
+    ) -> Optional[models.DetectionTask]:
+        task = models.DetectionTask
+        candidates = self.db.query(task).filter(
+            task.app_name == app_name,
+            task.content_hash == digest,
+            task.pipeline_version == version,
+            task.source_task_id.is_(None),
+        )
+        completed = (
+            candidates.filter(task.status == "completed", task.report_id.isnot(None))
+            .order_by(task.submission_time.desc())
+            .first()
+        )
+        if completed is not None:
+            return completed
+        cutoff = datetime.utcnow() - timedelta(seconds=get_settings().dedup_inflight_ttl)
+        return (
+            candidates.filter(task.status.in_(IN_FLIGHT_STATUSES), task.submission_time >= cutoff)
+            .order_by(task.submission_time.desc())
+            .first()
+        )
+
+    def _sync_followers(self, task: models.DetectionTask) -> List[models.DetectionTask]:
+        """把任务的状态同步给挂在它上面、尚未结束的重复提交，返回被更新的任务。"""
+        followers = (
+            self.db.query(models.DetectionTask)
+            .filter(
+                models.DetectionTask.source_task_id == task.task_id,
+                models.DetectionTask.status.in_(IN_FLIGHT_STATUSES),
+            )
+            .all()
+        )
+        for follower in followers:
+            follower.status = task.status
+            follower.progress = task.progress
+            follower.report = task.report
+        return followers
+
+    def _publish_status(self, *tasks: models.DetectionTask) -> None:
+        store = get_progress_store()
+        for task in tasks:
+            store.publish(
+                task.task_id,
+                task.status,
+                task.progress,
+                stage="persisted" if task.status == "completed" else None,
+                source_task_id=task.source_task_id,
+            )
 
     def get_task_status(self, task_id: str) -> Optional[TaskStatusResponse]:
-        task = self.db.get(models.DetectionTask, task_id)
-        if not task:
+        """优先读取 worker 上报的进度快照，不加载报告。"""
+        raw = read_status(self.db, task_id)
+        if raw is None:
             return None
-        return TaskStatusResponse(
-            task_id=task.task_id,
-            status=task.status,  # type: ignore[arg-type]
-            progress=task.progress,
-        )
+        return TaskStatusResponse.model_validate_json(raw)
 
-    def get_task_result(self, task_id: str) -> Optional[TaskResultResponse]:
+    def get_task_result(
+        self,
+        task_id: str,
+        level: Optional[str] = None,
+        category: Optional[str] = None,
+        page: Optional[int] = None,
+        page_size: Optional[int] = None,
+    ) -> Optional[TaskResultResponse]:
+        """读取任务结果；给出筛选或分页参数时只返回对应的风险项，并附带符合条件的总数。"""
         task = self.db.get(models.DetectionTask, task_id)
         if not task:
             return None
         report_payload = None
         if task.report:
+            paged = page_size is not None
+            total, risk_details = RiskStore(self.db).page_for_report(
+                task.report.report_id,
+                level=level,
+                category=category,
+                offset=(max(page or 1, 1) - 1) * page_size if paged else 0,
+                limit=page_size,
+            )
             report_payload = ReportPayload(
                 report_id=task.report.report_id,
                 basic_info=BasicInfo(**task.report.basic_info),
                 statistics=task.report.statistics,
-                risk_details=[
-                    RiskDetail(**detail) for detail in task.report.risk_details_json
-                ],
+                risk_details=risk_details,
                 operation_logs=[
                     OperationLog(**log) for log in task.report.operation_logs_json
                 ],
+                delta=ReportDelta(**task.report.delta_json) if task.report.delta_json else None,
+                risk_detail_total=total if paged or level or category else None,
             )
         return TaskResultResponse(
             task_id=task.task_id,
@@ -104,81 +314,328 @@ class DetectionService:
         report_model = models.Report(
             report_id=report.report_id,
             detection_time=report.basic_info.detection_time,
-            basic_info=report.basic_info.dict(),
-            statistics=report.statistics.dict(),
-            risk_details_json=[detail.dict() for detail in report.risk_details],
-            operation_logs_json=[log.dict() for log in report.operation_logs],
+            basic_info=report.basic_info.model_dump(mode="json"),
+            app_name=report.basic_info.app_name,
+            statistics=report.statistics.model_dump(mode="json"),
+            operation_logs_json=[log.model_dump(mode="json") for log in report.operation_logs],
+            delta_json=report.delta.model_dump(mode="json") if report.delta else None,
         )
         self.db.add(report_model)
+        self.db.flush()
+        RiskStore(self.db).save(report.report_id, report.risk_details)
         task.report = report_model
         task.status = "completed"
         task.progress = 100
+        followers = self._sync_followers(task)
         self.db.commit()
+        self._publish_status(task, *followers)
         logger.info("任务 %s 已完成，报告 %s 已保存。", task_id, report.report_id)
 
-    # ---- 以下方法为 Celery 任务内部调用的模拟逻辑 ----
+    def mark_status(self, task_id: str, status: str) -> None:
+        task = self.db.get(models.DetectionTask, task_id)
+        if task:
+            task.status = status
+            followers = self._sync_followers(task)
+            self.db.commit()
+            self._publish_status(task, *followers)
 
-    # ---- 新检测逻辑 ----
+    # ---- 检测流水线各阶段 ----
+    # build_report 串行执行全部阶段；Celery 任务逐个调用以便按实际进度上报。
 
-    def build_report(self, task_id: str, app_name: str, policy_text: str) -> ReportPayload:
+    def build_report(
+        self,
+        task_id: str,
+        app_name: str,
+        policy_text: str,
+        force_regenerate: bool = False,
+        incremental: bool = False,
+    ) -> ReportPayload:
         detection_time = datetime.utcnow()
-        chunks = self.model_manager.segment_policy_text(policy_text)
-        if not chunks:
-            chunks = [policy_text[:500]]
-
-        risk_details: List[RiskDetail] = []
-        cursor = 0
-        for idx, chunk in enumerate(chunks, start=1):
-            classification = self.model_manager.classify_chunk(chunk)
-            if classification["score"] < 0.25:
+        text = self.preprocess(policy_text)
+        plan = self.plan_for(task_id, app_name, text) if incremental else None
+        candidates = self.classify(plan.spans if plan else self.segment(text))
+        contexts = self.retrieve(candidates)
+        generations = self.generate(app_name, candidates, contexts, force_regenerate=force_regenerate)
+        risk_details = self.aggregate(task_id, candidates, contexts, generations)
+        delta = None
+        if plan:
+            risk_details, delta = self.merge_incremental(task_id, plan, risk_details)
+        return self.assemble_report(task_id, app_name, text, risk_details, detection_time, delta=delta)
+
+    def preprocess(self, policy_text: str) -> str:
+        # 只去掉尾部空白，保证片段下标与提交的原文一致
+        return policy_text.rstrip()
+
+    def segment(self, policy_text: str) -> List[TextSpan]:
+        spans = self.model_manager.segment_policy_text(policy_text)
+        if not spans and policy_text:
+            spans = [TextSpan(policy_text[:500], 0, min(500, len(policy_text)))]
+        return spans
+
+    def classify(self, spans: List[TextSpan], first_index: int = 1) -> List[ScoredSpan]:
+        classifications = self.model_manager.classify_chunks([span.text for span in spans])
+        return [
+            ScoredSpan(index=idx, span=span, score=classification["score"])
+            for idx, (span, classification) in enumerate(zip(spans, classifications), start=first_index)
+            if classification["score"] >= RISK_SCORE_THRESHOLD
+        ]
+
+    # ---- 增量检测 ----
+
+    def plan_for(self, task_id: str, app_name: str, policy_text: str) -> Optional[IncrementalPlan]:
+        """找到该应用上一份保存了正文的报告并生成增量计划，没有时返回 None（走全量检测）。"""
+        task = models.DetectionTask
+        base = (
+            self.db.query(task)
+            .filter(
+                task.app_name == app_name,
+                task.task_id != task_id,
+                task.status == "completed",
+                task.source_task_id.is_(None),
+                or_(task.policy_text.isnot(None), task.document_id.isnot(None)),
+                task.report_id.isnot(None),
+            )
+            .order_by(task.submission_time.desc())
+            .first()
+        )
+        if base is None:
+            return None
+        previous = self.preprocess(base.policy_text or base.document.text)
+        base_risks = [
+            risk
+            for risk in RiskStore(self.db).load(base.report_id)
+            if not risk.risk_id.endswith("-fallback")
+        ]
+        return self.plan_incremental(previous, policy_text, base.report_id, base_risks)
+
+    def plan_incremental(
+        self,
+        previous_text: str,
+        policy_text: str,
+        base_report_id: str,
+        base_risks: List[RiskDetail],
+    ) -> IncrementalPlan:
+        """逐句比对新旧正文，平移未变化的风险，其余句子合并成区域后重新分块。
+
+        旧风险片段覆盖的句子全部原样出现在新正文中、且平移后的原文与片段完全一致时才复用；
+        否则该片段对应的句子一并标记为待检测，保证修改过的窗口整体重新分类。
+        """
+        old_sentences = _split_sentences(previous_text)
+        new_sentences = _split_sentences(policy_text)
+        matcher = difflib.SequenceMatcher(
+            None,
+            [sentence.text for sentence in old_sentences],
+            [sentence.text for sentence in new_sentences],
+            autojunk=False,
+        )
+        old_to_new: Dict[int, int] = {}
+        for tag, i1, i2, j1, _ in matcher.get_opcodes():
+            if tag == "equal":
+                old_to_new.update((i1 + offset, j1 + offset) for offset in range(i2 - i1))
+        dirty = set(range(len(new_sentences))) - set(old_to_new.values())
+
+        # 每个旧风险：平移后的位置及其覆盖的新句子序号，无法平移时为 None
+        old_ends = [sentence.end for sentence in old_sentences]
+        shifted: List[Optional[Tuple[int, int, Set[int]]]] = []
+        for risk in base_risks:
+            start, end = risk.fragment_position.start_index, risk.fragment_position.end_index
+            covered = []
+            i = bisect.bisect_right(old_ends, start)
+            while i < len(old_sentences) and old_sentences[i].start < end:
+                covered.append(i)
+                i += 1
+            mapped = [old_to_new.get(i) for i in covered]
+            if (
+                not covered
+                or None in mapped
+                or mapped != list(range(mapped[0], mapped[0] + len(mapped)))
+            ):
+                dirty.update(j for j in mapped if j is not None)
+                shifted.append(None)
                 continue
+            new_start = new_sentences[mapped[0]].start + start - old_sentences[covered[0]].start
+            new_end = new_sentences[mapped[-1]].start + end - old_sentences[covered[-1]].start
+            if policy_text[new_start:new_end] != risk.policy_fragment:
+                dirty.update(mapped)
+                shifted.append(None)
+                continue
+            shifted.append((new_start, new_end, set(mapped)))
 
-            start_index = policy_text.find(chunk, cursor)
-            if start_index == -1:
-                start_index = cursor
-            end_index = start_index + len(chunk)
-            cursor = end_index
+        # 与待检测句子重叠的风险不能复用，其句子也要重新检测，直到不再变化
+        changed = True
+        while changed:
+            changed = False
+            for idx, item in enumerate(shifted):
+                if item is not None and item[2] & dirty:
+                    dirty.update(item[2])
+                    shifted[idx] = None
+                    changed = True
 
-            embedding = self.model_manager.embed_text(chunk)
-            regulations_raw = self.rag_retriever.search(embedding, kb_type="regulation")
-            cases_raw = self.rag_retriever.search(embedding, kb_type="case")
+        spans: List[TextSpan] = []
+        reprocessed_chars = 0
+        ordered = sorted(dirty)
+        run_start = 0
+        for pos in range(1, len(ordered) + 1):
+            if pos < len(ordered) and ordered[pos] == ordered[pos - 1] + 1:
+                continue
+            region_start = new_sentences[ordered[run_start]].start
+            region_end = new_sentences[ordered[pos - 1]].end
+            reprocessed_chars += region_end - region_start
+            spans.extend(
+                TextSpan(span.text, span.start + region_start, span.end + region_start)
+                for span in self.segment(policy_text[region_start:region_end])
+            )
+            run_start = pos
 
-            regulations = [
-                RegulationItem(kb_id=item["kb_id"], title=item["title"], excerpt=item["content"][:280])
-                for item in regulations_raw
-            ]
-            cases = [
-                CaseItem(kb_id=item["kb_id"], title=item["title"], penalty="参考案例")
-                for item in cases_raw
-            ]
+        reused = [
+            risk.model_copy(
+                update={
+                    "fragment_position": FragmentPosition(start_index=item[0], end_index=item[1])
+                }
+            )
+            for risk, item in zip(base_risks, shifted)
+            if item is not None
+        ]
+        removed = [risk.risk_id for risk, item in zip(base_risks, shifted) if item is None]
+        logger.info(
+            "增量检测：基准报告 %s，复用风险 %s 项，重新检测 %s 个片段（%s 字）。",
+            base_report_id,
+            len(reused),
+            len(spans),
+            reprocessed_chars,
+        )
+        return IncrementalPlan(base_report_id, spans, reused, removed, reprocessed_chars)
 
-            prompt = self.model_manager.build_generation_prompt(app_name, chunk, regulations_raw, cases_raw)
-            generation = self.model_manager.generate_text(prompt)
-            risk_desc, suggestion = self._split_generation(generation)
+    def merge_incremental(
+        self,
+        task_id: str,
+        plan: IncrementalPlan,
+        risk_details: List[RiskDetail],
+    ) -> Tuple[List[RiskDetail], ReportDelta]:
+        """合并复用的风险与新检测的风险，按位置重新编号并生成变化摘要。"""
+        merged = sorted(
+            [(risk, False) for risk in plan.reused] + [(risk, True) for risk in risk_details],
+            key=lambda item: item[0].fragment_position.start_index,
+        )
+        renumbered: List[RiskDetail] = []
+        added: List[str] = []
+        unchanged: List[str] = []
+        for number, (risk, is_new) in enumerate(merged, start=1):
+            risk_id = f"{task_id[:8]}-{number}"
+            renumbered.append(risk.model_copy(update={"risk_id": risk_id}))
+            (added if is_new else unchanged).append(risk_id)
+        delta = ReportDelta(
+            base_report_id=plan.base_report_id,
+            added_risk_ids=added,
+            removed_risk_ids=plan.removed_risk_ids,
+            unchanged_risk_ids=unchanged,
+            reprocessed_chars=plan.reprocessed_chars,
+        )
+        return renumbered, delta
 
-            features = [
-                classification["score"],
-                len(chunk) / 1000,
-                len(regulations) / 5,
-            ]
-            level = self.model_manager.predict_risk_level(features)
+    def retrieve(self, candidates: List[ScoredSpan]) -> List[RetrievedContext]:
+        embeddings = self.model_manager.embed_texts([candidate.span.text for candidate in candidates])
+        hits = self.rag_retriever.search_batch(embeddings, ["regulation", "case"])
+        return [RetrievedContext(chunk_hits["regulation"], chunk_hits["case"]) for chunk_hits in hits]
 
-            risk_details.append(
-                RiskDetail(
-                    risk_id=f"{task_id[:8]}-{idx}",
-                    category=self._infer_category(chunk),
-                    level=level,  # type: ignore[arg-type]
-                    policy_fragment=chunk,
-                    fragment_position=FragmentPosition(start_index=start_index, end_index=end_index),
-                    violated_regulations=regulations,
-                    related_cases=cases,
-                    risk_description=risk_desc,
-                    rectification_suggestion=suggestion,
-                )
+    def generate(
+        self,
+        app_name: str,
+        candidates: List[ScoredSpan],
+        contexts: List[RetrievedContext],
+        force_regenerate: bool = False,
+        on_progress: Optional[Callable[[int, int], None]] = None,
+        on_result: Optional[Callable[[int, str], None]] = None,
+    ) -> List[str]:
+        prompts = [
+            self.model_manager.build_generation_prompt(
+                app_name, candidate.span.text, context.regulations, context.cases
             )
+            for candidate, context in zip(candidates, contexts)
+        ]
+        return self.model_manager.generate_texts(
+            prompts,
+            use_cache=not force_regenerate,
+            on_progress=on_progress,
+            on_result=on_result,
+        )
+
+    def aggregate(
+        self,
+        task_id: str,
+        candidates: List[ScoredSpan],
+        contexts: List[RetrievedContext],
+        generations: List[str],
+        levels: Optional[List[str]] = None,
+    ) -> List[RiskDetail]:
+        if levels is None:
+            levels = self.risk_levels(candidates, contexts)
+        return [
+            self.build_risk(task_id, candidate, context, generation, level)
+            for candidate, context, generation, level in zip(candidates, contexts, generations, levels)
+        ]
+
+    def risk_levels(self, candidates: List[ScoredSpan], contexts: List[RetrievedContext]) -> List[str]:
+        """风险等级只依赖分类分数、片段长度与检索结果，可在生成之前算出。"""
+        features = np.empty((len(candidates), 3), dtype=np.float32)
+        features[:, 0] = [candidate.score for candidate in candidates]
+        features[:, 1] = [len(candidate.span.text) / 1000 for candidate in candidates]
+        features[:, 2] = [len(context.regulations) / 5 for context in contexts]
+        return self.model_manager.predict_risk_levels(features)
+
+    def build_risk(
+        self,
+        task_id: str,
+        candidate: ScoredSpan,
+        context: RetrievedContext,
+        generation: str,
+        level: str,
+    ) -> RiskDetail:
+        span = candidate.span
+        regulations = [
+            RegulationItem(kb_id=item["kb_id"], title=item["title"], excerpt=item["content"][:280])
+            for item in context.regulations
+        ]
+        cases = [
+            CaseItem(kb_id=item["kb_id"], title=item["title"], penalty="参考案例")
+            for item in context.cases
+        ]
+        risk_desc, suggestion = self._split_generation(generation)
+        return RiskDetail(
+            risk_id=f"{task_id[:8]}-{candidate.index}",
+            category=self._infer_category(span.text),
+            level=level,  # type: ignore[arg-type]
+            policy_fragment=span.text,
+            fragment_position=FragmentPosition(start_index=span.start, end_index=span.end),
+            violated_regulations=regulations,
+            related_cases=cases,
+            risk_description=risk_desc,
+            rectification_suggestion=suggestion,
+        )
 
+    def assemble_report(
+        self,
+        task_id: str,
+        app_name: str,
+        policy_text: str,
+        risk_details: List[RiskDetail],
+        detection_time: datetime,
+        notes: Optional[List[str]] = None,
+        delta: Optional[ReportDelta] = None,
+        report_id: Optional[str] = None,
+    ) -> ReportPayload:
+        """生成最终报告；notes 会作为附加的系统操作日志写入报告。
+
+        `report_id` 为空时生成新的 ID；分批模式下由提交子任务时预先分配。
+        """
+        if delta:
+            notes = [
+                *(notes or []),
+                f"基于报告 {delta.base_report_id} 增量检测：新增 {len(delta.added_risk_ids)} 项，"
+                f"移除 {len(delta.removed_risk_ids)} 项，沿用 {len(delta.unchanged_risk_ids)} 项",
+            ]
         if not risk_details:
-            risk_details.append(
+            risk_details = [
                 RiskDetail(
                     risk_id=f"{task_id[:8]}-fallback",
                     category="信息收集",
@@ -190,11 +647,11 @@ class DetectionService:
                     risk_description="未检测到高风险分段，建议人工复核关键条款。",
                     rectification_suggestion="补充用户知情同意义务说明。",
                 )
-            )
+            ]
 
         summary = self._build_statistics(risk_details)
         return ReportPayload(
-            report_id=str(uuid.uuid4()),
+            report_id=report_id or str(uuid.uuid4()),
             basic_info=BasicInfo(
                 app_name=app_name,
                 detection_time=detection_time,
@@ -208,12 +665,16 @@ class DetectionService:
                     log_id=str(uuid.uuid4()),
                     operated_by="system",
                     operation_time=detection_time,
-                    action="任务完成并生成报告",
+                    action=action,
                 )
+                for action in [*(notes or []), "任务完成并生成报告"]
             ],
+            delta=delta,
         )
 
     def _split_generation(self, text: str) -> (str, str):
+        if not text.strip():
+            return ("模型生成失败，请人工复核该片段。", "请根据法规要求补充整改措施。")
         if "[MOCK RESPONSE]" in text:
             return ("根据启发式规则，建议关注数据收集合规性。", "请补充处理目的、权限申请与撤回机制。")
         parts = text.split("建议")
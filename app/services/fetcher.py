@@ -0,0 +1,255 @@
+import asyncio
+import contextlib
+import hashlib
+import ipaddress
+import json
+import logging
+import os
+import socket
+import tempfile
+import time
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, NamedTuple, Optional
+from urllib.parse import urljoin, urlsplit
+
+import httpcore
+import httpx
+from starlette.concurrency import run_in_threadpool
+
+from app.config.settings import get_settings
+from app.services.ingestion import UploadTooLarge, extract_in_pool, spool_stream
+
+logger = logging.getLogger(__name__)
+
+
+class FetchError(ValueError):
+    pass
+
+
+class FetchedPolicy(NamedTuple):
+    url: str
+    text: str
+    format: str
+    # fetched：完整下载并抽取；revalidated：服务端返回 304，直接使用本地缓存
+    status: str
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+
+async def resolve_host(host: str, port: int) -> List[str]:
+    """解析主机名，返回全部 IP 地址。"""
+    infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    return [info[4][0] for info in infos]
+
+
+async def checked_address(host: str, port: int) -> str:
+    """解析主机并返回要连接的地址；任一解析结果不是公网地址时拒绝抓取。"""
+    try:
+        addresses = await resolve_host(host, port)
+    except OSError as exc:
+        raise FetchError(f"无法解析主机 {host}：{exc}") from exc
+    if not addresses:
+        raise FetchError(f"无法解析主机 {host}")
+    if not get_settings().fetch_allow_private_hosts:
+        for address in addresses:
+            # 去掉 IPv6 链路本地地址的 %scope 后缀
+            if not ipaddress.ip_address(address.split("%")[0]).is_global:
+                raise FetchError(f"拒绝抓取非公网地址：{host}（{address}）")
+    return addresses[0]
+
+
+class PinnedBackend(httpcore.AsyncNetworkBackend):
+    """建立 TCP 连接时解析并校验主机，直接拨号到校验过的 IP。
+
+    校验发生在连接池之下：请求 URL 仍是原主机名，连接池按主机名复用连接，
+    TLS 也按原主机名发送 SNI 并校验证书，解析到同一 IP 的不同主机不会共用连接。
+    """
+
+    def __init__(self, backend: Optional[httpcore.AsyncNetworkBackend] = None):
+        self._backend = backend or httpcore.AnyIOBackend()
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        address = await checked_address(host, port)
+        return await self._backend.connect_tcp(
+            address, port, timeout=timeout, local_address=local_address, socket_options=socket_options
+        )
+
+    async def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        return await self._backend.connect_unix_socket(path, timeout=timeout, socket_options=socket_options)
+
+    async def sleep(self, seconds: float) -> None:
+        await self._backend.sleep(seconds)
+
+
+class PinnedTransport(httpx.AsyncHTTPTransport):
+    """底层连接经 PinnedBackend 建立的 httpx 传输。"""
+
+    def __init__(self, limits: httpx.Limits, backend: Optional[httpcore.AsyncNetworkBackend] = None):
+        super().__init__(limits=limits)
+        self._pool = httpcore.AsyncConnectionPool(
+            ssl_context=httpx.create_ssl_context(),
+            max_connections=limits.max_connections,
+            max_keepalive_connections=limits.max_keepalive_connections,
+            keepalive_expiry=limits.keepalive_expiry,
+            network_backend=PinnedBackend(backend),
+        )
+
+
+class PolicyFetcher:
+    """抓取隐私政策页面并抽取正文。
+
+    所有请求共用一个带连接池的 httpx.AsyncClient，并按站点限制并发；
+    抽取结果连同 ETag/Last-Modified 按 URL 缓存在磁盘上，重复抓取时发送条件请求，
+    内容未变（304）就直接返回缓存的正文，不再下载和抽取。
+
+    URL 由用户提交，每一跳（包括重定向）都先解析主机名并拒绝非公网地址；
+    建立新连接时 PinnedTransport 再次校验并直接拨号到校验过的 IP，防止借 DNS 重绑定访问内网服务。
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        per_host_limit: int,
+        client: Optional[httpx.AsyncClient] = None,
+    ):
+        settings = get_settings()
+        self.cache_dir = Path(cache_dir)
+        self.per_host_limit = per_host_limit
+        self.client = client or httpx.AsyncClient(
+            timeout=settings.fetch_timeout,
+            transport=PinnedTransport(
+                httpx.Limits(
+                    max_connections=settings.fetch_max_connections,
+                    max_keepalive_connections=settings.fetch_max_connections,
+                )
+            ),
+            follow_redirects=False,
+            headers={"User-Agent": settings.fetch_user_agent},
+        )
+        self._host_slots: Dict[str, asyncio.Semaphore] = {}
+        # 每个站点正在持有或等待信号量的请求数，归零时删除该站点的信号量
+        self._host_users: Dict[str, int] = {}
+
+    async def fetch(self, url: str) -> FetchedPolicy:
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.netloc:
+            raise FetchError(f"不支持的隐私政策地址：{url}")
+        cached = await run_in_threadpool(self._load, url)
+        headers = {}
+        if cached:
+            if cached.get("etag"):
+                headers["If-None-Match"] = cached["etag"]
+            if cached.get("last_modified"):
+                headers["If-Modified-Since"] = cached["last_modified"]
+
+        max_bytes = get_settings().upload_max_bytes
+        try:
+            async with self._slot(parts.netloc):
+                response, final_url = await self._open(url, headers)
+                try:
+                    if response.status_code == 304 and cached:
+                        logger.info("隐私政策未变化，使用缓存：%s", url)
+                        return FetchedPolicy(
+                            url,
+                            cached["text"],
+                            cached["format"],
+                            "revalidated",
+                            cached.get("etag"),
+                            cached.get("last_modified"),
+                        )
+                    if response.status_code >= 400:
+                        raise FetchError(f"抓取 {url} 失败：HTTP {response.status_code}")
+                    etag = response.headers.get("etag")
+                    last_modified = response.headers.get("last-modified")
+                    content_type = response.headers.get("content-type")
+                    path, _ = await spool_stream(response.aiter_bytes(), max_bytes)
+                finally:
+                    await response.aclose()
+        except UploadTooLarge as exc:
+            raise FetchError(f"抓取 {url} 失败：{exc}") from exc
+        except httpx.HTTPError as exc:
+            raise FetchError(f"抓取 {url} 失败：{exc}") from exc
+
+        try:
+            document = await extract_in_pool(path, Path(urlsplit(final_url).path).name, content_type)
+        finally:
+            path.unlink(missing_ok=True)
+        fetched = FetchedPolicy(url, document.text, document.format, "fetched", etag, last_modified)
+        if etag or last_modified:
+            await run_in_threadpool(self._store, fetched)
+        return fetched
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+    async def _open(self, url: str, headers: Dict[str, str]):
+        """逐跳发送请求并手动跟随重定向，返回未读取正文的响应与最终 URL。"""
+        max_redirects = get_settings().fetch_max_redirects
+        for _ in range(max_redirects + 1):
+            parts = urlsplit(url)
+            if parts.scheme not in ("http", "https") or not parts.hostname:
+                raise FetchError(f"不支持的隐私政策地址：{url}")
+            # 发送前先校验，复用已有连接时同样能拒绝指向内网的重定向
+            await checked_address(parts.hostname, parts.port or (443 if parts.scheme == "https" else 80))
+            request = self.client.build_request("GET", url, headers=headers)
+            response = await self.client.send(request, stream=True, follow_redirects=False)
+            location = response.headers.get("location")
+            if not (response.is_redirect and location):
+                return response, url
+            await response.aclose()
+            url = urljoin(url, location)
+        raise FetchError(f"抓取失败：重定向超过 {max_redirects} 次")
+
+    @contextlib.asynccontextmanager
+    async def _slot(self, host: str) -> AsyncIterator[None]:
+        """按站点限制并发；站点没有进行中的请求时丢弃其信号量，避免随用户提交的地址无限增长。"""
+        slot = self._host_slots.get(host)
+        if slot is None:
+            slot = self._host_slots[host] = asyncio.Semaphore(self.per_host_limit)
+        self._host_users[host] = self._host_users.get(host, 0) + 1
+        try:
+            async with slot:
+                yield
+        finally:
+            self._host_users[host] -= 1
+            if not self._host_users[host]:
+                del self._host_users[host]
+                del self._host_slots[host]
+
+    def _path(self, url: str) -> Path:
+        return self.cache_dir / (hashlib.sha256(url.encode("utf-8")).hexdigest() + ".json")
+
+    def _load(self, url: str) -> Optional[dict]:
+        try:
+            entry = json.loads(self._path(url).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        return entry if entry.get("url") == url else None
+
+    def _store(self, fetched: FetchedPolicy) -> None:
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        entry = {**fetched._asdict(), "fetched_at": time.time()}
+        entry.pop("status")
+        fd, name = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as out:
+            json.dump(entry, out, ensure_ascii=False)
+        # 先写临时文件再替换，并发抓取同一 URL 时不会读到半个文件
+        os.replace(name, self._path(fetched.url))
+
+
+_fetcher: Optional[PolicyFetcher] = None
+
+
+def get_policy_fetcher() -> PolicyFetcher:
+    global _fetcher
+    if _fetcher is None:
+        settings = get_settings()
+        _fetcher = PolicyFetcher(settings.fetch_cache_dir, settings.fetch_per_host_limit)
+    return _fetcher
+
+
+async def close_policy_fetcher() -> None:
+    global _fetcher
+    if _fetcher is not None:
+        await _fetcher.aclose()
+        _fetcher = None
@@ -0,0 +1,392 @@
+import asyncio
+import codecs
+import logging
+import os
+import re
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from html.parser import HTMLParser
+from multiprocessing import get_context
+from pathlib import Path
+from threading import Lock
+from typing import Any, AsyncIterator, Dict, List, NamedTuple, Optional, Tuple
+
+from python_multipart.multipart import MultipartParser, parse_options_header
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from app import models
+from app.config.settings import get_settings
+from app.services.cache import content_hash
+
+try:
+    from pypdf import PdfReader
+
+    HAS_PYPDF = True
+except Exception:  # pragma: no cover
+    PdfReader = None
+    HAS_PYPDF = False
+
+try:
+    from charset_normalizer import from_bytes as detect_charset
+
+    HAS_CHARSET_NORMALIZER = True
+except Exception:  # pragma: no cover
+    detect_charset = None
+    HAS_CHARSET_NORMALIZER = False
+
+logger = logging.getLogger(__name__)
+
+SPOOL_CHUNK_SIZE = 1024 * 1024
+# multipart 边界与各字段头部占用的字节，请求体总量超过 max_bytes 加上此值即中止
+MULTIPART_OVERHEAD = 64 * 1024
+
+_BOMS = (
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+_META_CHARSET = re.compile(rb"""<meta[^>]+charset=["']?([\w-]+)""", re.IGNORECASE)
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+class ExtractionError(ValueError):
+    pass
+
+
+class ExtractedDocument(NamedTuple):
+    text: str
+    format: str
+    encoding: Optional[str]
+    page_count: Optional[int]
+
+
+class SpooledUpload(NamedTuple):
+    path: Path
+    size: int
+    filename: str
+    content_type: Optional[str]
+
+
+# --------- 上传落盘 ----------
+async def spool_multipart(
+    body: AsyncIterator[bytes],
+    content_type: str,
+    max_bytes: int,
+    field: str = "file",
+) -> SpooledUpload:
+    """边读取请求体边解析 multipart，把 `field` 字段的文件内容直接写入 upload_spool_dir。
+
+    按实际读到的字节数计数，未声明 Content-Length 的分块上传超限时同样立即中止；
+    文件只落盘这一次，不再经过 Starlette 表单解析的临时文件。
+    """
+    _, params = parse_options_header(content_type)
+    boundary = params.get(b"boundary")
+    if not boundary:
+        raise ValueError("请以 multipart/form-data 格式上传文件")
+
+    part: Dict[str, Any] = {}
+    found: Dict[str, Optional[str]] = {}
+    pending: List[bytes] = []
+
+    def on_part_begin() -> None:
+        part.update(headers={}, name=b"", value=b"", is_file=False)
+
+    def on_header_field(data: bytes, start: int, end: int) -> None:
+        part["name"] += data[start:end]
+
+    def on_header_value(data: bytes, start: int, end: int) -> None:
+        part["value"] += data[start:end]
+
+    def on_header_end() -> None:
+        part["headers"][part["name"].lower()] = part["value"]
+        part.update(name=b"", value=b"")
+
+    def on_headers_finished() -> None:
+        _, options = parse_options_header(part["headers"].get(b"content-disposition", b""))
+        if found or options.get(b"name") != field.encode() or b"filename" not in options:
+            return
+        part["is_file"] = True
+        found["filename"] = options[b"filename"].decode("utf-8", errors="replace")
+        found["content_type"] = part["headers"].get(b"content-type", b"").decode("latin-1") or None
+
+    def on_part_data(data: bytes, start: int, end: int) -> None:
+        if part["is_file"]:
+            pending.append(data[start:end])
+
+    parser = MultipartParser(
+        boundary,
+        callbacks={
+            "on_part_begin": on_part_begin,
+            "on_header_field": on_header_field,
+            "on_header_value": on_header_value,
+            "on_header_end": on_header_end,
+            "on_headers_finished": on_headers_finished,
+            "on_part_data": on_part_data,
+        },
+    )
+
+    async def file_chunks() -> AsyncIterator[bytes]:
+        received = 0
+        async for chunk in body:
+            received += len(chunk)
+            if received > max_bytes + MULTIPART_OVERHEAD:
+                raise UploadTooLarge(f"文件超过 {max_bytes // (1024 * 1024)}MB 上限")
+            parser.write(chunk)
+            if pending:
+                data = b"".join(pending)
+                pending.clear()
+                yield data
+        parser.finalize()
+
+    path, size = await spool_stream(file_chunks(), max_bytes)
+    if not found:
+        path.unlink(missing_ok=True)
+        raise ValueError(f"请求中缺少文件字段 {field}")
+    return SpooledUpload(path, size, found["filename"] or "", found["content_type"])
+
+
+async def spool_stream(chunks: AsyncIterator[bytes], max_bytes: int) -> Tuple[Path, int]:
+    """把异步字节流写入 upload_spool_dir 下的临时文件，返回路径与字节数。"""
+    spool_dir = Path(get_settings().upload_spool_dir)
+    spool_dir.mkdir(parents=True, exist_ok=True)
+    fd, name = tempfile.mkstemp(dir=spool_dir, prefix="upload-")
+    path = Path(name)
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as out:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"文件超过 {max_bytes // (1024 * 1024)}MB 上限")
+                await run_in_threadpool(out.write, chunk)
+    except BaseException:
+        path.unlink(missing_ok=True)
+        raise
+    return path, size
+
+
+# --------- 格式与编码识别 ----------
+def detect_format(head: bytes, filename: str = "", content_type: Optional[str] = None) -> str:
+    suffix = Path(filename).suffix.lower()
+    content_type = (content_type or "").lower()
+    if head.startswith(b"%PDF-") or suffix == ".pdf" or "pdf" in content_type:
+        return "pdf"
+    sniff = head[:1024].lstrip().lower()
+    if (
+        suffix in (".html", ".htm")
+        or "html" in content_type
+        or sniff.startswith((b"<!doctype html", b"<html"))
+    ):
+        return "html"
+    return "txt"
+
+
+def decode_bytes(data: bytes, declared: Optional[str] = None) -> Tuple[str, str]:
+    """识别编码并解码：BOM → UTF-8 → 文档声明的编码 → charset-normalizer → GB18030。"""
+    for bom, encoding in _BOMS:
+        if data.startswith(bom):
+            return data.decode(encoding), encoding
+    candidates = ["utf-8"]
+    if declared:
+        candidates.append(declared)
+    for encoding in candidates:
+        try:
+            return data.decode(encoding), encoding
+        except (LookupError, UnicodeDecodeError):
+            continue
+    if HAS_CHARSET_NORMALIZER:
+        match = detect_charset(data).best()
+        if match is not None:
+            return str(match), match.encoding
+    # 中文文档最常见的非 UTF-8 编码，GB18030 兼容 GBK/GB2312
+    try:
+        return data.decode("gb18030"), "gb18030"
+    except UnicodeDecodeError:
+        return data.decode("utf-8", errors="replace"), "utf-8"
+
+
+# --------- HTML ----------
+class _TextExtractor(HTMLParser):
+    """提取正文文本，丢弃脚本、样式及导航、页眉页脚等页面框架。"""
+
+    SKIP_TAGS = {
+        "script", "style", "noscript", "template", "svg", "iframe",
+        "head", "nav", "header", "footer", "aside", "form", "button",
+    }
+    BLOCK_TAGS = {
+        "p", "div", "section", "article", "main", "li", "ul", "ol", "br", "tr",
+        "table", "h1", "h2", "h3", "h4", "h5", "h6", "blockquote", "pre", "dd", "dt",
+    }
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self._parts: List[str] = []
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP_TAGS:
+            self._skip_depth += 1
+        elif tag in self.BLOCK_TAGS:
+            self._parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+        elif tag in self.BLOCK_TAGS:
+            self._parts.append("\n")
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self._parts.append(data)
+
+    def text(self) -> str:
+        return "".join(self._parts)
+
+
+def html_to_text(html: str) -> str:
+    parser = _TextExtractor()
+    parser.feed(html)
+    parser.close()
+    return parser.text()
+
+
+def normalize_document_text(text: str) -> str:
+    """逐行去掉首尾空白，合并连续空行，段落之间保留一个空行。"""
+    lines = [" ".join(line.split()) for line in text.splitlines()]
+    paragraphs: List[str] = []
+    blank = False
+    for line in lines:
+        if line:
+            if blank and paragraphs:
+                paragraphs.append("")
+            paragraphs.append(line)
+            blank = False
+        else:
+            blank = True
+    return "\n".join(paragraphs)
+
+
+# --------- 抽取 ----------
+def _extract_pdf(path: str) -> ExtractedDocument:
+    if not HAS_PYPDF:
+        raise ExtractionError("未安装 pypdf，无法解析 PDF 文件")
+    pages = []
+    try:
+        reader = PdfReader(path)
+        # PdfReader 按需解析页面对象，逐页抽取避免一次性展开整个文档
+        for page in reader.pages:
+            pages.append(page.extract_text() or "")
+    except Exception as exc:
+        # 损坏或截断的文件会在读取 xref 或解析页面时抛出 PdfReadError 等各类异常
+        raise ExtractionError("无法解析 PDF 文件") from exc
+    return ExtractedDocument("\n\n".join(pages), "pdf", None, len(pages))
+
+
+def extract_document(path: str, filename: str = "", content_type: Optional[str] = None) -> ExtractedDocument:
+    """从落盘的上传文件中抽取正文，在进程池中执行。"""
+    with open(path, "rb") as source:
+        head = source.read(2048)
+    doc_format = detect_format(head, filename, content_type)
+    if doc_format == "pdf":
+        document = _extract_pdf(path)
+    else:
+        data = Path(path).read_bytes()
+        declared = None
+        if doc_format == "html":
+            match = _META_CHARSET.search(data[:4096])
+            declared = match.group(1).decode("ascii", errors="ignore") if match else None
+        text, encoding = decode_bytes(data, declared)
+        if doc_format == "html":
+            text = html_to_text(text)
+        document = ExtractedDocument(text, doc_format, encoding, None)
+    return document._replace(text=normalize_document_text(document.text))
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = Lock()
+
+
+def _discard_pool(pool: ProcessPoolExecutor) -> None:
+    """终止进程池中的所有子进程并丢弃该池，下次抽取时重新创建。
+
+    仍在该池中排队或执行的其他抽取会以 BrokenProcessPool 失败。
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    # 超时的任务无法单独取消，只能结束执行它的进程
+    for process in list((pool._processes or {}).values()):
+        process.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _get_pool() -> Optional[ProcessPoolExecutor]:
+    global _pool
+    workers = get_settings().ingestion_workers
+    if workers <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            # spawn 避免在 API 进程的线程池运行期间 fork
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"))
+        return _pool
+
+
+async def extract_in_pool(path: Path, filename: str, content_type: Optional[str]) -> ExtractedDocument:
+    """在进程池中抽取文本；ingestion_workers 为 0 时改用线程池。
+
+    超时后终止并重建进程池，避免卡住的解析一直占用工作进程。
+    """
+    settings = get_settings()
+    pool = _get_pool()
+    if pool is None:
+        call = run_in_threadpool(extract_document, str(path), filename, content_type)
+    else:
+        loop = asyncio.get_running_loop()
+        call = loop.run_in_executor(pool, extract_document, str(path), filename, content_type)
+    try:
+        return await asyncio.wait_for(call, timeout=settings.ingestion_timeout)
+    except asyncio.TimeoutError as exc:
+        if pool is not None:
+            logger.warning("文本抽取超过 %ss，重建抽取进程池。", settings.ingestion_timeout)
+            _discard_pool(pool)
+        raise ExtractionError("文本抽取超时") from exc
+    except BrokenProcessPool as exc:
+        _discard_pool(pool)
+        raise ExtractionError("文本抽取进程异常退出") from exc
+
+
+def save_document(
+    db: Session,
+    document: ExtractedDocument,
+    filename: str,
+    content_type: Optional[str],
+    size_bytes: int,
+) -> models.PolicyDocument:
+    """保存抽取出的正文；内容相同的文档只存一份，直接返回已有记录。"""
+    digest = content_hash(document.text)
+    existing = db.query(models.PolicyDocument).filter_by(content_hash=digest).first()
+    if existing is not None:
+        return existing
+    record = models.PolicyDocument(
+        filename=filename,
+        content_type=content_type,
+        format=document.format,
+        encoding=document.encoding,
+        page_count=document.page_count,
+        size_bytes=size_bytes,
+        char_count=len(document.text),
+        content_hash=digest,
+        text=document.text,
+    )
+    db.add(record)
+    db.commit()
+    return record
@@ -0,0 +1,438 @@
+import csv
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+import numpy as np
+from sqlalchemy import or_, select, update
+from sqlalchemy.orm import Session
+
+from app import models
+from app.config.settings import get_settings
+from app.services.model_manager import ModelManager
+from app.services.rag_retriever import HAS_MILVUS, Collection, MilvusRegistry, connections, utility
+
+try:
+    from pymilvus import CollectionSchema, DataType, FieldSchema
+except Exception:  # pragma: no cover
+    CollectionSchema = DataType = FieldSchema = None
+
+logger = logging.getLogger(__name__)
+
+EmbedFn = Callable[[List[str]], np.ndarray]
+
+KB_TYPES = ("regulation", "case")
+# Milvus VARCHAR 的 max_length 按字节计，中文约 3 字节一字
+MILVUS_CONTENT_MAX_LENGTH = 8192
+MILVUS_CONTENT_MAX_CHARS = 2000
+_ARTICLE_PATTERN = re.compile(r"(?m)^[ \t　]*第[零〇一二三四五六七八九十百千两\d]+条")
+
+
+class KnowledgeRecord(NamedTuple):
+    kb_id: str
+    kb_type: str
+    content_text: str
+
+
+class LoadStats(NamedTuple):
+    records: int
+    rows: int
+    seconds: float
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+# --------- 读取与拆分 ----------
+def iter_source(path: str, default_kb_type: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """逐条读取 JSONL 或 CSV（按扩展名区分），不把整个文件读入内存。"""
+    suffix = Path(path).suffix.lower()
+    with open(path, encoding="utf-8-sig", newline="") as source:
+        if suffix == ".csv":
+            rows: Iterable[Dict[str, Any]] = csv.DictReader(source)
+        elif suffix in (".jsonl", ".ndjson"):
+            rows = (json.loads(line) for line in source if line.strip())
+        else:
+            raise ValueError(f"不支持的知识库文件格式：{path}")
+        for row in rows:
+            if default_kb_type and not row.get("kb_type"):
+                row["kb_type"] = default_kb_type
+            yield row
+
+
+def split_articles(row: Dict[str, Any]) -> List[KnowledgeRecord]:
+    """法规按「第 X 条」拆分为逐条的知识条目，每条前面拼上法规标题；案例和不分条的法规保持一条。"""
+    kb_id = str(row["kb_id"]).strip()
+    kb_type = str(row.get("kb_type") or "").strip()
+    content = str(row.get("content_text") or row.get("content") or "").strip()
+    if kb_type not in KB_TYPES:
+        raise ValueError(f"知识条目 {kb_id} 的 kb_type 无效：{kb_type!r}")
+    if not content:
+        return []
+    starts = [match.start() for match in _ARTICLE_PATTERN.finditer(content)]
+    if kb_type != "regulation" or len(starts) < 2:
+        return [KnowledgeRecord(kb_id, kb_type, content)]
+
+    preamble = content[: starts[0]].strip()
+    title = str(row.get("title") or "").strip() or (preamble.splitlines()[0] if preamble else kb_id)
+    records = []
+    for idx, (start, end) in enumerate(zip(starts, starts[1:] + [len(content)]), start=1):
+        article = " ".join(content[start:end].split())
+        records.append(KnowledgeRecord(f"{kb_id}-art{idx}", kb_type, f"{title} {article}"))
+    return records
+
+
+# --------- 写入 ----------
+def upsert_kb_items(db: Session, rows: List[Dict[str, Any]]) -> None:
+    """一条 INSERT ... ON CONFLICT 写入一批知识条目；内容与向量 ID 都未变的行不更新 updated_at。
+
+    同一批内重复的 kb_id 只保留最后一行：PostgreSQL 不允许一条语句两次更新同一行。
+    """
+    if not rows:
+        return
+    rows = list({row["kb_id"]: row for row in rows}.values())
+    table = models.KnowledgeBaseItem.__table__
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:  # pragma: no cover
+        for row in rows:
+            db.merge(models.KnowledgeBaseItem(**row))
+        return
+    stmt = insert(table).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.kb_id],
+        set_={
+            "kb_type": stmt.excluded.kb_type,
+            "content_text": stmt.excluded.content_text,
+            "milvus_vector_id": stmt.excluded.milvus_vector_id,
+            "is_active": stmt.excluded.is_active,
+            "updated_at": stmt.excluded.updated_at,
+            "vectors_synced_at": stmt.excluded.vectors_synced_at,
+        },
+        where=(table.c.content_text != stmt.excluded.content_text)
+        | (table.c.kb_type != stmt.excluded.kb_type)
+        | (table.c.milvus_vector_id != stmt.excluded.milvus_vector_id)
+        | table.c.is_active.isnot(True),
+    )
+    db.execute(stmt)
+
+
+def stale_kb_ids(db: Session, source_ids: List[str], produced: Iterable[str]) -> List[str]:
+    """源记录重新拆分后不再产生的有效条目：`{kb_id}` 本身或 `{kb_id}-artN` 中不在 produced 内的行。
+
+    法规删减条文、改为不分条或内容清空时，旧条目需要软删除并移除向量。
+    """
+    if not source_ids:
+        return []
+    item = models.KnowledgeBaseItem
+    conditions = []
+    for kb_id in source_ids:
+        escaped = kb_id.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        conditions.append(item.kb_id == kb_id)
+        conditions.append(item.kb_id.like(f"{escaped}-art%", escape="\\"))
+    existing = db.execute(
+        select(item.kb_id).where(item.is_active.isnot(False), or_(*conditions))
+    ).scalars()
+    bases = set(source_ids)
+    produced = set(produced)
+    stale = []
+    for kb_id in existing:
+        base, _, article = kb_id.rpartition("-art")
+        owned = kb_id in bases or (base in bases and article.isdigit())
+        if owned and kb_id not in produced:
+            stale.append(kb_id)
+    return stale
+
+
+def write_vectors(collection, records: List[KnowledgeRecord], vectors: np.ndarray) -> List[str]:
+    """批量写入 Milvus，返回每条记录在 Milvus 中的主键。
+
+    以 kb_id 为主键的 collection 直接 upsert；自增主键的 collection 先按 kb_id
+    删除旧向量再插入，使用插入返回的主键。
+    """
+    entities = [
+        {
+            "kb_id": record.kb_id,
+            "kb_type": record.kb_type,
+            "content": record.content_text[:MILVUS_CONTENT_MAX_CHARS],
+            "embedding": vector.tolist(),
+        }
+        for record, vector in zip(records, vectors)
+    ]
+    kb_ids = [record.kb_id for record in records]
+    if collection.schema.auto_id:
+        collection.delete(f"kb_id in {json.dumps(kb_ids, ensure_ascii=False)}")
+        result = collection.insert(entities)
+        return [str(pk) for pk in result.primary_keys]
+    collection.upsert(entities)
+    return kb_ids
+
+
+def open_collection(dim: Optional[int]):
+    """连接 Milvus，collection 不存在时按 kb_id 主键建表并建立 IVF 内积索引；dim 为 None 时不建表。"""
+    if not HAS_MILVUS:
+        logger.warning("未安装 pymilvus，只写入数据库。")
+        return None
+    settings = get_settings()
+    connections.connect(
+        alias=MilvusRegistry.ALIAS, host=settings.milvus_host, port=settings.milvus_port
+    )
+    name = settings.milvus_collection
+    if utility.has_collection(name, using=MilvusRegistry.ALIAS):
+        return Collection(name, using=MilvusRegistry.ALIAS)
+    if dim is None:
+        return None
+    schema = CollectionSchema(
+        [
+            FieldSchema("kb_id", DataType.VARCHAR, is_primary=True, max_length=255),
+            FieldSchema("kb_type", DataType.VARCHAR, max_length=50),
+            FieldSchema("content", DataType.VARCHAR, max_length=MILVUS_CONTENT_MAX_LENGTH),
+            FieldSchema("embedding", DataType.FLOAT_VECTOR, dim=dim),
+        ],
+        description="隐私政策合规知识库",
+    )
+    collection = Collection(name, schema, using=MilvusRegistry.ALIAS)
+    collection.create_index(
+        "embedding",
+        {"index_type": "IVF_FLAT", "metric_type": "IP", "params": {"nlist": 1024}},
+    )
+    logger.info("已创建 Milvus collection：%s（维度 %s）", name, dim)
+    return collection
+
+
+# --------- 断点 ----------
+class Checkpoint:
+    """记录某个源文件已写入的源记录数，重跑时跳过这些记录。"""
+
+    def __init__(self, checkpoint_dir: str, source: str):
+        source_path = Path(source).resolve()
+        key = hashlib.sha1(str(source_path).encode("utf-8")).hexdigest()[:16]
+        self.path = Path(checkpoint_dir) / f"{source_path.stem}-{key}.json"
+        self.source = str(source_path)
+        stat = source_path.stat()
+        self.fingerprint = f"{stat.st_size}:{int(stat.st_mtime)}"
+        self.records = 0
+        self.rows = 0
+        self.completed = False
+
+    def load(self) -> "Checkpoint":
+        try:
+            state = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return self
+        if state.get("fingerprint") != self.fingerprint:
+            logger.info("源文件 %s 已变化，忽略旧断点。", self.source)
+            return self
+        self.records = state["records"]
+        self.rows = state["rows"]
+        self.completed = state.get("completed", False)
+        return self
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        state = {
+            "source": self.source,
+            "fingerprint": self.fingerprint,
+            "records": self.records,
+            "rows": self.rows,
+            "completed": self.completed,
+        }
+        tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(state, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp_path, self.path)
+
+    def reset(self) -> None:
+        self.path.unlink(missing_ok=True)
+        self.records = self.rows = 0
+        self.completed = False
+
+
+# --------- 加载流程 ----------
+def _last_per_kb_id(records: List[KnowledgeRecord]) -> List[KnowledgeRecord]:
+    """源数据重复或重新拆分后同一批可能出现相同 kb_id，只嵌入和写入最后一条。"""
+    return list({record.kb_id: record for record in records}.values())
+
+
+class _Batch(NamedTuple):
+    records: List[KnowledgeRecord]
+    source_records: int
+    # 本批源记录的 kb_id，用于找出拆分结果中已不存在的旧条目
+    source_ids: List[str]
+
+
+class KnowledgeBaseLoader:
+    """流式批量加载知识库：读取 → 拆分 → 批量嵌入 → 写入 Milvus → 批量 upsert 数据库 → 记录断点。
+
+    下一批的嵌入在后台线程中与当前批的写入重叠进行；每批提交后才推进断点，
+    中断后重跑同一文件会从上次提交的位置继续，已写入的行重复 upsert 也不会产生重复数据。
+    源记录重新拆分后不再产生的旧条目会被软删除，并从 Milvus 中删除向量。
+    写入了 Milvus 的行把 vectors_synced_at 置为本次的 updated_at，增量同步据此跳过这些行，
+    不会把刚加载的条目重新嵌入一遍。
+    """
+
+    def __init__(
+        self,
+        db: Session,
+        embed_fn: Optional[EmbedFn] = None,
+        collection=None,
+        use_milvus: bool = True,
+        batch_size: Optional[int] = None,
+        checkpoint_dir: Optional[str] = None,
+    ):
+        settings = get_settings()
+        self.db = db
+        self.embed_fn = embed_fn or ModelManager.get_instance().embed_texts
+        self.collection = collection
+        self.use_milvus = use_milvus
+        self.batch_size = batch_size or settings.kb_load_batch_size
+        self.checkpoint_dir = checkpoint_dir or settings.kb_load_checkpoint_dir
+
+    def load_file(
+        self,
+        path: str,
+        default_kb_type: Optional[str] = None,
+        restart: bool = False,
+    ) -> LoadStats:
+        checkpoint = Checkpoint(self.checkpoint_dir, path).load()
+        if restart:
+            checkpoint.reset()
+        if checkpoint.completed:
+            logger.info("%s 已全部加载（%s 条），跳过；需要重新加载请使用 restart。", path, checkpoint.rows)
+            return LoadStats(0, 0, 0.0)
+        if checkpoint.records:
+            logger.info("从断点继续加载 %s：已完成 %s 条源记录。", path, checkpoint.records)
+        rows = iter_source(path, default_kb_type)
+        for _ in range(checkpoint.records):
+            next(rows, None)
+        stats = self.load_records(rows, checkpoint)
+        checkpoint.completed = True
+        checkpoint.save()
+        return stats
+
+    def load_records(
+        self,
+        rows: Iterable[Dict[str, Any]],
+        checkpoint: Optional[Checkpoint] = None,
+    ) -> LoadStats:
+        start = time.perf_counter()
+        records = written = 0
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="kb-embed") as executor:
+            pending: Optional[Future] = None
+            for batch in self._batches(rows):
+                future = executor.submit(self._embed, batch)
+                if pending is not None:
+                    records, written = self._write(*pending.result(), checkpoint, records, written, start)
+                pending = future
+            if pending is not None:
+                records, written = self._write(*pending.result(), checkpoint, records, written, start)
+        stats = LoadStats(records, written, time.perf_counter() - start)
+        logger.info(
+            "知识库加载完成：%s 条源记录，%s 条知识条目，用时 %.1fs，%.0f 条/秒。",
+            stats.records,
+            stats.rows,
+            stats.seconds,
+            stats.rows_per_sec,
+        )
+        return stats
+
+    def _batches(self, rows: Iterable[Dict[str, Any]]) -> Iterator[_Batch]:
+        # 同一条法规拆出的条目总在同一批，断点按源记录计数即可精确续传
+        records: List[KnowledgeRecord] = []
+        source_ids: List[str] = []
+        for row in rows:
+            records.extend(split_articles(row))
+            source_ids.append(str(row["kb_id"]).strip())
+            if len(records) >= self.batch_size:
+                yield _Batch(_last_per_kb_id(records), len(source_ids), source_ids)
+                records, source_ids = [], []
+        if source_ids:
+            yield _Batch(_last_per_kb_id(records), len(source_ids), source_ids)
+
+    def _embed(self, batch: _Batch):
+        if not batch.records:
+            return batch, np.zeros((0, 0), dtype=np.float32)
+        vectors = self.embed_fn([record.content_text for record in batch.records])
+        return batch, np.asarray(vectors, dtype=np.float32)
+
+    def _write(
+        self,
+        batch: _Batch,
+        vectors: np.ndarray,
+        checkpoint: Optional[Checkpoint],
+        records: int,
+        written: int,
+        start: float,
+    ):
+        now = datetime.utcnow()
+        self._deactivate_stale(batch, now)
+        if batch.records:
+            vector_ids = [""] * len(batch.records)
+            collection = self._collection(vectors.shape[1])
+            if collection is not None:
+                vector_ids = write_vectors(collection, batch.records, vectors)
+            upsert_kb_items(
+                self.db,
+                [
+                    {
+                        "kb_id": record.kb_id,
+                        "kb_type": record.kb_type,
+                        "content_text": record.content_text,
+                        "milvus_vector_id": vector_id,
+                        "is_active": True,
+                        "created_at": now,
+                        "updated_at": now,
+                        "vectors_synced_at": now if collection is not None else None,
+                    }
+                    for record, vector_id in zip(batch.records, vector_ids)
+                ],
+            )
+        self.db.commit()
+        records += batch.source_records
+        written += len(batch.records)
+        if checkpoint is not None:
+            checkpoint.records += batch.source_records
+            checkpoint.rows += len(batch.records)
+            checkpoint.save()
+        elapsed = time.perf_counter() - start
+        logger.info("已写入 %s 条知识条目，%.0f 条/秒。", written, written / elapsed if elapsed else 0.0)
+        return records, written
+
+    def _deactivate_stale(self, batch: _Batch, now: datetime) -> None:
+        stale = stale_kb_ids(self.db, batch.source_ids, (record.kb_id for record in batch.records))
+        if not stale:
+            return
+        if self.collection is None and self.use_milvus:
+            # 只打开已有的 collection，不存在时也就没有需要删除的向量
+            self.collection = open_collection(None)
+        if self.collection is not None:
+            self.collection.delete(f"kb_id in {json.dumps(stale, ensure_ascii=False)}")
+        item = models.KnowledgeBaseItem
+        self.db.execute(
+            update(item)
+            .where(item.kb_id.in_(stale))
+            .values(
+                is_active=False,
+                milvus_vector_id="",
+                updated_at=now,
+                vectors_synced_at=now if self.collection is not None else None,
+            )
+        )
+        logger.info("停用 %s 条已不存在于源数据中的知识条目。", len(stale))
+
+    def _collection(self, dim: int):
+        if self.collection is None and self.use_milvus:
+            self.collection = open_collection(dim)
+            # 未安装 pymilvus 时只写数据库，不再重复尝试
+            self.use_milvus = self.collection is not None
+        return self.collection
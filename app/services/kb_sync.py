@@ -0,0 +1,193 @@
+"""
+知识库到 Milvus 的增量同步：按 (updated_at, kb_id) 高水位线只处理上次同步后变更的行。
+运行方式：
+    python -m app.services.kb_sync            # 执行一次同步
+    python -m app.services.kb_sync --status   # 只查看同步延迟
+"""
+
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import List, NamedTuple, Optional
+
+from sqlalchemy import and_, bindparam, func, or_, select, update
+from sqlalchemy.orm import Session
+
+from app import models
+from app.config.settings import get_settings
+from app.services.kb_loader import EmbedFn, KnowledgeRecord, open_collection, write_vectors
+from app.services.model_manager import ModelManager
+from app.services.rag_retriever import HAS_MILVUS
+
+logger = logging.getLogger(__name__)
+
+SYNC_NAME = "knowledge_base_milvus"
+
+
+class SyncResult(NamedTuple):
+    upserted: int
+    deleted: int
+    pending: int
+    # 最早一条未同步变更距今的秒数，没有积压时为 0
+    lag_seconds: float
+    watermark: Optional[datetime]
+
+
+class KnowledgeBaseSync:
+    """把 knowledge_base 的新增、修改和软删除同步到 Milvus。
+
+    每批按 (updated_at, kb_id) 顺序取出水位线之后的行：有效行重新嵌入后 upsert，
+    is_active 为 False 的行删除向量；Milvus 写入成功后才在同一事务中推进水位线，
+    中途失败时下次从上一批结束处继续。每批处理期间锁住 sync_state 行，
+    与上一轮尚未结束的同步交替执行时，水位线只会向前推进。
+    批量加载器已写好向量的行（vectors_synced_at 等于 updated_at）只推进水位线，不重新嵌入。
+    """
+
+    def __init__(
+        self,
+        db: Session,
+        embed_fn: Optional[EmbedFn] = None,
+        collection=None,
+        batch_size: Optional[int] = None,
+    ):
+        self.settings = get_settings()
+        self.db = db
+        self.embed_fn = embed_fn
+        self.collection = collection
+        self.batch_size = batch_size or self.settings.kb_load_batch_size
+
+    def run(self, now: Optional[datetime] = None) -> SyncResult:
+        now = now or datetime.utcnow()
+        if self.collection is None and not HAS_MILVUS:
+            logger.warning("未安装 pymilvus，跳过知识库向量同步。")
+            return self.status(now)
+        state = self._state(lock=True)
+        until = now - timedelta(seconds=self.settings.kb_sync_settle_seconds)
+        upserted = deleted = 0
+        while True:
+            rows = self.db.execute(
+                self._changed_since(state)
+                .where(models.KnowledgeBaseItem.updated_at <= until)
+                .limit(self.batch_size)
+            ).all()
+            if not rows:
+                break
+            changed = [row for row in rows if row.vectors_synced_at != row.updated_at]
+            active = [row for row in changed if row.is_active is not False]
+            removed = [row.kb_id for row in changed if row.is_active is False]
+            if active:
+                self._upsert_vectors(active)
+            if removed:
+                collection = self._get_collection()
+                # collection 尚不存在时没有需要删除的向量
+                if collection is not None:
+                    collection.delete(f"kb_id in {json.dumps(removed, ensure_ascii=False)}")
+            upserted += len(active)
+            deleted += len(removed)
+            state.watermark, state.last_key = rows[-1].updated_at, rows[-1].kb_id
+            self.db.commit()
+            logger.info("知识库同步：已 upsert %s 条，删除 %s 条。", upserted, deleted)
+            # 提交会释放行锁，下一批前重新加锁并读取最新水位线
+            state = self._state(lock=True)
+
+        state.last_run_at = now
+        state.last_synced = upserted + deleted
+        self.db.commit()
+        result = self.status(now)._replace(upserted=upserted, deleted=deleted)
+        log = logger.warning if result.lag_seconds > self.settings.kb_sync_lag_warning else logger.info
+        log(
+            "知识库同步完成：upsert %s 条，删除 %s 条，待同步 %s 条，延迟 %.0fs。",
+            upserted,
+            deleted,
+            result.pending,
+            result.lag_seconds,
+        )
+        return result
+
+    def status(self, now: Optional[datetime] = None) -> SyncResult:
+        """当前积压：水位线之后的行数与其中最早一条变更距今的秒数。"""
+        now = now or datetime.utcnow()
+        state = self._state()
+        pending_filter = self._changed_since(state).whereclause
+        item = models.KnowledgeBaseItem
+        query = select(func.count(item.kb_id), func.min(item.updated_at))
+        if pending_filter is not None:
+            query = query.where(pending_filter)
+        pending, oldest = self.db.execute(query).one()
+        lag = max(0.0, (now - oldest).total_seconds()) if oldest else 0.0
+        return SyncResult(0, 0, pending, lag, state.watermark)
+
+    def _state(self, lock: bool = False) -> models.SyncState:
+        state = self.db.get(models.SyncState, SYNC_NAME, with_for_update=True if lock else None)
+        if state is None:
+            state = models.SyncState(name=SYNC_NAME, last_synced=0)
+            self.db.add(state)
+            self.db.flush()
+        return state
+
+    @staticmethod
+    def _changed_since(state: models.SyncState):
+        item = models.KnowledgeBaseItem
+        query = select(
+            item.kb_id,
+            item.kb_type,
+            item.content_text,
+            item.is_active,
+            item.updated_at,
+            item.milvus_vector_id,
+            item.vectors_synced_at,
+        ).order_by(item.updated_at, item.kb_id)
+        if state.watermark is not None:
+            query = query.where(
+                or_(
+                    item.updated_at > state.watermark,
+                    and_(item.updated_at == state.watermark, item.kb_id > (state.last_key or "")),
+                )
+            )
+        return query
+
+    def _upsert_vectors(self, rows) -> None:
+        embed_fn = self.embed_fn or ModelManager.get_instance().embed_texts
+        records: List[KnowledgeRecord] = [
+            KnowledgeRecord(row.kb_id, row.kb_type, row.content_text) for row in rows
+        ]
+        vectors = embed_fn([record.content_text for record in records])
+        vector_ids = write_vectors(self._get_collection(len(vectors[0])), records, vectors)
+        changed = [
+            {"key": row.kb_id, "vector_id": vector_id}
+            for row, vector_id in zip(rows, vector_ids)
+            if row.milvus_vector_id != vector_id
+        ]
+        if changed:
+            # 只回写向量 ID，不改 updated_at，避免下一轮把这些行再同步一次
+            item = models.KnowledgeBaseItem
+            self.db.execute(
+                update(item.__table__)
+                .where(item.__table__.c.kb_id == bindparam("key"))
+                .values(milvus_vector_id=bindparam("vector_id")),
+                changed,
+            )
+
+    def _get_collection(self, dim: Optional[int] = None):
+        if self.collection is None:
+            self.collection = open_collection(dim)
+        return self.collection
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from app.config.logging_config import setup_logging
+    from app.db.session import db_session
+
+    setup_logging()
+    parser = argparse.ArgumentParser(description="知识库增量同步")
+    parser.add_argument("--status", action="store_true", help="只输出积压与延迟")
+    args = parser.parse_args()
+    with db_session() as session:
+        sync = KnowledgeBaseSync(session)
+        result = sync.status() if args.status else sync.run()
+    print(
+        f"upsert {result.upserted} 条，删除 {result.deleted} 条，"
+        f"待同步 {result.pending} 条，延迟 {result.lag_seconds:.0f}s，水位线 {result.watermark}"
+    )
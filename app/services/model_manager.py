@@ -1,13 +1,22 @@
 import hashlib
 import json
 import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from threading import Lock
-from typing import Dict, List, Optional
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
 
 import numpy as np
 
 from app.config.settings import get_settings
+from app.services.cache import (
+    EmbeddingCache,
+    GenerationCache,
+    get_embedding_cache,
+    get_generation_cache,
+)
 
 try:
     import torch
@@ -29,15 +38,69 @@ except Exception:  # pragma: no cover
     HAS_XGBOOST = False
 
 try:
-    from openai import OpenAI
+    from openai import APIConnectionError, OpenAI
 
     HAS_OPENAI = True
 except Exception:  # pragma: no cover
     OpenAI = None
+    APIConnectionError = None
     HAS_OPENAI = False
 
 logger = logging.getLogger(__name__)
 
+SENTENCE_DELIMITERS = "。！？；"
+GENERATION_SYSTEM_PROMPT = "你是资深隐私合规专家。"
+GENERATION_TEMPERATURE = 0.2
+# 400 错误中表示批次条数或输入长度超限的关键词，其余 400（鉴权、模型名、参数错误等）拆分也无济于事
+BATCH_LIMIT_HINTS = ("batch", "too large", "too long", "too many", "exceed", "larger than", "length")
+
+
+class TextSpan(NamedTuple):
+    """原文中的一个片段，start/end 为字符下标（左闭右开）。"""
+
+    text: str
+    start: int
+    end: int
+
+
+class _RetryBudget:
+    """一批请求共享的重试次数上限，避免服务端异常时重试量随请求数放大。"""
+
+    def __init__(self, total: int):
+        self._remaining = total
+        self._lock = Lock()
+
+    def acquire(self) -> bool:
+        with self._lock:
+            if self._remaining <= 0:
+                return False
+            self._remaining -= 1
+            return True
+
+
+def _strip_span(text: str, start: int, end: int) -> Optional[TextSpan]:
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    if start >= end:
+        return None
+    return TextSpan(text[start:end], start, end)
+
+
+def _is_batch_limit_error(exc: Exception, status: Optional[int]) -> bool:
+    if status == 413:
+        return True
+    if status != 400:
+        return False
+    body = getattr(exc, "body", None)
+    detail = " ".join(
+        str(part)
+        for part in (exc, getattr(exc, "code", None), json.dumps(body, ensure_ascii=False) if body else None)
+        if part
+    ).lower()
+    return any(hint in detail for hint in BATCH_LIMIT_HINTS)
+
 
 class ModelManager:
     """集中管理本地模型与云端推理接口。"""
@@ -52,6 +115,10 @@ class ModelManager:
         self._bert_model = None
         self._risk_model: Optional["xgb.Booster"] = None
         self._openai_client = None
+        self._embedding_cache: Optional[EmbeddingCache] = None
+        self._generation_cache: Optional[GenerationCache] = None
+        self._ready = False
+        self._warmup_timings: Dict[str, float] = {}
 
     # --------- Singleton ----------
     @classmethod
@@ -61,6 +128,46 @@ class ModelManager:
                 cls._instance = cls()
             return cls._instance
 
+    # --------- 预热 ----------
+    def warm_up(self) -> Dict[str, float]:
+        """加载 BERT 与 XGBoost 模型并各跑一次空推理，返回各步骤耗时（秒）。"""
+        timings: Dict[str, float] = {}
+
+        start = time.perf_counter()
+        self._load_transformers()
+        timings["bert_load"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        self.classify_chunks(["我们会收集您的设备信息。"])
+        timings["bert_forward"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        self._load_risk_model()
+        timings["risk_model_load"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        self.predict_risk_levels(np.zeros((1, 3), dtype=np.float32))
+        timings["risk_model_predict"] = time.perf_counter() - start
+
+        self._warmup_timings = timings
+        self._ready = True
+        logger.info(
+            "模型预热完成 pid=%s：%s",
+            os.getpid(),
+            ", ".join(f"{name}={seconds:.2f}s" for name, seconds in timings.items()),
+        )
+        return timings
+
+    def readiness(self) -> Dict[str, Any]:
+        return {
+            "ready": self._ready,
+            "pid": os.getpid(),
+            "device": self.device,
+            "bert_loaded": self._bert_model is not None,
+            "risk_model_loaded": self._risk_model is not None,
+            "timings": dict(self._warmup_timings),
+        }
+
     # --------- BERT Chunker ----------
     def _load_transformers(self):
         if not HAS_TRANSFORMERS:
@@ -68,47 +175,137 @@ class ModelManager:
         if self._tokenizer is None or self._bert_model is None:
             logger.info("加载 BERT 模型：%s", self.settings.bert_model_name)
             self._tokenizer = AutoTokenizer.from_pretrained(self.settings.bert_model_name)
-            self._bert_model = AutoModelForSequenceClassification.from_pretrained(
+            model = AutoModelForSequenceClassification.from_pretrained(
                 self.settings.bert_model_name,
                 num_labels=2,
             ).to(self.device)
+            if self._use_int8():
+                # 动态量化：Linear 层权重转为 int8，激活在推理时按批量化
+                model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+                logger.info("BERT 已启用 int8 动态量化。")
+            self._bert_model = model
         return self._tokenizer, self._bert_model
 
-    def segment_policy_text(self, text: str) -> List[str]:
-        """基于 tokenizer 将文本切分成子块。"""
-        text = text.strip()
-        if not text:
+    def _use_int8(self) -> bool:
+        return self.settings.bert_inference_profile == "int8" and self.device == "cpu"
+
+    def _inference_context(self):
+        if self.settings.bert_inference_profile == "int8":
+            return torch.inference_mode()
+        return torch.no_grad()
+
+    def configure_threads(self, concurrency: Optional[int] = None) -> int:
+        """按 CPU 核数 / worker 并发数设置 torch 线程数，避免多个 prefork 进程争抢核心。
+
+        仅在启用 int8 推理配置或显式设置 `torch_num_threads` 时生效，返回实际线程数（0 表示未设置）。
+        """
+        if not HAS_TRANSFORMERS:
+            return 0
+        threads = self.settings.torch_num_threads
+        if threads <= 0:
+            if self.settings.bert_inference_profile != "int8":
+                return 0
+            cores = os.cpu_count() or 1
+            workers = concurrency or self.settings.celery_worker_concurrency or cores
+            threads = max(1, cores // workers)
+        torch.set_num_threads(threads)
+        logger.info("torch intra-op 线程数设置为 %s（pid=%s）", threads, os.getpid())
+        return threads
+
+    def segment_policy_text(self, text: str, stride: Optional[int] = None) -> List[TextSpan]:
+        """基于 tokenizer 的 offset mapping 将文本切分成子块，直接返回原文片段及其位置。
+
+        `stride` 为相邻窗口重叠的 token 数，默认取 `bert_chunk_stride`；
+        窗口结尾会回退到最近的句末标点（。！？；），避免把一句话截断在两个片段中。
+        """
+        if not text.strip():
             return []
+        if stride is None:
+            stride = self.settings.bert_chunk_stride
         tokenizer, _ = self._load_transformers()
         if tokenizer:
-            tokens = tokenizer.encode(text)
-            max_len = self.settings.bert_max_chunk_tokens
-            segments = []
-            for i in range(0, len(tokens), max_len):
-                sub_tokens = tokens[i : i + max_len]
-                segment = tokenizer.decode(sub_tokens, skip_special_tokens=True)
-                segments.append(segment.strip())
-            return segments
+            if getattr(tokenizer, "is_fast", False):
+                encoding = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)
+                offsets = [(start, end) for start, end in encoding["offset_mapping"] if end > start]
+            else:
+                # 慢速 tokenizer 没有 offset mapping，中文 BERT 近似一字一 token
+                offsets = [(i, i + 1) for i, char in enumerate(text) if not char.isspace()]
+            # 预留 [CLS] / [SEP] 两个位置，保证分类时不会被截断
+            window = max(1, self.settings.bert_max_chunk_tokens - 2)
+            return self._window_spans(text, offsets, window, stride)
         # fallback：按段落拆分
-        return [part.strip() for part in text.split("\n\n") if part.strip()]
+        spans = []
+        cursor = 0
+        while cursor <= len(text):
+            boundary = text.find("\n\n", cursor)
+            if boundary == -1:
+                boundary = len(text)
+            span = _strip_span(text, cursor, boundary)
+            if span:
+                spans.append(span)
+            cursor = boundary + 2
+        return spans
+
+    @staticmethod
+    def _window_spans(
+        text: str,
+        offsets: Sequence[Tuple[int, int]],
+        window: int,
+        stride: int,
+    ) -> List[TextSpan]:
+        total = len(offsets)
+        stride = min(max(0, stride), window // 2)
+        spans: List[TextSpan] = []
+        begin = 0
+        while begin < total:
+            end = min(begin + window, total)
+            if end < total:
+                # 只在窗口后半段寻找句末标点，防止片段过短
+                for idx in range(end - 1, begin + window // 2 - 1, -1):
+                    if text[offsets[idx][1] - 1] in SENTENCE_DELIMITERS:
+                        end = idx + 1
+                        break
+            span = _strip_span(text, offsets[begin][0], offsets[end - 1][1])
+            if span:
+                spans.append(span)
+            if end >= total:
+                break
+            begin = max(end - stride, begin + 1)
+        return spans
 
     def classify_chunk(self, text: str) -> Dict[str, float]:
         """返回 chunk 的风险置信度。"""
+        return self.classify_chunks([text])[0]
+
+    def classify_chunks(self, texts: List[str]) -> List[Dict[str, float]]:
+        """批量返回多个 chunk 的风险置信度，结果顺序与输入一致。
+
+        按长度排序后以 `bert_batch_size` 为单位分批推理，每批只 padding 到批内最长序列。
+        """
+        if not texts:
+            return []
         tokenizer, model = self._load_transformers()
         if tokenizer and model:
-            inputs = tokenizer(
-                text,
-                return_tensors="pt",
-                truncation=True,
-                max_length=self.settings.bert_max_chunk_tokens,
-            ).to(self.device)
-            with torch.no_grad():
-                outputs = model(**inputs)
-                score = torch.softmax(outputs.logits, dim=-1)[0, 1].item()
-            return {"score": float(score)}
+            batch_size = max(1, self.settings.bert_batch_size)
+            order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+            scores = [0.0] * len(texts)
+            for start in range(0, len(order), batch_size):
+                batch_ids = order[start : start + batch_size]
+                inputs = tokenizer(
+                    [texts[i] for i in batch_ids],
+                    return_tensors="pt",
+                    padding="longest",
+                    truncation=True,
+                    max_length=self.settings.bert_max_chunk_tokens,
+                ).to(self.device)
+                with self._inference_context():
+                    outputs = model(**inputs)
+                    probs = torch.softmax(outputs.logits, dim=-1)[:, 1].tolist()
+                for i, score in zip(batch_ids, probs):
+                    scores[i] = float(score)
+            return [{"score": score} for score in scores]
         # fallback：长度越大风险越高
-        score = min(0.95, max(0.05, len(text) / 2000))
-        return {"score": score}
+        return [{"score": min(0.95, max(0.05, len(text) / 2000))} for text in texts]
 
     # --------- DashScope Client ----------
     def _get_openai_client(self):
@@ -119,15 +316,115 @@ class ModelManager:
             )
         return self._openai_client
 
+    @property
+    def embedding_cache(self) -> EmbeddingCache:
+        if self._embedding_cache is None:
+            self._embedding_cache = get_embedding_cache()
+        return self._embedding_cache
+
+    @property
+    def generation_cache(self) -> GenerationCache:
+        if self._generation_cache is None:
+            self._generation_cache = get_generation_cache()
+        return self._generation_cache
+
+    def cache_stats(self) -> Dict[str, Dict[str, int]]:
+        return {
+            "embedding": self.embedding_cache.stats(),
+            "generation": self.generation_cache.stats(),
+        }
+
+    @property
+    def embedding_signature(self) -> str:
+        """标识当前向量来源，向量维度或语义变化时该值随之变化。"""
+        if self._get_openai_client():
+            return f"dashscope:{self.settings.dashscope_embedding_model}"
+        return "sha256-fallback"
+
     def embed_text(self, text: str) -> List[float]:
+        return self.embed_texts([text])[0].tolist()
+
+    def embed_texts(self, texts: List[str]) -> np.ndarray:
+        """批量生成向量，返回形状为 (len(texts), dim) 的 float32 矩阵。
+
+        先查缓存，未命中的文本去重后按条数与 token 上限打包成多输入请求。
+        """
         client = self._get_openai_client()
-        if client:
-            response = client.embeddings.create(
-                model=self.settings.dashscope_embedding_model,
-                input=text,
-            )
-            return response.data[0].embedding  # type: ignore[attr-defined]
-        # fallback：使用 hash 生成稳定伪向量
+        if not client:
+            # fallback：使用 hash 生成稳定伪向量
+            return np.asarray([self._hash_embedding(text) for text in texts], dtype=np.float32)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        model_name = self.settings.dashscope_embedding_model
+        vectors: List[Optional[List[float]]] = [
+            self.embedding_cache.get(model_name, text) for text in texts
+        ]
+        pending: Dict[str, List[int]] = {}
+        for idx, vector in enumerate(vectors):
+            if vector is None:
+                pending.setdefault(EmbeddingCache.make_key(model_name, texts[idx]), []).append(idx)
+
+        missing_texts = [texts[ids[0]] for ids in pending.values()]
+        missing_ids = list(pending.values())
+        cursor = 0
+        for batch in self._pack_embedding_batches(missing_texts):
+            for vector in self._request_embeddings(client, batch):
+                self.embedding_cache.set(model_name, missing_texts[cursor], vector)
+                for idx in missing_ids[cursor]:
+                    vectors[idx] = vector
+                cursor += 1
+        return np.asarray(vectors, dtype=np.float32)
+
+    def _pack_embedding_batches(self, texts: List[str]) -> List[List[str]]:
+        # 中文文本按一字一 token 粗略估算
+        max_inputs = max(1, self.settings.embedding_batch_size)
+        max_tokens = self.settings.embedding_batch_max_tokens
+        batches: List[List[str]] = []
+        current: List[str] = []
+        current_tokens = 0
+        for text in texts:
+            tokens = len(text)
+            if current and (len(current) >= max_inputs or current_tokens + tokens > max_tokens):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(text)
+            current_tokens += tokens
+        if current:
+            batches.append(current)
+        return batches
+
+    def _request_embeddings(self, client, texts: List[str]) -> List[List[float]]:
+        max_retries = self.settings.embedding_max_retries
+        for attempt in range(max_retries + 1):
+            try:
+                response = client.with_options(max_retries=0).embeddings.create(
+                    model=self.settings.dashscope_embedding_model,
+                    input=texts,
+                )
+                data = sorted(response.data, key=lambda item: item.index)
+                return [item.embedding for item in data]  # type: ignore[attr-defined]
+            except Exception as exc:
+                status = getattr(exc, "status_code", None)
+                if len(texts) > 1 and _is_batch_limit_error(exc, status):
+                    # 批次条数或长度超限时对半拆分重试
+                    mid = len(texts) // 2
+                    logger.warning("向量批次被拒绝（%s），拆分为 %s + %s 条。", status, mid, len(texts) - mid)
+                    return self._request_embeddings(client, texts[:mid]) + self._request_embeddings(
+                        client, texts[mid:]
+                    )
+                retryable = status == 429 or (status is not None and status >= 500)
+                if APIConnectionError is not None and isinstance(exc, APIConnectionError):
+                    retryable = True
+                if not retryable or attempt >= max_retries:
+                    raise
+                delay = self.settings.embedding_retry_backoff * (2**attempt)
+                logger.warning("向量接口调用失败（%s），%.1fs 后重试：%s", status, delay, exc)
+                time.sleep(delay)
+        return []
+
+    @staticmethod
+    def _hash_embedding(text: str) -> List[float]:
         digest = hashlib.sha256(text.encode("utf-8")).digest()
         vector = []
         for i in range(0, len(digest), 4):
@@ -135,19 +432,97 @@ class ModelManager:
             vector.append(int.from_bytes(chunk, "little") / 2**32)
         return vector
 
-    def generate_text(self, prompt: str) -> str:
+    def generate_text(self, prompt: str, use_cache: bool = True) -> str:
+        return self.generate_texts([prompt], use_cache=use_cache)[0]
+
+    def generate_texts(
+        self,
+        prompts: List[str],
+        use_cache: bool = True,
+        on_progress: Optional[Callable[[int, int], None]] = None,
+        on_result: Optional[Callable[[int, str], None]] = None,
+    ) -> List[str]:
+        """并发生成多个 prompt 的回复，结果顺序与输入一致。
+
+        命中生成缓存的 prompt 不再请求模型；`use_cache=False` 时跳过读取缓存强制重新生成，
+        新结果仍会写回缓存。并发数受 `llm_max_concurrency` 限制，整批共享
+        `llm_retry_budget` 次重试；最终失败的请求返回空字符串，不影响其余结果。
+        `on_progress(done, total)` 与 `on_result(index, text)` 在调用线程中随结果返回而触发。
+        """
         client = self._get_openai_client()
-        if client:
-            response = client.chat.completions.create(
-                model=self.settings.dashscope_moe_model,
-                messages=[
-                    {"role": "system", "content": "你是资深隐私合规专家。"},
-                    {"role": "user", "content": prompt},
-                ],
-                temperature=0.2,
-            )
-            return response.choices[0].message.content or ""
-        return f"[MOCK RESPONSE]\n{prompt[:400]}"
+        if not client:
+            results = [f"[MOCK RESPONSE]\n{prompt[:400]}" for prompt in prompts]
+            if on_result:
+                for idx, text in enumerate(results):
+                    on_result(idx, text)
+            return results
+        model_name = self.settings.dashscope_moe_model
+        cache_args = (model_name, GENERATION_SYSTEM_PROMPT)
+        results: List[Optional[str]] = [
+            self.generation_cache.get(*cache_args, prompt, GENERATION_TEMPERATURE) if use_cache else None
+            for prompt in prompts
+        ]
+        missing = [idx for idx, result in enumerate(results) if result is None]
+        done = len(prompts) - len(missing)
+        if on_progress:
+            on_progress(done, len(prompts))
+        if on_result:
+            for idx, result in enumerate(results):
+                if result is not None:
+                    on_result(idx, result)
+        if not missing:
+            return results  # type: ignore[return-value]
+        budget = _RetryBudget(self.settings.llm_retry_budget)
+
+        def _generate(prompt: str) -> str:
+            try:
+                text = self._complete_with_retry(client, prompt, budget)
+            except Exception as exc:
+                logger.error("LLM 生成失败，跳过该片段：%s", exc)
+                return ""
+            if text:
+                self.generation_cache.set(*cache_args, prompt, GENERATION_TEMPERATURE, text)
+            return text
+
+        workers = max(1, min(self.settings.llm_max_concurrency, len(missing)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="llm") as pool:
+            generated = pool.map(_generate, [prompts[idx] for idx in missing])
+            for idx, text in zip(missing, generated):
+                results[idx] = text
+                done += 1
+                if on_progress:
+                    on_progress(done, len(prompts))
+                if on_result:
+                    on_result(idx, text)
+        return results  # type: ignore[return-value]
+
+    def _complete_with_retry(self, client, prompt: str, budget: _RetryBudget) -> str:
+        attempt = 0
+        while True:
+            try:
+                response = client.with_options(
+                    timeout=self.settings.llm_request_timeout,
+                    max_retries=0,
+                ).chat.completions.create(
+                    model=self.settings.dashscope_moe_model,
+                    messages=[
+                        {"role": "system", "content": GENERATION_SYSTEM_PROMPT},
+                        {"role": "user", "content": prompt},
+                    ],
+                    temperature=GENERATION_TEMPERATURE,
+                )
+                return response.choices[0].message.content or ""
+            except Exception as exc:
+                status = getattr(exc, "status_code", None)
+                retryable = status == 429 or (status is not None and status >= 500)
+                if APIConnectionError is not None and isinstance(exc, APIConnectionError):
+                    retryable = True
+                if not retryable or not budget.acquire():
+                    raise
+                delay = self.settings.llm_retry_backoff * (2**attempt)
+                attempt += 1
+                logger.warning("LLM 调用失败（%s），%.1fs 后重试：%s", status, delay, exc)
+                time.sleep(delay)
 
     # --------- XGBoost ----------
     def _load_risk_model(self):
@@ -164,22 +539,27 @@ class ModelManager:
         return self._risk_model
 
     def predict_risk_level(self, features: List[float]) -> str:
+        return self.predict_risk_levels(np.asarray([features], dtype=np.float32))[0]
+
+    def predict_risk_levels(self, feature_matrix: np.ndarray) -> List[str]:
+        """一次性为所有片段评估风险等级，返回值与矩阵的行一一对应。"""
+        matrix = np.asarray(feature_matrix, dtype=np.float32)
+        if matrix.ndim == 1:
+            matrix = matrix.reshape(1, -1)
+        if matrix.shape[0] == 0:
+            return []
         model = self._load_risk_model()
         if model:
-            dmatrix = xgb.DMatrix(np.array([features]))
-            prob = model.predict(dmatrix)[0]
-            if prob > 0.66:
-                return "high"
-            if prob > 0.33:
-                return "medium"
-            return "low"
+            probs = np.asarray(model.inplace_predict(matrix)).reshape(-1)
+            return self._map_levels(probs, high=0.66, medium=0.33)
         # fallback：基于特征简单打分
-        score = sum(features) / (len(features) or 1)
-        if score > 0.7:
-            return "high"
-        if score > 0.4:
-            return "medium"
-        return "low"
+        scores = matrix.mean(axis=1) if matrix.shape[1] else np.zeros(matrix.shape[0])
+        return self._map_levels(scores, high=0.7, medium=0.4)
+
+    @staticmethod
+    def _map_levels(scores: np.ndarray, high: float, medium: float) -> List[str]:
+        levels = np.select([scores > high, scores > medium], ["high", "medium"], default="low")
+        return levels.tolist()
 
     # --------- Prompt 构造 ----------
     def build_generation_prompt(
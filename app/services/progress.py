@@ -0,0 +1,172 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from threading import Lock
+from typing import Any, AsyncIterator, Dict, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app import models
+from app.config.settings import get_settings
+from app.services.cache import HAS_REDIS, LRUCache, RedisStore, redis
+
+try:
+    import redis.asyncio as aioredis
+except Exception:  # pragma: no cover
+    aioredis = None
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = ("completed", "failed")
+
+
+class ProgressStore:
+    """以业务 task_id 为键的任务状态快照：worker 写入，状态查询接口一次读取。
+
+    值为 JSON（status、progress、stage 及阶段附加信息），后端为 Redis；
+    未安装 redis 或配置为 memory 时退化为进程内 LRU，仅适用于单进程开发环境。
+    配置了 `redis_url` 时每次写入同时发布到 `ppna:events:{task_id}` 频道，
+    事件格式为 {"event": "progress" | "risk", "data": {...}}。
+    """
+
+    KEY_PREFIX = "ppna:progress:"
+    COUNTER_PREFIX = "ppna:counter:"
+    CHANNEL_PREFIX = "ppna:events:"
+
+    def __init__(self, backend, ttl: int, redis_url: Optional[str] = None):
+        self.backend = backend
+        self.ttl = ttl
+        self.redis_url = redis_url
+        self._publisher = redis.Redis.from_url(redis_url) if redis_url else None
+
+    def publish(
+        self,
+        task_id: str,
+        status: str,
+        progress: int,
+        stage: Optional[str] = None,
+        source_task_id: Optional[str] = None,
+        **meta,
+    ) -> bytes:
+        payload = {
+            "task_id": task_id,
+            "status": status,
+            "progress": progress,
+            "stage": stage,
+            "updated_at": time.time(),
+            **meta,
+        }
+        if source_task_id:
+            payload["source_task_id"] = source_task_id
+        raw = json.dumps(payload, ensure_ascii=False, sort_keys=True).encode("utf-8")
+        self.backend.set(self.KEY_PREFIX + task_id, raw, self.ttl)
+        self._broadcast(task_id, "progress", payload)
+        return raw
+
+    def publish_risk(self, task_id: str, risk: Dict[str, Any]) -> None:
+        """推送生成阶段陆续产出的单条风险，只发布事件，不写入快照。"""
+        self._broadcast(task_id, "risk", risk)
+
+    def advance(self, task_id: str, counter: str) -> Optional[int]:
+        """把任务的某个计数（如已完成的批次数）加一并返回新值，写入失败时返回 None。"""
+        return self.backend.incr(f"{self.COUNTER_PREFIX}{task_id}:{counter}", self.ttl)
+
+    def get_raw(self, task_id: str) -> Optional[bytes]:
+        return self.backend.get(self.KEY_PREFIX + task_id)
+
+    def _broadcast(self, task_id: str, event: str, data: Dict[str, Any]) -> None:
+        if self._publisher is None:
+            return
+        message = json.dumps({"event": event, "data": data}, ensure_ascii=False)
+        try:
+            self._publisher.publish(self.CHANNEL_PREFIX + task_id, message)
+        except redis.RedisError as exc:
+            logger.warning("发布任务 %s 的进度事件失败：%s", task_id, exc)
+
+    async def events(self, task_id: str, poll_interval: float) -> AsyncIterator[Optional[Dict]]:
+        """订阅任务事件。订阅建立后先产出一个 None，调用方此时再读取快照可避免漏掉事件；
+        之后每条事件产出一次，`poll_interval` 内无事件时产出 None。
+
+        没有 Redis 时按 `poll_interval` 轮询快照，只能推送进度变化。
+        """
+        if self.redis_url is None:
+            yield None
+            last = self.get_raw(task_id)
+            while True:
+                await asyncio.sleep(poll_interval)
+                raw = self.get_raw(task_id)
+                if raw is not None and raw != last:
+                    last = raw
+                    yield {"event": "progress", "data": json.loads(raw)}
+                else:
+                    yield None
+
+        client = aioredis.Redis.from_url(self.redis_url)
+        pubsub = client.pubsub()
+        try:
+            await pubsub.subscribe(self.CHANNEL_PREFIX + task_id)
+            yield None
+            while True:
+                message = await pubsub.get_message(
+                    ignore_subscribe_messages=True, timeout=poll_interval
+                )
+                yield json.loads(message["data"]) if message else None
+        finally:
+            await pubsub.aclose()
+            await client.aclose()
+
+
+def etag_for(raw: bytes) -> str:
+    return '"' + hashlib.sha1(raw).hexdigest()[:20] + '"'
+
+
+def read_status(db: Session, task_id: str) -> Optional[bytes]:
+    """读取任务状态快照，未命中时只查询 detection_tasks 的三个列并回填。
+
+    挂在同内容任务上的重复提交在结束前读取源任务的进度。
+    """
+    store = get_progress_store()
+    raw = store.get_raw(task_id)
+    if raw is None:
+        task = models.DetectionTask
+        row = db.execute(
+            select(task.status, task.progress, task.source_task_id).where(task.task_id == task_id)
+        ).first()
+        if row is None:
+            return None
+        raw = store.publish(task_id, row.status, row.progress, source_task_id=row.source_task_id)
+
+    payload = json.loads(raw)
+    source_task_id = payload.get("source_task_id")
+    if source_task_id and payload["status"] not in TERMINAL_STATUSES:
+        source_raw = read_status(db, source_task_id)
+        if source_raw is not None:
+            source = json.loads(source_raw)
+            source.update(task_id=task_id, source_task_id=source_task_id)
+            raw = json.dumps(source, ensure_ascii=False, sort_keys=True).encode("utf-8")
+    return raw
+
+
+_store: Optional[ProgressStore] = None
+_store_lock = Lock()
+
+
+def get_progress_store() -> ProgressStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            settings = get_settings()
+            if settings.progress_backend == "redis" and HAS_REDIS:
+                _store = ProgressStore(
+                    RedisStore(settings.progress_redis_url),
+                    settings.progress_ttl,
+                    redis_url=settings.progress_redis_url,
+                )
+            else:
+                if settings.progress_backend == "redis":
+                    logger.warning("未安装 redis，任务进度只保存在当前进程内。")
+                _store = ProgressStore(LRUCache(4 * 1024 * 1024), settings.progress_ttl)
+        return _store
@@ -1,10 +1,15 @@
 import logging
-from typing import Dict, List, Optional
+import os
+import time
+from threading import Lock
+from typing import Dict, List, Optional, Sequence
 
+import numpy as np
 from sqlalchemy.orm import Session
 
 from app import models
 from app.config.settings import get_settings
+from app.services.vector_index import LocalVectorIndex, get_local_index
 
 logger = logging.getLogger(__name__)
 
@@ -19,29 +24,118 @@ except Exception:  # pragma: no cover
     HAS_MILVUS = False
 
 
+class MilvusRegistry:
+    """进程级的 Milvus 连接与 collection 句柄。
+
+    每个 worker 进程只建立一次连接并加载一次 collection，之后按
+    `milvus_health_check_interval` 做健康检查；检查或查询失败后断开并重连，
+    重连失败时在 `milvus_reconnect_backoff` 秒内直接走数据库回退。
+    """
+
+    ALIAS = "ppna"
+
+    def __init__(self):
+        self.settings = get_settings()
+        self._lock = Lock()
+        self._collection: Optional["Collection"] = None
+        self._pid: Optional[int] = None
+        self._last_check = 0.0
+        self._retry_after = 0.0
+
+    def get_collection(self) -> Optional["Collection"]:
+        if not HAS_MILVUS:
+            return None
+        with self._lock:
+            if self._pid != os.getpid():
+                # fork 出的子进程不能复用父进程的 gRPC 连接
+                self._collection = None
+                self._pid = os.getpid()
+                self._retry_after = 0.0
+            now = time.monotonic()
+            if self._collection is not None:
+                if now - self._last_check < self.settings.milvus_health_check_interval:
+                    return self._collection
+                if self._is_healthy():
+                    self._last_check = now
+                    return self._collection
+                logger.warning("Milvus 健康检查失败，准备重连。")
+                self._disconnect()
+            if now < self._retry_after:
+                return None
+            self._collection = self._connect()
+            self._last_check = now
+            if self._collection is None:
+                self._retry_after = now + self.settings.milvus_reconnect_backoff
+            return self._collection
+
+    def mark_unhealthy(self) -> None:
+        with self._lock:
+            self._disconnect()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._collection is not None:
+                logger.info("断开 Milvus 连接。")
+            self._disconnect()
+
+    def _connect(self) -> Optional["Collection"]:
+        try:
+            connections.connect(
+                alias=self.ALIAS,
+                host=self.settings.milvus_host,
+                port=self.settings.milvus_port,
+            )
+            if not utility.has_collection(self.settings.milvus_collection, using=self.ALIAS):
+                logger.warning("Milvus 不存在 collection：%s", self.settings.milvus_collection)
+                return None
+            collection = Collection(self.settings.milvus_collection, using=self.ALIAS)
+            collection.load()
+            logger.info("Milvus collection 已加载：%s", self.settings.milvus_collection)
+            return collection
+        except Exception as exc:  # pragma: no cover
+            logger.warning("连接 Milvus 失败，使用数据库回退。%s", exc)
+            return None
+
+    def _is_healthy(self) -> bool:
+        try:
+            return utility.has_collection(self.settings.milvus_collection, using=self.ALIAS)
+        except Exception:  # pragma: no cover
+            return False
+
+    def _disconnect(self) -> None:
+        self._collection = None
+        if HAS_MILVUS:
+            try:
+                connections.disconnect(self.ALIAS)
+            except Exception:  # pragma: no cover
+                pass
+
+
+_registry = MilvusRegistry()
+
+
+def get_milvus_registry() -> MilvusRegistry:
+    return _registry
+
+
 class RagRetriever:
-    """封装 Milvus 查询，若不可用则回退到 PostgreSQL。"""
+    """封装 Milvus 查询；不可用时依次回退到本地向量索引和 PostgreSQL。"""
 
     def __init__(self, db: Session):
         self.db = db
         self.settings = get_settings()
-        self.collection: Optional["Collection"] = None
-        if HAS_MILVUS:
-            try:
-                connections.connect(
-                    alias="default",
-                    host=self.settings.milvus_host,
-                    port=self.settings.milvus_port,
-                )
-                if utility.has_collection(self.settings.milvus_collection):
-                    self.collection = Collection(self.settings.milvus_collection)
-                    self.collection.load()
-                    logger.info("Milvus collection 已加载：%s", self.settings.milvus_collection)
-                else:
-                    logger.warning("Milvus 不存在 collection：%s", self.settings.milvus_collection)
-            except Exception as exc:  # pragma: no cover
-                logger.warning("连接 Milvus 失败，使用数据库回退。%s", exc)
-                self.collection = None
+        self.registry = get_milvus_registry()
+        self._local_index: Optional[LocalVectorIndex] = None
+
+    @property
+    def collection(self) -> Optional["Collection"]:
+        return self.registry.get_collection()
+
+    @property
+    def local_index(self) -> Optional[LocalVectorIndex]:
+        if self._local_index is None and self.settings.local_index_enabled:
+            self._local_index = get_local_index()
+        return self._local_index
 
     def search(
         self,
@@ -49,33 +143,115 @@ class RagRetriever:
         kb_type: str,
         top_k: int = 3,
     ) -> List[Dict[str, str]]:
-        if self.collection:
+        return self.search_batch([vector], [kb_type], top_k=top_k)[0][kb_type]
+
+    def search_batch(
+        self,
+        vectors: Sequence[Sequence[float]],
+        kb_types: Sequence[str],
+        top_k: int = 3,
+    ) -> List[Dict[str, List[Dict[str, str]]]]:
+        """批量检索：每个 kb_type 只发起一次 Milvus 请求，返回与 vectors 等长的命中列表。
+
+        返回值第 i 项为 {kb_type: hits}，对应第 i 个向量。
+        """
+        results: List[Dict[str, List[Dict[str, str]]]] = [
+            {kb_type: [] for kb_type in kb_types} for _ in range(len(vectors))
+        ]
+        if not results:
+            return results
+        data = np.asarray(vectors, dtype=np.float32).tolist()
+        for kb_type in kb_types:
+            per_vector = self._milvus_search(data, kb_type, top_k)
+            missing = [idx for idx, hits in enumerate(per_vector) if not hits]
+            if missing:
+                local_hits = self._local_search([data[idx] for idx in missing], kb_type, top_k)
+                for idx, hits in zip(missing, local_hits):
+                    per_vector[idx] = hits
+            fallback: Optional[List[Dict[str, str]]] = None
+            for idx, hits in enumerate(per_vector):
+                if not hits:
+                    if fallback is None:
+                        fallback = self._db_search(kb_type, top_k)
+                    hits = fallback
+                results[idx][kb_type] = hits
+        return results
+
+    def _milvus_search(
+        self,
+        data: List[List[float]],
+        kb_type: str,
+        top_k: int,
+    ) -> List[List[Dict[str, str]]]:
+        collection = self.collection
+        if collection:
             try:
-                results = self.collection.search(
-                    data=[vector],
+                results = collection.search(
+                    data=data,
                     anns_field="embedding",
                     param={"metric_type": "IP", "params": {"nprobe": 10}},
                     limit=top_k,
                     expr=f"kb_type == \"{kb_type}\"",
                     output_fields=["kb_id", "content"],
                 )
-                hits = []
-                for hit in results[0]:
-                    hits.append(
+                return [
+                    [
                         {
                             "kb_id": hit.entity.get("kb_id"),
                             "title": hit.entity.get("kb_id"),
                             "content": hit.entity.get("content"),
                         }
-                    )
-                if hits:
-                    return hits
+                        for hit in hits
+                    ]
+                    for hits in results
+                ]
             except Exception as exc:  # pragma: no cover
                 logger.warning("Milvus 搜索失败，回退数据库：%s", exc)
+                self.registry.mark_unhealthy()
+        return [[] for _ in data]
+
+    def _local_search(
+        self,
+        data: List[List[float]],
+        kb_type: str,
+        top_k: int,
+    ) -> List[List[Dict[str, str]]]:
+        index = self.local_index
+        if index is None:
+            return [[] for _ in data]
+        try:
+            index.refresh(self.db)
+            ranked = index.search(data, kb_type, top_k)
+        except Exception as exc:
+            logger.warning("本地向量索引检索失败，回退数据库：%s", exc)
+            return [[] for _ in data]
+        kb_ids = {kb_id for hits in ranked for kb_id, _ in hits}
+        if not kb_ids:
+            return [[] for _ in data]
+        contents = dict(
+            self.db.query(models.KnowledgeBaseItem.kb_id, models.KnowledgeBaseItem.content_text)
+            .filter(
+                models.KnowledgeBaseItem.kb_id.in_(kb_ids),
+                models.KnowledgeBaseItem.is_active.isnot(False),
+            )
+            .all()
+        )
+        return [
+            [
+                {"kb_id": kb_id, "title": kb_id, "content": contents[kb_id]}
+                for kb_id, _ in hits
+                if kb_id in contents
+            ]
+            for hits in ranked
+        ]
 
+    def _db_search(self, kb_type: str, top_k: int) -> List[Dict[str, str]]:
         query = (
             self.db.query(models.KnowledgeBaseItem)
-            .filter(models.KnowledgeBaseItem.kb_type == kb_type)
+            .filter(
+                models.KnowledgeBaseItem.kb_type == kb_type,
+                models.KnowledgeBaseItem.is_active.isnot(False),
+            )
             .order_by(models.KnowledgeBaseItem.updated_at.desc())
             .limit(top_k)
             .all()
@@ -84,4 +260,3 @@ class RagRetriever:
             {"kb_id": item.kb_id, "title": item.kb_id, "content": item.content_text}
             for item in query
         ]
-
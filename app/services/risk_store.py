@@ -0,0 +1,233 @@
+import logging
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import func, insert, or_, select
+from sqlalchemy.orm import Session, selectinload
+
+from app import models
+from app.schemas import (
+    CaseItem,
+    FragmentPosition,
+    RegulationItem,
+    RiskDetail,
+    RiskListItem,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class RiskStore:
+    """risk_details 及法规、案例关联表的读写。
+
+    写入时三张表各一次批量 INSERT；读取时用 selectinload 一次取回关联行，
+    支持按等级、类别、引用的知识库条目和时间范围筛选并分页。
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def save(self, report_id: str, risk_details: Sequence[RiskDetail]) -> None:
+        self.save_rows(report_id, [detail.model_dump() for detail in risk_details])
+
+    def save_rows(self, report_id: str, risk_details: Sequence[Dict[str, Any]]) -> None:
+        """批量写入一份报告的风险项，接受 RiskDetail.model_dump() 结构的字典。"""
+        details, regulations, cases = [], [], []
+        for position, detail in enumerate(risk_details):
+            detail_id = str(uuid.uuid4())
+            fragment_position = detail["fragment_position"]
+            details.append(
+                {
+                    "detail_id": detail_id,
+                    "report_id": report_id,
+                    "position": position,
+                    "risk_id": detail["risk_id"],
+                    "category": detail["category"],
+                    "level": detail["level"],
+                    "policy_fragment": detail["policy_fragment"],
+                    "start_index": fragment_position["start_index"],
+                    "end_index": fragment_position["end_index"],
+                    "risk_description": detail["risk_description"],
+                    "rectification_suggestion": detail["rectification_suggestion"],
+                    "handling_status": detail.get("handling_status", "untreated"),
+                }
+            )
+            regulations.extend(
+                {"detail_id": detail_id, "position": idx, **item}
+                for idx, item in enumerate(detail["violated_regulations"])
+            )
+            cases.extend(
+                {"detail_id": detail_id, "position": idx, **item}
+                for idx, item in enumerate(detail["related_cases"])
+            )
+        for model, rows in (
+            (models.RiskDetailRecord, details),
+            (models.RiskRegulation, regulations),
+            (models.RiskCase, cases),
+        ):
+            if rows:
+                self.db.execute(insert(model), rows)
+
+    def load(self, report_id: str) -> List[RiskDetail]:
+        _, records = self._fetch(report_id=report_id)
+        return [self._to_detail(record) for record in records]
+
+    def page_for_report(
+        self,
+        report_id: str,
+        level: Optional[str] = None,
+        category: Optional[str] = None,
+        offset: int = 0,
+        limit: Optional[int] = None,
+    ) -> Tuple[int, List[RiskDetail]]:
+        total, records = self._fetch(
+            report_id=report_id, level=level, category=category, offset=offset, limit=limit
+        )
+        return total, [self._to_detail(record) for record in records]
+
+    def search(
+        self,
+        level: Optional[str] = None,
+        category: Optional[str] = None,
+        kb_id: Optional[str] = None,
+        app_name: Optional[str] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        offset: int = 0,
+        limit: int = 50,
+    ) -> Tuple[int, List[RiskListItem]]:
+        """跨报告查询风险项，按检测时间倒序，例如上月所有引用 reg_001 的高风险。"""
+        total, records = self._fetch(
+            level=level,
+            category=category,
+            kb_id=kb_id,
+            app_name=app_name,
+            since=since,
+            until=until,
+            offset=offset,
+            limit=limit,
+        )
+        items = [
+            RiskListItem(
+                **self._to_detail(record).model_dump(),
+                report_id=record.report_id,
+                app_name=record.report.app_name,
+                detection_time=record.report.detection_time,
+            )
+            for record in records
+        ]
+        return total, items
+
+    def _fetch(
+        self,
+        report_id: Optional[str] = None,
+        level: Optional[str] = None,
+        category: Optional[str] = None,
+        kb_id: Optional[str] = None,
+        app_name: Optional[str] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        offset: int = 0,
+        limit: Optional[int] = None,
+    ) -> Tuple[int, List[models.RiskDetailRecord]]:
+        record = models.RiskDetailRecord
+        conditions = []
+        if report_id is not None:
+            conditions.append(record.report_id == report_id)
+        if level:
+            conditions.append(record.level == level)
+        if category:
+            conditions.append(record.category == category)
+        if kb_id:
+            conditions.append(
+                or_(
+                    record.regulations.any(models.RiskRegulation.kb_id == kb_id),
+                    record.cases.any(models.RiskCase.kb_id == kb_id),
+                )
+            )
+        if app_name or since or until:
+            report = models.Report
+            report_conditions = []
+            if app_name:
+                report_conditions.append(report.app_name == app_name)
+            if since:
+                report_conditions.append(report.detection_time >= since)
+            if until:
+                report_conditions.append(report.detection_time < until)
+            conditions.append(record.report.has(*report_conditions))
+
+        total = self.db.scalar(select(func.count()).select_from(record).where(*conditions))
+        query = (
+            select(record)
+            .where(*conditions)
+            .options(selectinload(record.regulations), selectinload(record.cases))
+        )
+        if report_id is not None:
+            query = query.order_by(record.position)
+        else:
+            query = (
+                query.join(record.report)
+                .options(selectinload(record.report))
+                .order_by(models.Report.detection_time.desc(), record.position)
+            )
+        if offset:
+            query = query.offset(offset)
+        if limit is not None:
+            query = query.limit(limit)
+        return total or 0, list(self.db.scalars(query))
+
+    @staticmethod
+    def _to_detail(record: models.RiskDetailRecord) -> RiskDetail:
+        return RiskDetail(
+            risk_id=record.risk_id,
+            category=record.category,
+            level=record.level,  # type: ignore[arg-type]
+            policy_fragment=record.policy_fragment,
+            fragment_position=FragmentPosition(
+                start_index=record.start_index, end_index=record.end_index
+            ),
+            violated_regulations=[
+                RegulationItem(kb_id=item.kb_id, title=item.title, excerpt=item.excerpt)
+                for item in record.regulations
+            ],
+            related_cases=[
+                CaseItem(kb_id=item.kb_id, title=item.title, penalty=item.penalty)
+                for item in record.cases
+            ],
+            risk_description=record.risk_description,
+            rectification_suggestion=record.rectification_suggestion,
+            handling_status=record.handling_status,  # type: ignore[arg-type]
+        )
+
+
+def backfill_risk_details(db: Session, batch_size: int = 200) -> int:
+    """把仍只存在 risk_details_json 中的历史报告拆分写入 risk_details，返回处理的报告数。"""
+    store = RiskStore(db)
+    migrated = 0
+    last_id = ""
+    has_rows = select(models.RiskDetailRecord.report_id).where(
+        models.RiskDetailRecord.report_id == models.Report.report_id
+    )
+    while True:
+        reports = db.scalars(
+            select(models.Report)
+            .where(
+                models.Report.report_id > last_id,
+                models.Report.risk_details_json.isnot(None),
+                ~has_rows.exists(),
+            )
+            .order_by(models.Report.report_id)
+            .limit(batch_size)
+        ).all()
+        if not reports:
+            break
+        for report in reports:
+            store.save_rows(report.report_id, report.risk_details_json or [])
+            if report.app_name is None:
+                report.app_name = (report.basic_info or {}).get("app_name")
+        db.commit()
+        last_id = reports[-1].report_id
+        migrated += len(reports)
+        logger.info("已回填 %s 份报告的风险明细。", migrated)
+    return migrated
@@ -0,0 +1,258 @@
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from pathlib import Path
+from threading import Lock
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app import models
+from app.config.settings import get_settings
+from app.services.model_manager import ModelManager
+
+logger = logging.getLogger(__name__)
+
+EmbedFn = Callable[[List[str]], np.ndarray]
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class _Partition:
+    """单个 kb_type 的向量矩阵，行与 ids 一一对应。"""
+
+    def __init__(self, ids: List[str], matrix: np.ndarray):
+        self.ids = ids
+        self.matrix = matrix
+        self.positions = {kb_id: row for row, kb_id in enumerate(ids)}
+
+
+class LocalVectorIndex:
+    """由知识库构建的进程内向量索引，作为 Milvus 不可用时的语义检索回退。
+
+    每个 kb_type 一个已 L2 归一化的 float32 矩阵，以 .npy memmap 形式保存在
+    `index_dir` 下，多个 worker 进程可共享同一份文件。`refresh` 只重新嵌入
+    updated_at 不早于上次水位线的条目，其余行直接从旧矩阵复制。
+    """
+
+    META_FILE = "meta.json"
+
+    def __init__(self, index_dir: str, embed_fn: EmbedFn, signature: str):
+        self.settings = get_settings()
+        self.index_dir = Path(index_dir)
+        self.embed_fn = embed_fn
+        self.signature = signature
+        self._partitions: Dict[str, _Partition] = {}
+        self._watermark: Optional[datetime] = None
+        self._last_refresh = 0.0
+        self._lock = Lock()
+        self._load()
+
+    @property
+    def size(self) -> int:
+        return sum(len(partition.ids) for partition in self._partitions.values())
+
+    # --------- 构建 ----------
+    def refresh(self, db: Session, force: bool = False) -> None:
+        """知识库有新增、修改或删除时增量重建索引。"""
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._last_refresh < self.settings.local_index_refresh_interval:
+                return
+            self._last_refresh = now
+
+            item = models.KnowledgeBaseItem
+            active = item.is_active.isnot(False)
+            latest, total = (
+                db.query(func.max(item.updated_at), func.count(item.kb_id)).filter(active).one()
+            )
+            if latest is None:
+                self._replace({}, None)
+                return
+            if self._watermark is not None and latest <= self._watermark and total == self.size:
+                return
+
+            rows = (
+                db.query(item.kb_id, item.kb_type, item.updated_at)
+                .filter(active)
+                .order_by(item.kb_id)
+                .all()
+            )
+            needed = [
+                kb_id
+                for kb_id, kb_type, updated_at in rows
+                if self._watermark is None
+                or updated_at >= self._watermark
+                or not self._is_indexed(kb_type, kb_id)
+            ]
+            new_vectors = self._embed_items(db, needed)
+
+            by_type: Dict[str, List[str]] = {}
+            for kb_id, kb_type, _ in rows:
+                by_type.setdefault(kb_type, []).append(kb_id)
+            partitions: Dict[str, _Partition] = {}
+            for kb_type, ids in by_type.items():
+                old = self._partitions.get(kb_type)
+                if old is not None and old.ids == ids and not any(kb_id in new_vectors for kb_id in ids):
+                    partitions[kb_type] = old
+                    continue
+                partitions[kb_type] = self._build_partition(kb_type, ids, old, new_vectors)
+            self._replace(partitions, latest)
+            logger.info("本地向量索引已更新：重新嵌入 %s 条，共 %s 条。", len(needed), self.size)
+
+    def _is_indexed(self, kb_type: str, kb_id: str) -> bool:
+        partition = self._partitions.get(kb_type)
+        return partition is not None and kb_id in partition.positions
+
+    def _embed_items(self, db: Session, kb_ids: List[str]) -> Dict[str, np.ndarray]:
+        item = models.KnowledgeBaseItem
+        vectors: Dict[str, np.ndarray] = {}
+        batch_size = 500
+        for start in range(0, len(kb_ids), batch_size):
+            rows = (
+                db.query(item.kb_id, item.content_text)
+                .filter(item.kb_id.in_(kb_ids[start : start + batch_size]))
+                .all()
+            )
+            if not rows:
+                continue
+            matrix = _normalize_rows(self.embed_fn([content for _, content in rows]))
+            for (kb_id, _), vector in zip(rows, matrix):
+                vectors[kb_id] = vector
+        return vectors
+
+    def _build_partition(
+        self,
+        kb_type: str,
+        ids: List[str],
+        old: Optional[_Partition],
+        new_vectors: Dict[str, np.ndarray],
+    ) -> _Partition:
+        dim = len(next(iter(new_vectors.values()))) if new_vectors else old.matrix.shape[1]
+        matrix = np.empty((len(ids), dim), dtype=np.float32)
+        reused = [
+            (row, old.positions[kb_id])
+            for row, kb_id in enumerate(ids)
+            if kb_id not in new_vectors and old is not None and kb_id in old.positions
+        ]
+        if reused:
+            target_rows, source_rows = zip(*reused)
+            matrix[list(target_rows)] = old.matrix[list(source_rows)]
+        for row, kb_id in enumerate(ids):
+            if kb_id in new_vectors:
+                matrix[row] = new_vectors[kb_id]
+        return _Partition(ids, self._write_matrix(kb_type, matrix))
+
+    # --------- 检索 ----------
+    def search(
+        self,
+        vectors: Sequence[Sequence[float]],
+        kb_type: str,
+        top_k: int = 3,
+    ) -> List[List[Tuple[str, float]]]:
+        """归一化内积检索，返回每个查询向量的 [(kb_id, score)]，按分数降序。"""
+        queries = np.asarray(vectors, dtype=np.float32)
+        partition = self._partitions.get(kb_type)
+        if partition is None or not partition.ids or queries.size == 0:
+            return [[] for _ in range(len(queries))]
+        if queries.shape[1] != partition.matrix.shape[1]:
+            logger.warning(
+                "查询向量维度 %s 与本地索引维度 %s 不一致，跳过本地检索。",
+                queries.shape[1],
+                partition.matrix.shape[1],
+            )
+            return [[] for _ in range(len(queries))]
+
+        scores = _normalize_rows(queries) @ partition.matrix.T
+        k = min(top_k, scores.shape[1])
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+        return [
+            [(partition.ids[col], float(score)) for col, score in zip(row_ids, row_scores)]
+            for row_ids, row_scores in zip(top, top_scores)
+        ]
+
+    # --------- 持久化 ----------
+    def _matrix_path(self, kb_type: str) -> Path:
+        return self.index_dir / f"{kb_type}.npy"
+
+    def _write_matrix(self, kb_type: str, matrix: np.ndarray) -> np.ndarray:
+        if matrix.shape[0] == 0:
+            return matrix
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        path = self._matrix_path(kb_type)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        mmap = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=matrix.shape)
+        mmap[:] = matrix
+        mmap.flush()
+        del mmap
+        os.replace(tmp_path, path)
+        return np.load(path, mmap_mode="r")
+
+    def _replace(self, partitions: Dict[str, _Partition], watermark: Optional[datetime]) -> None:
+        for kb_type in set(self._partitions) - set(partitions):
+            self._matrix_path(kb_type).unlink(missing_ok=True)
+        self._partitions = partitions
+        self._watermark = watermark
+        if not self.index_dir.exists() and not partitions:
+            return
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        meta = {
+            "signature": self.signature,
+            "watermark": watermark.isoformat() if watermark else None,
+            "partitions": {kb_type: partition.ids for kb_type, partition in partitions.items()},
+        }
+        tmp_path = self.index_dir / f"{self.META_FILE}.{os.getpid()}.tmp"
+        tmp_path.write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp_path, self.index_dir / self.META_FILE)
+
+    def _load(self) -> None:
+        meta_path = self.index_dir / self.META_FILE
+        if not meta_path.exists():
+            return
+        try:
+            meta = json.loads(meta_path.read_text(encoding="utf-8"))
+            if meta.get("signature") != self.signature:
+                logger.info("本地向量索引的嵌入模型已变化，将全量重建。")
+                return
+            partitions = {}
+            for kb_type, ids in meta["partitions"].items():
+                matrix = np.load(self._matrix_path(kb_type), mmap_mode="r")
+                if matrix.shape[0] != len(ids):
+                    raise ValueError(f"{kb_type} 索引行数与元数据不一致")
+                partitions[kb_type] = _Partition(ids, matrix)
+        except Exception as exc:
+            logger.warning("加载本地向量索引失败，将全量重建：%s", exc)
+            return
+        self._partitions = partitions
+        watermark = meta.get("watermark")
+        self._watermark = datetime.fromisoformat(watermark) if watermark else None
+
+
+_local_index: Optional[LocalVectorIndex] = None
+_local_index_lock = Lock()
+
+
+def get_local_index() -> LocalVectorIndex:
+    global _local_index
+    with _local_index_lock:
+        if _local_index is None:
+            manager = ModelManager.get_instance()
+            _local_index = LocalVectorIndex(
+                get_settings().local_index_dir,
+                embed_fn=manager.embed_texts,
+                signature=manager.embedding_signature,
+            )
+        return _local_index
@@ -8,11 +8,27 @@ celery_app = Celery(
     "ppna_tasks",
     broker=settings.broker_url,
     backend=settings.result_backend,
+    include=["app.tasks.detection_task", "app.tasks.kb_sync_task", "app.tasks.signals"],
 )
 
 celery_app.conf.update(
     task_default_queue=settings.celery_task_default_queue,
     result_expires=3600,
     task_track_started=True,
+    # 子进程在 worker_process_init 中预热模型，需放宽默认 4 秒的启动超时
+    worker_proc_alive_timeout=settings.model_warmup_timeout,
 )
 
+if settings.kb_sync_interval > 0:
+    # 需要同时运行 celery beat；任务过期时间与间隔一致，积压时不会叠加多轮同步
+    celery_app.conf.beat_schedule = {
+        "sync-knowledge-base": {
+            "task": "sync_knowledge_base_task",
+            "schedule": settings.kb_sync_interval,
+            "options": {"expires": settings.kb_sync_interval},
+        }
+    }
+
+if settings.celery_worker_concurrency > 0:
+    celery_app.conf.worker_concurrency = settings.celery_worker_concurrency
+
@@ -1,17 +1,34 @@
 import logging
-import time
-from typing import Dict, Optional
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional
 
-from celery import states
+from celery import chord, group, states
 from celery import current_task
 
 from app.config.logging_config import setup_logging
+from app.config.settings import get_settings
 from app.db.session import db_session
+from app.schemas import RiskDetail
 from app.services.detection import DetectionService
+from app.services.model_manager import TextSpan
+from app.services.progress import get_progress_store
 from app.tasks.celery_app import celery_app
 
 setup_logging()
 logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# 各阶段在总进度中的权重（合计 100），按典型耗时估算
+STAGE_WEIGHTS = (
+    ("preprocess", 2),
+    ("chunking", 3),
+    ("classification", 15),
+    ("rag", 15),
+    ("generation", 55),
+    ("aggregation", 5),
+    ("persisted", 5),
+)
 
 
 def _update_progress(progress: int, meta: Optional[Dict] = None) -> None:
@@ -23,38 +40,297 @@ def _update_progress(progress: int, meta: Optional[Dict] = None) -> None:
         logger.info("任务 %s 进度 %s%%", current_task.request.id, progress)
 
 
+class PipelineProgress:
+    """按已完成阶段的权重及当前阶段的完成比例计算总进度。
+
+    进度同时写入以业务 task_id 为键的进度快照，供状态查询接口直接读取。
+    """
+
+    def __init__(self, task_id: str):
+        self.task_id = task_id
+        self._ranges: Dict[str, tuple] = {}
+        offset = 0
+        for stage, weight in STAGE_WEIGHTS:
+            self._ranges[stage] = (offset, weight)
+            offset += weight
+        self._last = -1
+
+    def update(self, stage: str, fraction: float = 1.0, meta: Optional[Dict] = None) -> None:
+        offset, weight = self._ranges[stage]
+        progress = int(offset + weight * min(max(fraction, 0.0), 1.0))
+        # 阶段内的细粒度进度只在整数百分比变化时上报
+        if progress == self._last and fraction < 1.0:
+            return
+        self._last = progress
+        payload = {"stage": stage}
+        if meta:
+            payload.update(meta)
+        _update_progress(progress, payload)
+        if stage != "persisted":
+            # persisted 阶段的最终状态由 persist_report 发布
+            get_progress_store().publish(self.task_id, "processing", progress, **payload)
+
+    def update_batches(self, done: int, total: int) -> None:
+        """分批模式下各批次并行完成分类、检索与生成，按已完成批次数在这三个阶段的区间内推进。"""
+        start = self._ranges["classification"][0]
+        offset, weight = self._ranges["generation"]
+        progress = int(start + (offset + weight - start) * min(done, total) / max(total, 1))
+        payload = {"stage": "generation", "batches_done": done, "batch_count": total}
+        _update_progress(progress, payload)
+        get_progress_store().publish(self.task_id, "processing", progress, **payload)
+
+
 @celery_app.task(name="detect_policy_task")
-def detect_policy_task(task_id: str, app_name: str, policy_text: str) -> str:
-    """核心 Celery 任务，模拟 RAG + MOE 的检测流程。"""
+def detect_policy_task(
+    task_id: str,
+    app_name: str,
+    policy_text: str,
+    force_regenerate: bool = False,
+    incremental: bool = False,
+    document_id: Optional[str] = None,
+) -> str:
+    """核心 Celery 任务：预处理 → 分块 → 分类 → 检索 → 生成 → 汇总 → 持久化。
+
+    分块数达到 `fanout_min_chunks` 时改为 chord 模式：分块结果拆成多批交给
+    `detect_chunk_batch_task` 并行处理，由 `merge_batch_results_task` 汇总持久化。
+    两种模式都返回报告 ID；分批模式的报告 ID 在提交时预先分配，返回时报告可能尚未写入。
+
+    `incremental` 为真且该应用已有报告时，只对新增或修改的段落分块检测，
+    其余风险从上一份报告平移复用；增量模式下不拆分子任务。
+    提交时引用上传文档的任务只传 `document_id`，正文在 worker 中读取。
+    """
     logger.info("Celery 任务开始 task_id=%s", task_id)
-    step_progress = [5, 15, 55, 90, 100]
-    with db_session() as session:
-        service = DetectionService(session)
+    progress = PipelineProgress(task_id)
+    try:
+        with db_session() as session:
+            service = DetectionService(session)
+            service.mark_status(task_id, "processing")
+            detection_time = datetime.utcnow()
+            if document_id and not policy_text:
+                policy_text = service.document_text(document_id)
 
-        # --- 预处理 ---
-        cleaned_text = policy_text.strip()
-        _update_progress(step_progress[0], {"stage": "preprocess"})
-        time.sleep(0.2)
+            # --- 预处理 ---
+            text = service.preprocess(policy_text)
+            progress.update("preprocess", meta={"char_count": len(text)})
 
-        # --- 智能分块 ---
-        chunks = [cleaned_text[i : i + 500] for i in range(0, len(cleaned_text), 500)]
-        _update_progress(step_progress[1], {"stage": "chunking", "chunk_count": len(chunks)})
-        time.sleep(0.2)
+            # --- 智能分块 ---
+            plan = service.plan_for(task_id, app_name, text) if incremental else None
+            if plan is not None:
+                spans = plan.spans
+                progress.update(
+                    "chunking",
+                    meta={
+                        "chunk_count": len(spans),
+                        "mode": "incremental",
+                        "reused_risk_count": len(plan.reused),
+                    },
+                )
+            else:
+                spans = service.segment(text)
+            if (
+                plan is None
+                and settings.fanout_min_chunks
+                and len(spans) >= settings.fanout_min_chunks
+            ):
+                batch_size = max(1, settings.fanout_batch_size)
+                # 先上报分块进度，再提交子任务，避免覆盖子任务已上报的批次进度
+                progress.update(
+                    "chunking",
+                    meta={
+                        "chunk_count": len(spans),
+                        "mode": "fanout",
+                        "batch_count": -(-len(spans) // batch_size),
+                    },
+                )
+                report_id = str(uuid.uuid4())
+                _fan_out(task_id, app_name, text, spans, detection_time, force_regenerate, report_id)
+                logger.info("任务 %s 分块 %s 个，已拆分为并行子任务。", task_id, len(spans))
+                return report_id
+            if plan is None:
+                progress.update("chunking", meta={"chunk_count": len(spans)})
 
-        # --- MOE 专家协作 ---
-        fused_text = " ".join(chunks)
-        _update_progress(step_progress[2], {"stage": "rag"})
-        time.sleep(0.2)
+            # --- 风险分类 ---
+            candidates = service.classify(spans)
+            progress.update("classification", meta={"candidate_count": len(candidates)})
 
-        # --- 汇总报告 ---
-        report = service.build_report(task_id=task_id, app_name=app_name, policy_text=fused_text)
-        _update_progress(step_progress[3], {"stage": "aggregation"})
-        time.sleep(0.2)
+            # --- RAG 检索 ---
+            contexts = service.retrieve(candidates)
+            progress.update("rag")
 
-        # --- 持久化 ---
-        service.persist_report(task_id=task_id, report=report)
-        _update_progress(step_progress[4], {"stage": "persisted"})
+            # --- MOE 生成 ---
+            # 等级不依赖生成结果，先算出来以便每条生成完成时即可推送完整的风险项
+            levels = service.risk_levels(candidates, contexts)
+            store = get_progress_store()
+
+            def publish_risk(idx: int, text: str) -> None:
+                risk = service.build_risk(task_id, candidates[idx], contexts[idx], text, levels[idx])
+                store.publish_risk(task_id, risk.model_dump(mode="json"))
+
+            generations = service.generate(
+                app_name,
+                candidates,
+                contexts,
+                force_regenerate=force_regenerate,
+                on_progress=lambda done, total: progress.update(
+                    "generation", done / total if total else 1.0
+                ),
+                on_result=publish_risk,
+            )
+            progress.update("generation")
+
+            # --- 汇总报告 ---
+            risk_details = service.aggregate(task_id, candidates, contexts, generations, levels=levels)
+            delta = None
+            if plan is not None:
+                risk_details, delta = service.merge_incremental(task_id, plan, risk_details)
+            report = service.assemble_report(
+                task_id, app_name, text, risk_details, detection_time, delta=delta
+            )
+            progress.update("aggregation", meta={"risk_count": len(report.risk_details)})
+
+            # --- 持久化 ---
+            service.persist_report(task_id=task_id, report=report)
+            progress.update("persisted")
+    except Exception:
+        logger.exception("Celery 任务失败 task_id=%s", task_id)
+        with db_session() as session:
+            DetectionService(session).mark_status(task_id, "failed")
+        raise
 
     logger.info("Celery 任务完成 task_id=%s", task_id)
     return report.report_id
 
+
+def _fan_out(
+    task_id: str,
+    app_name: str,
+    text: str,
+    spans: List[TextSpan],
+    detection_time: datetime,
+    force_regenerate: bool,
+    report_id: str,
+):
+    batch_size = max(1, settings.fanout_batch_size)
+    starts = range(0, len(spans), batch_size)
+    header = group(
+        detect_chunk_batch_task.s(
+            task_id,
+            app_name,
+            [list(span) for span in spans[start : start + batch_size]],
+            start + 1,
+            force_regenerate,
+            len(starts),
+        )
+        for start in starts
+    )
+    # 兜底风险项只需要原文开头部分，避免把全文塞进回调消息
+    callback = merge_batch_results_task.s(
+        task_id, app_name, text[:200], detection_time.isoformat(), report_id
+    ).on_error(fanout_failed_task.s(task_id))
+    return chord(header)(callback)
+
+
+@celery_app.task(name="detect_chunk_batch_task", bind=True)
+def detect_chunk_batch_task(
+    self,
+    task_id: str,
+    app_name: str,
+    spans: List[List[Any]],
+    first_index: int,
+    force_regenerate: bool = False,
+    batch_count: int = 1,
+) -> Dict[str, Any]:
+    """处理一批分块：分类 → 检索 → 生成 → 汇总。
+
+    重试耗尽后返回带 error 的结果而不是抛出异常，保证 chord 回调始终执行。
+    每批结束（成功或最终失败）时把已完成批次数加一，并据此上报整个任务的进度。
+    """
+    try:
+        with db_session() as session:
+            service = DetectionService(session)
+            candidates = service.classify([TextSpan(*span) for span in spans], first_index=first_index)
+            contexts = service.retrieve(candidates)
+            generations = service.generate(
+                app_name, candidates, contexts, force_regenerate=force_regenerate
+            )
+            risk_details = service.aggregate(task_id, candidates, contexts, generations)
+        store = get_progress_store()
+        for detail in risk_details:
+            store.publish_risk(task_id, detail.model_dump(mode="json"))
+    except Exception as exc:
+        if self.request.retries < settings.fanout_batch_max_retries:
+            raise self.retry(exc=exc, countdown=2**self.request.retries)
+        logger.exception("任务 %s 的分块批次 %s 处理失败", task_id, first_index)
+        _advance_batches(task_id, batch_count)
+        return {"first_index": first_index, "chunk_count": len(spans), "risks": [], "error": str(exc)}
+    _advance_batches(task_id, batch_count)
+    return {
+        "first_index": first_index,
+        "chunk_count": len(spans),
+        "risks": [detail.model_dump(mode="json") for detail in risk_details],
+        "error": None,
+    }
+
+
+def _advance_batches(task_id: str, batch_count: int) -> None:
+    done = get_progress_store().advance(task_id, "batches_done")
+    if done is not None:
+        PipelineProgress(task_id).update_batches(done, batch_count)
+
+
+@celery_app.task(name="merge_batch_results_task")
+def merge_batch_results_task(
+    results: List[Dict[str, Any]],
+    task_id: str,
+    app_name: str,
+    policy_head: str,
+    detection_time: str,
+    report_id: Optional[str] = None,
+) -> str:
+    """chord 回调：合并各批次的 RiskDetail，统计并持久化报告，返回报告 ID。
+
+    全部批次失败时把任务标记为失败并返回空字符串。
+    """
+    failed = [result for result in results if result["error"]]
+    if results and len(failed) == len(results):
+        logger.error("任务 %s 的全部分块批次均失败", task_id)
+        with db_session() as session:
+            DetectionService(session).mark_status(task_id, "failed")
+        return ""
+
+    risk_details = sorted(
+        (RiskDetail(**risk) for result in results for risk in result["risks"]),
+        key=lambda detail: detail.fragment_position.start_index,
+    )
+    notes = [
+        f"分块 {result['first_index']}-{result['first_index'] + result['chunk_count'] - 1} "
+        f"处理失败，已跳过：{result['error']}"
+        for result in failed
+    ]
+    with db_session() as session:
+        service = DetectionService(session)
+        report = service.assemble_report(
+            task_id,
+            app_name,
+            policy_head,
+            risk_details,
+            datetime.fromisoformat(detection_time),
+            notes=notes,
+            report_id=report_id,
+        )
+        PipelineProgress(task_id).update(
+            "aggregation",
+            meta={"risk_count": len(report.risk_details), "failed_batches": len(failed)},
+        )
+        # 完成状态与 100% 进度由 persist_report 写入进度快照
+        service.persist_report(task_id=task_id, report=report)
+    logger.info("任务 %s 分批结果已合并，失败批次 %s 个。", task_id, len(failed))
+    return report.report_id
+
+
+@celery_app.task(name="fanout_failed_task")
+def fanout_failed_task(request, exc, traceback, task_id: str) -> None:
+    """chord 的错误回调：合并回调抛出异常或 chord 本身出错时把业务任务标记为失败。"""
+    logger.error("任务 %s 的分批合并失败：%s", task_id, exc)
+    with db_session() as session:
+        DetectionService(session).mark_status(task_id, "failed")
@@ -0,0 +1,33 @@
+import logging
+from typing import Any, Dict
+
+from app.config.logging_config import setup_logging
+from app.config.settings import get_settings
+from app.db.session import db_session
+from app.services.kb_sync import KnowledgeBaseSync
+from app.services.vector_index import get_local_index
+from app.tasks.celery_app import celery_app
+
+setup_logging()
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+
+@celery_app.task(name="sync_knowledge_base_task")
+def sync_knowledge_base_task() -> Dict[str, Any]:
+    """由 Celery beat 周期触发，把知识库变更增量同步到 Milvus。
+
+    有变更时顺带强制刷新当前进程的本地向量索引；其他 worker 进程的索引
+    在下一次检索时按 updated_at 与条目数自行发现变化并增量重建。
+    """
+    with db_session() as session:
+        result = KnowledgeBaseSync(session).run()
+        if (result.upserted or result.deleted) and settings.local_index_enabled:
+            get_local_index().refresh(session, force=True)
+    return {
+        "upserted": result.upserted,
+        "deleted": result.deleted,
+        "pending": result.pending,
+        "lag_seconds": result.lag_seconds,
+        "watermark": result.watermark.isoformat() if result.watermark else None,
+    }
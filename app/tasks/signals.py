@@ -0,0 +1,55 @@
+import logging
+from typing import Any, Dict, Optional
+
+from celery.signals import worker_init, worker_process_init, worker_process_shutdown
+
+from app.config.settings import get_settings
+from app.services.model_manager import ModelManager
+from app.services.rag_retriever import get_milvus_registry
+from app.tasks.celery_app import celery_app
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# 主进程在 worker_init 中记录并发数，fork 出的子进程继承该值用于划分线程
+_worker_concurrency: Optional[int] = None
+
+
+@worker_init.connect
+def preload_models_in_parent(sender=None, **_) -> None:
+    """prefork 之前在主进程加载模型，子进程通过写时复制共享权重。"""
+    global _worker_concurrency
+    _worker_concurrency = getattr(sender, "concurrency", None)
+    if settings.model_warmup_enabled and settings.model_preload_in_parent:
+        logger.info("在主进程中预加载模型。")
+        manager = ModelManager.get_instance()
+        manager.configure_threads(_worker_concurrency)
+        manager.warm_up()
+
+
+@worker_process_init.connect
+def warm_up_models(**_) -> None:
+    """子进程开始消费任务前完成模型加载与一次空推理。"""
+    manager = ModelManager.get_instance()
+    manager.configure_threads(_worker_concurrency)
+    if not settings.model_warmup_enabled:
+        return
+    if manager.readiness()["ready"]:
+        return
+    try:
+        manager.warm_up()
+    except Exception:
+        # 预热失败不阻止 worker 启动，首个任务会再次尝试懒加载
+        logger.exception("模型预热失败。")
+
+
+@worker_process_shutdown.connect
+def close_milvus_connection(**_) -> None:
+    """worker 子进程退出前断开进程级 Milvus 连接。"""
+    get_milvus_registry().close()
+
+
+@celery_app.task(name="model_readiness_task")
+def model_readiness_task() -> Dict[str, Any]:
+    """返回处理该任务的 worker 进程的模型就绪状态与加载耗时。"""
+    return ModelManager.get_instance().readiness()
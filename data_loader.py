@@ -1,12 +1,21 @@
-import json
-import random
-from pathlib import Path
+"""
+知识库加载：流式读取 JSONL/CSV 中的法规与案例，法规按条拆分，
+批量生成向量后写入 Milvus 与 knowledge_base 表，支持断点续传。
+运行方式：
+    python data_loader.py                                  # 写入内置的示例数据
+    python data_loader.py regulations.jsonl cases.csv      # 加载文件
+    python data_loader.py cases.csv --kb-type case --batch-size 512 --restart
+文件每行（或每个 CSV 行）包含 kb_id、kb_type（regulation / case）、content_text，
+法规可另给 title；缺少 kb_type 时使用 --kb-type。
+"""
+
+import argparse
 
 from sqlalchemy.orm import Session
 
 from app.config.logging_config import setup_logging
 from app.db.session import db_session
-from app.models import KnowledgeBaseItem
+from app.services.kb_loader import KnowledgeBaseLoader
 
 setup_logging()
 
@@ -29,23 +38,32 @@ MOCK_DATA = [
 ]
 
 
-def load_mock_data(session: Session, data=None) -> None:
-    records = data or MOCK_DATA
-    for item in records:
-        vector_id = f"vec_{random.randint(100000, 999999)}"
-        session.merge(
-            KnowledgeBaseItem(
-                kb_id=item["kb_id"],
-                kb_type=item["kb_type"],
-                content_text=item["content_text"],
-                milvus_vector_id=vector_id,
-            )
-        )
-    session.commit()
+def load_mock_data(session: Session, data=None, use_milvus: bool = True) -> None:
+    KnowledgeBaseLoader(session, use_milvus=use_milvus).load_records(data or MOCK_DATA)
 
 
-if __name__ == "__main__":
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("sources", nargs="*", help="JSONL / CSV 文件，不指定时写入示例数据")
+    parser.add_argument("--kb-type", choices=("regulation", "case"), help="源文件未给出 kb_type 时使用")
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument("--restart", action="store_true", help="忽略断点，从头加载")
+    parser.add_argument("--no-milvus", action="store_true", help="只写数据库，不写入 Milvus")
+    args = parser.parse_args()
+
     with db_session() as session:
-        load_mock_data(session)
-        print("知识库初始化完成。")
+        if not args.sources:
+            load_mock_data(session, use_milvus=not args.no_milvus)
+            print("知识库初始化完成。")
+            return
+        loader = KnowledgeBaseLoader(session, use_milvus=not args.no_milvus, batch_size=args.batch_size)
+        for source in args.sources:
+            stats = loader.load_file(source, default_kb_type=args.kb_type, restart=args.restart)
+            print(
+                f"{source}: {stats.records} 条源记录 → {stats.rows} 条知识条目，"
+                f"{stats.seconds:.1f}s，{stats.rows_per_sec:.0f} 条/秒"
+            )
+
 
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,35 @@
+import logging
+from contextlib import asynccontextmanager
+
+from anyio import to_thread
 from fastapi import FastAPI
 
 from app.config.logging_config import setup_logging
 from app.config.settings import get_settings
 from app.routers import auth, detection
+from app.services.fetcher import close_policy_fetcher
 
 setup_logging()
 settings = get_settings()
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    # 同步接口在 anyio 线程池中执行，线程数与数据库连接池保持一致，
+    # 避免线程多于连接时请求在 pool_timeout 上排队
+    to_thread.current_default_thread_limiter().total_tokens = settings.api_threadpool_size
+    if settings.api_threadpool_size > settings.db_pool_size + settings.db_max_overflow:
+        logger.warning(
+            "API_THREADPOOL_SIZE=%s 超过数据库连接上限 %s，高并发时请求会等待连接。",
+            settings.api_threadpool_size,
+            settings.db_pool_size + settings.db_max_overflow,
+        )
+    yield
+    await close_policy_fetcher()
+
 
-app = FastAPI(title=settings.app_name)
+app = FastAPI(title=settings.app_name, lifespan=lifespan)
 
 app.include_router(auth.router, prefix=settings.api_prefix)
 app.include_router(detection.router, prefix=settings.api_prefix)
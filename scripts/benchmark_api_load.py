@@ -0,0 +1,143 @@
+"""
+并发压测任务提交与状态轮询接口，输出各接口的 requests/sec 与延迟分位数。
+默认在进程内通过 ASGI 调用应用，数据库为临时 SQLite 文件，并用 --db-latency
+为每条 SQL 注入固定延迟以模拟到 PostgreSQL 的网络往返；Celery 入队被替换为空操作。
+运行方式：
+    conda activate PPNA
+    python scripts/benchmark_api_load.py --concurrency 50 --requests 500 --db-latency 0.005
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, List
+
+os.environ.setdefault("PROGRESS_BACKEND", "memory")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import httpx  # noqa: E402
+from sqlalchemy import create_engine, event  # noqa: E402
+from sqlalchemy.orm import Session, sessionmaker  # noqa: E402
+
+from app.db.migrations import upgrade  # noqa: E402
+from app.db.session import get_db, get_session_factory  # noqa: E402
+from app.tasks import detection_task  # noqa: E402
+from main import app  # noqa: E402
+
+POLICY_TEXT = "我们会收集您的位置信息用于提供附近的服务。" * 50
+
+
+def setup_database(path: str, latency: float, pool_size: int) -> None:
+    engine = create_engine(
+        f"sqlite:///{path}",
+        future=True,
+        pool_size=pool_size,
+        connect_args={"check_same_thread": False, "timeout": 30},
+    )
+    upgrade(engine)
+    if latency:
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def _simulate_round_trip(*_):
+            time.sleep(latency)
+
+    session_factory = sessionmaker(bind=engine, class_=Session, expire_on_commit=False)
+
+    def override_db():
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = override_db
+    app.dependency_overrides[get_session_factory] = lambda: session_factory
+    detection_task.detect_policy_task.delay = lambda **kwargs: None
+
+
+async def run_load(
+    client: httpx.AsyncClient,
+    make_request: Callable,
+    total: int,
+    concurrency: int,
+) -> dict:
+    latencies: List[float] = []
+    errors = 0
+    queue: asyncio.Queue = asyncio.Queue()
+    for idx in range(total):
+        queue.put_nowait(idx)
+
+    async def worker():
+        nonlocal errors
+        while not queue.empty():
+            idx = queue.get_nowait()
+            start = time.perf_counter()
+            response = await make_request(client, idx)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "rps": total / elapsed,
+        "p50": statistics.median(latencies) * 1000,
+        "p95": latencies[int(0.95 * (len(latencies) - 1))] * 1000,
+        "errors": errors,
+    }
+
+
+async def main_async(args) -> None:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        task_ids: List[str] = []
+
+        async def submit(client, idx):
+            response = await client.post(
+                "/api/v1/detection/tasks",
+                json={"app_name": f"BenchApp{idx}", "policy_text": POLICY_TEXT, "force": True},
+            )
+            if response.status_code == 200:
+                task_ids.append(response.json()["task_id"])
+            return response
+
+        async def poll_status(client, idx):
+            return await client.get(f"/api/v1/detection/tasks/{task_ids[idx % len(task_ids)]}/status")
+
+        async def poll_result(client, idx):
+            return await client.get(f"/api/v1/detection/tasks/{task_ids[idx % len(task_ids)]}")
+
+        for name, make_request in (
+            ("submit  POST /tasks", submit),
+            ("status  GET /tasks/{id}/status", poll_status),
+            ("result  GET /tasks/{id}", poll_result),
+        ):
+            result = await run_load(client, make_request, args.requests, args.concurrency)
+            print(
+                f"{name:<34} {result['rps']:>8.1f} req/s  p50={result['p50']:.1f}ms  "
+                f"p95={result['p95']:.1f}ms  errors={result['errors']}"
+            )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--db-latency", type=float, default=0.005, help="每条 SQL 的模拟往返延迟（秒）")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_database(os.path.join(tmp, "bench.db"), args.db_latency, pool_size=args.concurrency)
+        print(f"并发 {args.concurrency}，每个接口 {args.requests} 次请求，SQL 延迟 {args.db_latency * 1000:.1f}ms")
+        asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+对比 BERT 在 fp32 与 int8 推理配置下的延迟与分数漂移。
+运行方式：
+    conda activate PPNA
+    python scripts/benchmark_bert_inference.py --repeat 5 --threads 4
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.config.settings import get_settings  # noqa: E402
+from app.services import model_manager  # noqa: E402
+from app.services.model_manager import ModelManager  # noqa: E402
+
+SUBJECTS = ["位置信息", "通讯录", "设备标识符", "人脸信息", "浏览记录", "支付账户"]
+ACTIONS = ["收集", "共享给第三方合作伙伴", "在境外服务器存储", "用于个性化广告推送", "长期保存"]
+SUFFIXES = ["", "，您可以在设置中撤回授权。", "，未经您的单独同意。", "，保存期限为业务所需的最短时间。"]
+
+
+def build_corpus() -> List[str]:
+    """固定语料：由主体、行为与附加条款组合出的隐私政策句子。"""
+    corpus = []
+    for subject in SUBJECTS:
+        for action in ACTIONS:
+            for suffix in SUFFIXES:
+                corpus.append(f"为向您提供服务，我们会{action}您的{subject}{suffix}。" * 3)
+    return corpus
+
+
+def run_profile(profile: str, corpus: List[str], repeat: int, threads: int) -> Dict:
+    manager = ModelManager()
+    manager.settings = get_settings().model_copy(
+        update={"bert_inference_profile": profile, "torch_num_threads": threads}
+    )
+    # 显式设置线程数：两种配置必须在相同线程数下比较，加速比才只反映量化本身
+    manager.configure_threads()
+    model_manager.torch.set_num_threads(threads)
+    manager.warm_up()
+
+    latencies = []
+    scores: List[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results = manager.classify_chunks(corpus)
+        latencies.append(time.perf_counter() - start)
+        scores = [item["score"] for item in results]
+    return {
+        "profile": profile,
+        "scores": np.asarray(scores),
+        "p50": statistics.median(latencies),
+        "p95": sorted(latencies)[max(0, int(round(0.95 * len(latencies))) - 1)],
+        "throughput": len(corpus) / statistics.median(latencies),
+        "threads": model_manager.torch.get_num_threads(),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="两种配置共用的 torch 线程数，默认等于 CPU 核数",
+    )
+    args = parser.parse_args()
+    if args.threads <= 0:
+        parser.error("--threads 必须为正整数")
+
+    if not model_manager.HAS_TRANSFORMERS:
+        print("未安装 torch / transformers，无法执行基准测试。")
+        return
+
+    corpus = build_corpus()
+    baseline = run_profile("fp32", corpus, args.repeat, args.threads)
+    quantized = run_profile("int8", corpus, args.repeat, args.threads)
+
+    print(f"语料：{len(corpus)} 条，重复 {args.repeat} 次")
+    for result in (baseline, quantized):
+        print(
+            f"{result['profile']:>5}  p50={result['p50'] * 1000:.1f}ms  "
+            f"p95={result['p95'] * 1000:.1f}ms  吞吐={result['throughput']:.1f} 条/秒  "
+            f"线程={result['threads']}"
+        )
+    drift = np.abs(baseline["scores"] - quantized["scores"])
+    threshold = 0.25
+    agreement = np.mean((baseline["scores"] >= threshold) == (quantized["scores"] >= threshold))
+    print(f"加速比：{baseline['p50'] / quantized['p50']:.2f}x")
+    print(f"分数漂移：平均 {drift.mean():.4f}，最大 {drift.max():.4f}")
+    print(f"阈值 {threshold} 下判定一致率：{agreement:.2%}")
+
+
+if __name__ == "__main__":
+    main()
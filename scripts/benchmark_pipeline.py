@@ -0,0 +1,421 @@
+"""
+按阶段压测检测流水线：在 1k～200k 字的合成隐私政策上分别测量分块、分类、嵌入、检索、
+风险等级、生成与完整 build_report 的 p50/p95 延迟、吞吐（字/秒）和峰值内存，
+并与保存的基线比较，超出容差时以非零状态码退出。
+不连接外部服务：DashScope 的嵌入与对话接口由 httpx.MockTransport 回放
+scripts/fixtures/dashscope_responses.json 中录制的响应，按设定延迟返回并周期性返回 429，
+因此真实经过 openai 客户端、分批、缓存、并发与重试逻辑；不连接 Milvus，
+知识库为固定种子生成的法规与案例，写入临时 SQLite 并由本地向量索引检索。
+每个阶段分别测量冷缓存（每次计时前清空嵌入与生成缓存）和热缓存两种情况。
+运行方式：
+    conda activate PPNA
+    python scripts/benchmark_pipeline.py                                  # 与默认基线比较
+    python scripts/benchmark_pipeline.py --sizes 1000,20000 --repeat 3
+    python scripts/benchmark_pipeline.py --save-baseline scripts/benchmark_pipeline_baseline.json
+基线记录了本次运行参数（知识库规模、是否使用 BERT、接口延迟等），参数不一致时拒绝比较；
+基线与机器相关，更换运行环境后请先重新生成。
+"""
+
+import argparse
+import base64
+import gc
+import hashlib
+import itertools
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import httpx  # noqa: E402
+import numpy as np  # noqa: E402
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+
+from app import models  # noqa: E402
+from app.config.settings import get_settings  # noqa: E402
+from app.services import model_manager, rag_retriever, vector_index  # noqa: E402
+from app.services.cache import EmbeddingCache, GenerationCache, LRUCache, TieredCache  # noqa: E402
+from app.services.detection import DetectionService  # noqa: E402
+from app.services.model_manager import HAS_OPENAI, ModelManager  # noqa: E402
+from app.services.vector_index import LocalVectorIndex  # noqa: E402
+
+if HAS_OPENAI:
+    from openai import OpenAI
+
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "benchmark_pipeline_baseline.json"
+DEFAULT_FIXTURES = Path(__file__).resolve().parent / "fixtures" / "dashscope_responses.json"
+RECORDED_BASE_URL = "http://dashscope.recorded/compatible-mode/v1"
+# 回放时的重试退避，保持重试路径但不让退避时间主导计时
+RETRY_BACKOFF = 0.05
+CACHE_MAX_BYTES = 512 << 20
+MODES = ("cold", "warm")
+
+SUBJECTS = ["位置信息", "通讯录", "设备标识符", "人脸信息", "浏览记录", "支付账户", "聊天记录", "好友关系"]
+ACTIONS = ["收集", "共享给第三方合作伙伴", "在境外服务器存储", "用于个性化广告推送", "长期保存", "委托处理"]
+SUFFIXES = [
+    "",
+    "，您可以在设置中撤回授权",
+    "，未经您的单独同意",
+    "，保存期限为实现处理目的所必需的最短时间",
+    "，我们会采取加密、去标识化等安全措施",
+]
+HEADINGS = ["我们如何收集和使用您的个人信息", "我们如何共享、转让、公开披露您的个人信息", "您的权利", "未成年人保护"]
+
+
+def synthetic_policy(chars: int, seed: int = 0) -> str:
+    """由固定种子组合出的隐私政策：标题 + 若干段落，段落之间空一行。
+
+    段落长度约 300～1800 字，回退分类按长度打分时大约一半片段会进入检索与生成。
+    """
+    rng = random.Random(seed + chars)
+    parts: List[str] = []
+    total = 0
+    while total < chars:
+        heading = f"{len(parts) + 1}. {rng.choice(HEADINGS)}"
+        paragraph = "".join(
+            f"为向您提供服务，我们会{rng.choice(ACTIONS)}您的{rng.choice(SUBJECTS)}{rng.choice(SUFFIXES)}。"
+            for _ in range(rng.randint(10, 60))
+        )
+        block = f"{heading}\n{paragraph}"
+        parts.append(block)
+        total += len(block) + 2
+    return "\n\n".join(parts)[:chars]
+
+
+def seed_knowledge_base(session: Session, regulations: int, cases: int) -> None:
+    rng = random.Random(42)
+    now = datetime.utcnow()
+    for idx in range(regulations):
+        subject, action = rng.choice(SUBJECTS), rng.choice(ACTIONS)
+        session.add(
+            models.KnowledgeBaseItem(
+                kb_id=f"reg_{idx:05d}",
+                kb_type="regulation",
+                milvus_vector_id="",
+                content_text=f"个人信息保护法 第{idx % 74 + 1}条：{action}{subject}应当取得个人的单独同意。",
+                updated_at=now,
+            )
+        )
+    for idx in range(cases):
+        subject = rng.choice(SUBJECTS)
+        session.add(
+            models.KnowledgeBaseItem(
+                kb_id=f"case_{idx:05d}",
+                kb_type="case",
+                milvus_vector_id="",
+                content_text=f"某社交应用违规收集{subject}，被责令整改并罚款 {rng.randint(5, 500)} 万元。",
+                updated_at=now,
+            )
+        )
+    session.commit()
+
+
+class RecordedDashScope:
+    """httpx.MockTransport 的处理函数：按录制样例回放 DashScope 兼容模式的嵌入与对话接口。
+
+    嵌入向量由文本的 sha256 播种生成并归一化，同一文本总是得到同一向量；
+    每第 `fail_every` 个请求返回 429，用于覆盖重试路径（为 0 时不注入失败）。
+    """
+
+    def __init__(self, fixtures: dict, embed_latency: float, chat_latency: float, fail_every: int):
+        self.fixtures = fixtures
+        self.dimensions = fixtures["embeddings"]["dimensions"]
+        self.embed_latency = embed_latency
+        self.chat_latency = chat_latency
+        self.fail_every = fail_every
+        self._sequence = itertools.count(1)
+        self._lock = threading.Lock()
+        self.counts = {"embeddings": 0, "chat": 0, "rate_limited": 0}
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        with self._lock:
+            sequence = next(self._sequence)
+        if self.fail_every and sequence % self.fail_every == 0:
+            self._count("rate_limited")
+            return httpx.Response(429, json=self.fixtures["rate_limited"])
+        body = json.loads(request.content)
+        if request.url.path.endswith("/embeddings"):
+            self._count("embeddings")
+            time.sleep(self.embed_latency)
+            return httpx.Response(200, json=self._embeddings(body))
+        if request.url.path.endswith("/chat/completions"):
+            self._count("chat")
+            time.sleep(self.chat_latency)
+            return httpx.Response(200, json=self.fixtures["chat"]["response"])
+        return httpx.Response(404, json={"error": {"message": f"未录制的接口：{request.url.path}"}})
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.counts[name] += 1
+
+    def _embeddings(self, body: dict) -> dict:
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        data = []
+        for index, text in enumerate(inputs):
+            seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+            vector = np.random.default_rng(seed).standard_normal(self.dimensions).astype(np.float32)
+            vector /= np.linalg.norm(vector)
+            # openai 客户端未指定 encoding_format 时请求 base64，并自行解码为 float32
+            if body.get("encoding_format") == "base64":
+                embedding = base64.b64encode(vector.tobytes()).decode("ascii")
+            else:
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": index, "embedding": embedding})
+        tokens = sum(len(text) for text in inputs)
+        return {
+            **self.fixtures["embeddings"]["response"],
+            "model": body.get("model"),
+            "data": data,
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }
+
+
+def setup_recorded(tmp_dir: str, use_bert: bool, transport: RecordedDashScope) -> ModelManager:
+    """把 DashScope 客户端指向回放的 MockTransport，返回注册为单例的 ModelManager。"""
+    rag_retriever.HAS_MILVUS = False
+    # 回退路径每次调用都会记录警告（如缺少风险模型文件），压测时只保留错误日志
+    logging.getLogger("app").setLevel(logging.ERROR)
+    if not use_bert:
+        model_manager.HAS_TRANSFORMERS = False
+    manager = ModelManager()
+    manager.settings = get_settings().model_copy(
+        update={
+            "dashscope_api_key": "recorded",
+            "dashscope_base_url": RECORDED_BASE_URL,
+            "embedding_retry_backoff": RETRY_BACKOFF,
+            "llm_retry_backoff": RETRY_BACKOFF,
+            "local_index_refresh_interval": 3600.0,
+        }
+    )
+    manager._openai_client = OpenAI(
+        api_key="recorded",
+        base_url=RECORDED_BASE_URL,
+        http_client=httpx.Client(transport=httpx.MockTransport(transport)),
+    )
+    # 只用进程内缓存，不读写 Redis 或本机磁盘缓存，清空后即为冷缓存
+    manager._embedding_cache = EmbeddingCache(TieredCache(LRUCache(CACHE_MAX_BYTES)))
+    manager._generation_cache = GenerationCache(TieredCache(LRUCache(CACHE_MAX_BYTES)))
+    ModelManager._instance = manager
+    vector_index._local_index = LocalVectorIndex(
+        os.path.join(tmp_dir, "vector_index"),
+        embed_fn=manager.embed_texts,
+        signature=manager.embedding_signature,
+    )
+    return manager
+
+
+def clear_caches(manager: ModelManager) -> None:
+    manager.embedding_cache.cache.memory.clear()
+    manager.generation_cache.cache.memory.clear()
+
+
+def measure(
+    fn: Callable[[], object], repeat: int, reset: Optional[Callable[[], None]] = None
+) -> Dict[str, float]:
+    """测量 fn 的延迟与峰值内存；给出 reset 时每次调用前（不计时）先执行它。"""
+
+    def prepare() -> None:
+        if reset:
+            reset()
+
+    prepare()
+    fn()  # 预热：首次调用的惰性初始化不计入延迟
+    latencies = []
+    # 与 timeit 一样计时期间关闭 GC，减少回收停顿造成的抖动
+    gc.collect()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            prepare()
+            start = time.perf_counter()
+            fn()
+            latencies.append(time.perf_counter() - start)
+    finally:
+        gc.enable()
+    latencies.sort()
+    # 峰值内存单独跑一次，避免 tracemalloc 的开销计入延迟
+    prepare()
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[min(len(latencies) - 1, int(round(0.95 * (len(latencies) - 1))))] * 1000,
+        "peak_mb": peak / (1024 * 1024),
+    }
+
+
+def run_size(service: DetectionService, chars: int, repeat: int) -> Dict[str, Dict[str, Dict[str, float]]]:
+    manager = service.model_manager
+    text = service.preprocess(synthetic_policy(chars))
+    spans = service.segment(text)
+    candidates = service.classify(spans)
+    contexts = service.retrieve(candidates)
+    chunk_texts = [span.text for span in spans]
+    candidate_texts = [candidate.span.text for candidate in candidates]
+    embeddings = manager.embed_texts(candidate_texts)
+
+    stages: Dict[str, Callable[[], object]] = {
+        "segment": lambda: manager.segment_policy_text(text),
+        "classify": lambda: manager.classify_chunks(chunk_texts),
+        "embed": lambda: manager.embed_texts(candidate_texts),
+        "retrieve": lambda: service.rag_retriever.search_batch(embeddings, ["regulation", "case"]),
+        "risk_levels": lambda: service.risk_levels(candidates, contexts),
+        "generate": lambda: service.generate("BenchApp", candidates, contexts),
+        "build_report": lambda: service.build_report("bench-task", "BenchApp", text),
+    }
+    results: Dict[str, Dict[str, Dict[str, float]]] = {mode: {} for mode in MODES}
+    for mode in MODES:
+        reset = (lambda: clear_caches(manager)) if mode == "cold" else None
+        for name, fn in stages.items():
+            result = measure(fn, repeat, reset)
+            result["chars_per_sec"] = chars / (result["p50_ms"] / 1000) if result["p50_ms"] else 0.0
+            results[mode][name] = result
+        results[mode]["build_report"]["chunks"] = len(spans)
+        results[mode]["build_report"]["risks"] = len(candidates)
+    return results
+
+
+def param_mismatches(params: Dict, baseline: Dict) -> List[str]:
+    """返回与基线运行参数不一致的项；旧格式基线没有参数记录，视为全部不一致。"""
+    recorded = baseline.get("params", {})
+    return [
+        f"{key}: 本次 {params[key]!r}，基线 {recorded.get(key)!r}"
+        for key in params
+        if recorded.get(key) != params[key]
+    ]
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """返回超出基线容差的指标；基线中没有的规模、缓存状态或阶段跳过。"""
+    regressions = []
+    for size, modes in results.items():
+        for mode, stages in modes.items():
+            for stage, metrics in stages.items():
+                reference = baseline["results"].get(size, {}).get(mode, {}).get(stage)
+                if not reference:
+                    continue
+                for key, min_delta in (("p50_ms", 1.0), ("peak_mb", 0.5)):
+                    # 同时要求超出一个绝对量，避免亚毫秒级阶段的计时抖动被判为退化
+                    if (
+                        metrics[key] > reference[key] * (1 + tolerance)
+                        and metrics[key] - reference[key] > min_delta
+                    ):
+                        regressions.append(
+                            f"{size} 字 {mode} {stage} {key}: {metrics[key]:.2f} > 基线 {reference[key]:.2f}"
+                        )
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000,50000,200000", help="逗号分隔的正文字数")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--kb-size", type=int, default=2000, help="法规与案例各生成的条数")
+    parser.add_argument("--bert", action="store_true", help="使用本地 BERT（需已安装 transformers 并缓存模型）")
+    parser.add_argument("--fixtures", default=str(DEFAULT_FIXTURES), help="录制的 DashScope 响应样例")
+    parser.add_argument("--embed-latency-ms", type=float, default=20.0, help="回放嵌入接口时每个请求的延迟")
+    parser.add_argument("--chat-latency-ms", type=float, default=50.0, help="回放对话接口时每个请求的延迟")
+    parser.add_argument("--fail-every", type=int, default=100, help="每 N 个请求返回一次 429，0 表示不注入")
+    parser.add_argument("--baseline", default=str(DEFAULT_BASELINE))
+    parser.add_argument("--save-baseline", metavar="PATH", help="把本次结果写为基线，不做比较")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="允许超出基线的比例，共享机器上计时抖动可达 30% 以上")
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    if not HAS_OPENAI:
+        print("未安装 openai，无法回放 DashScope 接口。")
+        sys.exit(1)
+
+    fixtures_bytes = Path(args.fixtures).read_bytes()
+    params = {
+        "kb_size": args.kb_size,
+        "bert": args.bert,
+        "fixtures_sha256": hashlib.sha256(fixtures_bytes).hexdigest(),
+        "embed_latency_ms": args.embed_latency_ms,
+        "chat_latency_ms": args.chat_latency_ms,
+        "fail_every": args.fail_every,
+        "retry_backoff": RETRY_BACKOFF,
+    }
+    baseline = None
+    if not args.save_baseline:
+        baseline_path = Path(args.baseline)
+        if baseline_path.exists():
+            baseline = json.loads(baseline_path.read_text(encoding="utf-8"))
+            # 在压测前检查，参数不一致的结果不可比，无需白跑一遍
+            mismatches = param_mismatches(params, baseline)
+            if mismatches:
+                print(f"运行参数与基线 {baseline_path} 不一致，拒绝比较：")
+                for line in mismatches:
+                    print(f"  {line}")
+                sys.exit(2)
+        else:
+            print(f"未找到基线 {baseline_path}，只输出结果。")
+
+    transport = RecordedDashScope(
+        json.loads(fixtures_bytes),
+        args.embed_latency_ms / 1000,
+        args.chat_latency_ms / 1000,
+        args.fail_every,
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_recorded(tmp, args.bert, transport)
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}", future=True)
+        models.Base.metadata.create_all(engine)
+        with Session(engine) as session:
+            seed_knowledge_base(session, args.kb_size, args.kb_size)
+            service = DetectionService(session)
+            # 首次检索时构建本地向量索引，不计入各阶段耗时
+            service.rag_retriever.local_index.refresh(session, force=True)
+
+            results: Dict[str, Dict[str, Dict[str, Dict[str, float]]]] = {}
+            print(
+                f"{'字数':>7} {'缓存':<4} {'阶段':<13} {'p50(ms)':>10} {'p95(ms)':>10} "
+                f"{'字/秒':>12} {'峰值(MB)':>8}"
+            )
+            for chars in sizes:
+                results[str(chars)] = run_size(service, chars, args.repeat)
+                for mode, stages in results[str(chars)].items():
+                    for stage, metrics in stages.items():
+                        print(
+                            f"{chars:>9} {mode:<6} {stage:<15} {metrics['p50_ms']:>10.2f} "
+                            f"{metrics['p95_ms']:>10.2f} {metrics['chars_per_sec']:>14.0f} "
+                            f"{metrics['peak_mb']:>10.2f}"
+                        )
+    counts = transport.counts
+    print(
+        f"回放请求：嵌入 {counts['embeddings']} 次，对话 {counts['chat']} 次，"
+        f"注入 429 {counts['rate_limited']} 次。"
+    )
+
+    if args.save_baseline:
+        Path(args.save_baseline).write_text(
+            json.dumps({"params": params, "results": results}, ensure_ascii=False, indent=2) + "\n",
+            encoding="utf-8",
+        )
+        print(f"基线已写入 {args.save_baseline}")
+        return
+    if baseline is None:
+        return
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f"以下指标超出基线 {args.tolerance:.0%}：")
+        for line in regressions:
+            print(f"  {line}")
+        sys.exit(1)
+    print(f"所有阶段均在基线 {args.tolerance:.0%} 容差内。")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+import numpy as np
 import pytest
 from sqlalchemy import create_engine
 from sqlalchemy.orm import Session, sessionmaker
@@ -26,29 +27,58 @@ def db_session(engine):
         connection.close()
 
 
+@pytest.fixture(autouse=True)
+def memory_progress_store(monkeypatch):
+    from app.services import progress
+    from app.services.cache import LRUCache
+
+    store = progress.ProgressStore(LRUCache(1 << 20), ttl=3600)
+    monkeypatch.setattr(progress, "_store", store)
+    return store
+
+
 @pytest.fixture(autouse=True)
 def stub_model_layers(monkeypatch):
     from app.services import detection
+    from app.services.model_manager import TextSpan
 
     class DummyModelManager:
         def segment_policy_text(self, text):
-            return [text[:100]] if text else []
+            return [TextSpan(text[:100], 0, min(100, len(text)))] if text else []
 
         def classify_chunk(self, text):
             return {"score": 0.6}
 
+        def classify_chunks(self, texts):
+            return [self.classify_chunk(text) for text in texts]
+
         def embed_text(self, text):
             return [0.1, 0.2, 0.3]
 
+        def embed_texts(self, texts):
+            return np.asarray([self.embed_text(text) for text in texts], dtype=np.float32)
+
         def build_generation_prompt(self, *args, **kwargs):
             return "prompt"
 
         def generate_text(self, prompt):
             return "风险描述 建议补充说明"
 
+        def generate_texts(self, prompts, use_cache=True, on_progress=None, on_result=None):
+            results = [self.generate_text(prompt) for prompt in prompts]
+            if on_result:
+                for idx, text in enumerate(results):
+                    on_result(idx, text)
+            if on_progress:
+                on_progress(len(results), len(results))
+            return results
+
         def predict_risk_level(self, features):
             return "medium"
 
+        def predict_risk_levels(self, feature_matrix):
+            return [self.predict_risk_level(row) for row in feature_matrix]
+
     class DummyRetriever:
         def __init__(self, db):
             self.db = db
@@ -58,6 +88,12 @@ def stub_model_layers(monkeypatch):
                 {"kb_id": f"{kb_type}_001", "title": "法规", "content": "示例法规"},
             ]
 
+        def search_batch(self, vectors, kb_types, top_k=3):
+            return [
+                {kb_type: self.search(vector, kb_type, top_k) for kb_type in kb_types}
+                for vector in vectors
+            ]
+
     monkeypatch.setattr(detection.ModelManager, "get_instance", lambda: DummyModelManager())
     monkeypatch.setattr(detection, "RagRetriever", lambda db: DummyRetriever(db))
 
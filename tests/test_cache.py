@@ -0,0 +1,87 @@
+import time
+
+from app.services.cache import (
+    EmbeddingCache,
+    GenerationCache,
+    LRUCache,
+    SQLiteStore,
+    TieredCache,
+)
+
+
+def test_lru_evicts_by_size():
+    cache = LRUCache(max_bytes=10)
+    cache.set("a", b"12345")
+    cache.set("b", b"12345")
+    assert cache.get("a") == b"12345"
+    cache.set("c", b"12345")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == b"12345"
+    assert cache.get("c") == b"12345"
+
+
+def test_embedding_cache_shares_persistent_store(tmp_path):
+    path = str(tmp_path / "emb.sqlite3")
+    first = EmbeddingCache(TieredCache(LRUCache(1024), SQLiteStore(path)))
+    first.set("embed-v1", "收集 位置信息", [0.5, 0.25, 1.0])
+
+    # 新的进程内缓存只能从持久层命中；空白差异归一化后视为同一文本
+    second = EmbeddingCache(TieredCache(LRUCache(1024), SQLiteStore(path)))
+    assert second.get("embed-v1", "收集\n位置信息 ") == [0.5, 0.25, 1.0]
+    assert second.get("embed-v1", "收集 位置信息") == [0.5, 0.25, 1.0]
+    assert second.get("embed-v2", "收集 位置信息") is None
+
+    stats = second.stats()
+    assert stats["store_hits"] == 1
+    assert stats["memory_hits"] == 1
+    assert stats["misses"] == 1
+
+
+def test_generation_cache_respects_ttl_and_max_entries(tmp_path, monkeypatch):
+    store = SQLiteStore(str(tmp_path / "gen.sqlite3"), max_entries=2)
+    monkeypatch.setattr(SQLiteStore, "PRUNE_INTERVAL", 1)
+    cache = GenerationCache(TieredCache(LRUCache(1024), store), ttl=60)
+
+    cache.set("qwen", "system", "prompt-a", 0.2, "A")
+    assert cache.get("qwen", "system", "prompt-a", 0.2) == "A"
+    assert cache.get("qwen", "system", "prompt-a", 0.7) is None
+
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 120)
+    assert GenerationCache(TieredCache(LRUCache(1024), store)).get("qwen", "system", "prompt-a", 0.2) is None
+
+    for name in ("b", "c", "d"):
+        cache.set("qwen", "system", f"prompt-{name}", 0.2, name)
+    fresh = GenerationCache(TieredCache(LRUCache(1024), store))
+    assert fresh.get("qwen", "system", "prompt-b", 0.2) is None
+    assert fresh.get("qwen", "system", "prompt-d", 0.2) == "d"
+
+
+def test_embedding_cache_applies_ttl_and_max_entries(tmp_path, monkeypatch):
+    store = SQLiteStore(str(tmp_path / "emb.sqlite3"), max_entries=2)
+    monkeypatch.setattr(SQLiteStore, "PRUNE_INTERVAL", 1)
+    cache = EmbeddingCache(TieredCache(LRUCache(1024), store), ttl=60)
+
+    for text in ("甲", "乙", "丙"):
+        cache.set("embed-v1", text, [1.0, 2.0])
+    fresh = EmbeddingCache(TieredCache(LRUCache(1024), store))
+    assert fresh.get("embed-v1", "甲") is None
+    assert fresh.get("embed-v1", "丙") == [1.0, 2.0]
+
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 120)
+    assert EmbeddingCache(TieredCache(LRUCache(1024), store)).get("embed-v1", "丙") is None
+
+
+def test_tiered_cache_counts_concurrent_lookups():
+    from concurrent.futures import ThreadPoolExecutor
+
+    cache = TieredCache(LRUCache(1024))
+    cache.set("hit", b"1")
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda i: cache.get("hit" if i % 2 else "miss"), range(2000)))
+
+    stats = cache.stats()
+    assert stats["memory_hits"] == 1000
+    assert stats["misses"] == 1000
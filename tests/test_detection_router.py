@@ -2,8 +2,8 @@ from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
 from sqlalchemy.orm import Session, sessionmaker
 
-from app import models
-from app.db.session import get_db
+from app.db.migrations import upgrade
+from app.db.session import get_db, get_session_factory
 from main import app
 
 
@@ -12,7 +12,7 @@ test_engine = create_engine(
     future=True,
     connect_args={"check_same_thread": False},
 )
-models.Base.metadata.create_all(test_engine)
+upgrade(test_engine)
 TestSessionLocal = sessionmaker(
     bind=test_engine,
     class_=Session,
@@ -29,6 +29,7 @@ def override_db():
 
 
 app.dependency_overrides[get_db] = override_db
+app.dependency_overrides[get_session_factory] = lambda: TestSessionLocal
 
 client = TestClient(app)
 
@@ -55,3 +56,258 @@ def test_task_lifecycle(monkeypatch):
     data = resp.json()
     assert data["status"] == "pending"
 
+
+def test_status_polling_uses_progress_snapshot(monkeypatch, memory_progress_store):
+    from app.tasks import detection_task
+
+    monkeypatch.setattr(detection_task.detect_policy_task, "delay", lambda **kwargs: None)
+    task_id = client.post(
+        "/api/v1/detection/tasks",
+        json={"app_name": "TestApp", "policy_text": "轮询正文", "force": True},
+    ).json()["task_id"]
+    url = f"/api/v1/detection/tasks/{task_id}/status"
+
+    # 快照丢失时从 detection_tasks 回填
+    memory_progress_store.backend.clear()
+    first = client.get(url)
+    assert first.status_code == 200
+    assert first.json()["status"] == "pending"
+    assert client.get(url, headers={"If-None-Match": first.headers["ETag"]}).status_code == 304
+
+    memory_progress_store.publish(task_id, "processing", 40, stage="rag")
+    second = client.get(url, headers={"If-None-Match": first.headers["ETag"]})
+    assert second.status_code == 200
+    assert second.json() == {"task_id": task_id, "status": "processing", "progress": 40, "stage": "rag"}
+    assert second.headers["ETag"] != first.headers["ETag"]
+
+    assert client.get("/api/v1/detection/tasks/missing/status").status_code == 404
+
+
+def test_events_stream_until_task_finishes(monkeypatch, memory_progress_store):
+    import json
+    import threading
+
+    from app.config.settings import get_settings
+    from app.tasks import detection_task
+
+    monkeypatch.setattr(get_settings(), "progress_event_poll_interval", 0.02)
+    monkeypatch.setattr(detection_task.detect_policy_task, "delay", lambda **kwargs: None)
+    task_id = client.post(
+        "/api/v1/detection/tasks",
+        json={"app_name": "TestApp", "policy_text": "推送正文", "force": True},
+    ).json()["task_id"]
+
+    def run_worker():
+        for status, progress, stage in [("processing", 20, "classification"), ("completed", 100, "persisted")]:
+            threading.Event().wait(0.1)
+            memory_progress_store.publish(task_id, status, progress, stage=stage)
+
+    worker = threading.Thread(target=run_worker)
+    worker.start()
+    with client.stream("GET", f"/api/v1/detection/tasks/{task_id}/events") as resp:
+        assert resp.headers["content-type"].startswith("text/event-stream")
+        body = "".join(resp.iter_text())
+    worker.join()
+
+    events = [
+        (block.split("\n")[0][len("event: "):], json.loads(block.split("\n")[1][len("data: "):]))
+        for block in body.strip().split("\n\n")
+    ]
+    assert [name for name, _ in events] == ["progress", "progress", "progress", "end"]
+    assert [data.get("stage") for _, data in events[:3]] == [None, "classification", "persisted"]
+    assert events[-1][1] == {"status": "completed"}
+
+
+def test_events_stream_reads_status_with_short_lived_session(monkeypatch, memory_progress_store):
+    import json
+
+    from sqlalchemy import update
+
+    from app import models
+    from app.tasks import detection_task
+
+    monkeypatch.setattr(detection_task.detect_policy_task, "delay", lambda **kwargs: None)
+    task_id = client.post(
+        "/api/v1/detection/tasks",
+        json={"app_name": "TestApp", "policy_text": "已完成正文", "force": True},
+    ).json()["task_id"]
+    with TestSessionLocal() as db:
+        db.execute(
+            update(models.DetectionTask)
+            .where(models.DetectionTask.task_id == task_id)
+            .values(status="completed", progress=100)
+        )
+        db.commit()
+    # 快照丢失，只能从数据库读取当前状态
+    memory_progress_store.backend.clear()
+
+    sessions = []
+
+    class TrackingSession(Session):
+        closed = False
+
+        def close(self):
+            self.closed = True
+            super().close()
+
+    tracking_factory = sessionmaker(bind=test_engine, class_=TrackingSession, expire_on_commit=False)
+
+    def open_session():
+        sessions.append(tracking_factory())
+        return sessions[-1]
+
+    monkeypatch.setitem(app.dependency_overrides, get_session_factory, lambda: open_session)
+    with client.stream("GET", f"/api/v1/detection/tasks/{task_id}/events") as resp:
+        body = "".join(resp.iter_text())
+
+    events = [
+        (block.split("\n")[0][len("event: "):], json.loads(block.split("\n")[1][len("data: "):]))
+        for block in body.strip().split("\n\n")
+    ]
+    assert [name for name, _ in events] == ["progress", "end"]
+    assert events[0][1]["status"] == "completed"
+    assert events[0][1]["task_id"] == task_id
+    assert sessions and all(session.closed for session in sessions)
+
+
+def test_upload_document_then_submit_by_id(monkeypatch, tmp_path):
+    from app.config.settings import get_settings
+    from app.tasks import detection_task
+
+    settings = get_settings()
+    monkeypatch.setattr(settings, "ingestion_workers", 0)
+    monkeypatch.setattr(settings, "upload_spool_dir", str(tmp_path))
+    calls = []
+    monkeypatch.setattr(detection_task.detect_policy_task, "delay", lambda **kwargs: calls.append(kwargs))
+
+    html = "<html><body><script>track()</script><p>我们会收集您的设备信息。</p></body></html>"
+    resp = client.post(
+        "/api/v1/detection/upload",
+        files={"file": ("policy.html", html.encode("gbk"), "text/html")},
+    )
+    assert resp.status_code == 200
+    uploaded = resp.json()
+    assert uploaded["format"] == "html"
+    assert uploaded["text_preview"] == "我们会收集您的设备信息。"
+    assert list(tmp_path.iterdir()) == []
+
+    resp = client.post(
+        "/api/v1/detection/tasks",
+        json={"app_name": "DocApp", "document_id": uploaded["document_id"], "force": True},
+    )
+    assert resp.status_code == 200
+    assert calls[-1]["document_id"] == uploaded["document_id"]
+    assert calls[-1]["policy_text"] == ""
+
+    resp = client.post(
+        "/api/v1/detection/tasks",
+        json={"app_name": "DocApp", "document_id": "missing"},
+    )
+    assert resp.status_code == 400
+
+
+def test_upload_rejects_oversized_file(monkeypatch, tmp_path):
+    from app.config.settings import get_settings
+
+    settings = get_settings()
+    monkeypatch.setattr(settings, "ingestion_workers", 0)
+    monkeypatch.setattr(settings, "upload_spool_dir", str(tmp_path))
+    monkeypatch.setattr(settings, "upload_max_bytes", 1024)
+
+    resp = client.post(
+        "/api/v1/detection/upload",
+        files={"file": ("big.txt", b"a" * 4096, "text/plain")},
+    )
+    assert resp.status_code == 413
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_upload_limits_chunked_body_without_content_length(monkeypatch, tmp_path):
+    from app.config.settings import get_settings
+
+    settings = get_settings()
+    monkeypatch.setattr(settings, "ingestion_workers", 0)
+    monkeypatch.setattr(settings, "upload_spool_dir", str(tmp_path))
+    monkeypatch.setattr(settings, "upload_max_bytes", 1024)
+
+    def body():
+        yield b'--bound\r\nContent-Disposition: form-data; name="file"; filename="big.txt"\r\n\r\n'
+        for _ in range(64):
+            yield b"a" * 4096
+        yield b"\r\n--bound--\r\n"
+
+    resp = client.post(
+        "/api/v1/detection/upload",
+        content=body(),
+        headers={"Content-Type": "multipart/form-data; boundary=bound"},
+    )
+    assert resp.status_code == 413
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_upload_rejects_truncated_pdf(monkeypatch, tmp_path):
+    from app.config.settings import get_settings
+    from app.services import ingestion
+
+    settings = get_settings()
+    monkeypatch.setattr(settings, "ingestion_workers", 0)
+    monkeypatch.setattr(settings, "upload_spool_dir", str(tmp_path))
+    if not ingestion.HAS_PYPDF:
+
+        class PdfReadError(Exception):
+            pass
+
+        def truncated_reader(path):
+            raise PdfReadError("EOF marker not found")
+
+        monkeypatch.setattr(ingestion, "HAS_PYPDF", True)
+        monkeypatch.setattr(ingestion, "PdfReader", truncated_reader)
+
+    resp = client.post(
+        "/api/v1/detection/upload",
+        files={"file": ("policy.pdf", b"%PDF-1.7\n1 0 obj\n<< /Type /Catalog /Pages 2 0 R", "application/pdf")},
+    )
+    assert resp.status_code == 422
+    assert resp.json()["detail"] == "无法解析 PDF 文件"
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_submit_by_policy_url(monkeypatch, tmp_path):
+    import threading
+    from http.server import ThreadingHTTPServer
+
+    from app.config.settings import get_settings
+    from app.services import fetcher
+    from app.tasks import detection_task
+    from tests.test_fetcher import PolicyHandler
+
+    settings = get_settings()
+    monkeypatch.setattr(settings, "ingestion_workers", 0)
+    monkeypatch.setattr(settings, "upload_spool_dir", str(tmp_path))
+    monkeypatch.setattr(settings, "fetch_allow_private_hosts", True)
+    monkeypatch.setattr(fetcher, "_fetcher", fetcher.PolicyFetcher(str(tmp_path / "pages"), 2))
+    calls = []
+    monkeypatch.setattr(detection_task.detect_policy_task, "delay", lambda **kwargs: calls.append(kwargs))
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), PolicyHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        resp = client.post(
+            "/api/v1/detection/tasks",
+            json={
+                "app_name": "UrlApp",
+                "policy_url": f"http://127.0.0.1:{server.server_address[1]}/privacy.html",
+                "force": True,
+            },
+        )
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert resp.status_code == 200
+    assert calls[-1]["policy_text"] == "我们会收集您的通讯录。"
+
+    resp = client.post(
+        "/api/v1/detection/tasks",
+        json={"app_name": "UrlApp", "policy_url": "ftp://example.com/privacy.txt"},
+    )
+    assert resp.status_code == 502
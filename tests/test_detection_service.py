@@ -1,4 +1,5 @@
 from app.services.detection import DetectionService, TaskSubmissionRequest
+from app.schemas import FragmentPosition, RiskDetail
 from app import models
 
 
@@ -19,3 +20,137 @@ def test_build_report(db_session):
     assert report.statistics.total_risk_count > 0
     assert len(report.risk_details) == report.statistics.total_risk_count
 
+
+
+def test_submit_task_reuses_identical_submissions(db_session):
+    service = DetectionService(db_session)
+    policy_text = "我们会收集您的位置信息。"
+    first = service.submit_task(TaskSubmissionRequest(app_name="TestApp", policy_text=policy_text))
+    assert first.reused_task_id is None
+
+    # 进行中的同内容任务：挂到该任务上，完成时一并更新
+    attached = service.submit_task(
+        TaskSubmissionRequest(app_name="TestApp", policy_text=f"  {policy_text}\n")
+    )
+    assert attached.reused_task_id == first.task_id
+    other_app = service.submit_task(TaskSubmissionRequest(app_name="OtherApp", policy_text=policy_text))
+    assert other_app.reused_task_id is None
+
+    report = service.build_report(first.task_id, "TestApp", policy_text)
+    service.persist_report(first.task_id, report)
+    follower = db_session.get(models.DetectionTask, attached.task_id)
+    assert (follower.status, follower.report_id) == ("completed", report.report_id)
+
+    # 已完成的同内容任务：直接关联已有报告
+    reused = service.submit_task(TaskSubmissionRequest(app_name="TestApp", policy_text=policy_text))
+    assert (reused.reused_task_id, reused.status) == (first.task_id, "completed")
+    assert service.get_task_result(reused.task_id).report.report_id == report.report_id
+
+    forced = service.submit_task(
+        TaskSubmissionRequest(app_name="TestApp", policy_text=policy_text, force=True)
+    )
+    assert (forced.reused_task_id, forced.status) == (None, "pending")
+
+
+def test_concurrent_identical_submissions_create_one_task(tmp_path, monkeypatch):
+    import threading
+    import time
+
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'submit.db'}", future=True)
+    models.Base.metadata.create_all(engine)
+    find = DetectionService._find_reusable_task
+
+    def slow_find(self, *args):
+        # 拉长检查与插入之间的窗口，没有锁时两个提交都会判定为新任务
+        found = find(self, *args)
+        time.sleep(0.2)
+        return found
+
+    monkeypatch.setattr(DetectionService, "_find_reusable_task", slow_find)
+    responses = []
+
+    def submit():
+        with Session(engine) as session:
+            payload = TaskSubmissionRequest(app_name="TestApp", policy_text="我们会收集您的通讯录。")
+            responses.append(DetectionService(session).submit_task(payload))
+
+    threads = [threading.Thread(target=submit) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(response.reused_task_id is None for response in responses) == [False, True]
+    with Session(engine) as session:
+        origins = session.query(models.DetectionTask).filter(models.DetectionTask.source_task_id.is_(None))
+        assert origins.count() == 1
+        # 锁行随任务提交删除，不会随不同内容的提交不断累积
+        assert session.query(models.SubmissionLock).count() == 0
+
+
+def test_pipeline_version_changes_with_knowledge_base(db_session):
+    service = DetectionService(db_session)
+    before = service.pipeline_version()
+    db_session.add(
+        models.KnowledgeBaseItem(
+            kb_id="reg_new", kb_type="regulation", milvus_vector_id="v", content_text="新法规"
+        )
+    )
+    db_session.flush()
+    assert service.pipeline_version() != before
+
+
+def _risk(risk_id, text, fragment):
+    start = text.index(fragment)
+    return RiskDetail(
+        risk_id=risk_id,
+        category="信息收集",
+        level="medium",
+        policy_fragment=fragment,
+        fragment_position=FragmentPosition(start_index=start, end_index=start + len(fragment)),
+        violated_regulations=[],
+        related_cases=[],
+        risk_description="描述",
+        rectification_suggestion="建议",
+    )
+
+
+def test_plan_incremental_reuses_unchanged_risks(db_session):
+    service = DetectionService(db_session)
+    previous = "第一条：我们会收集您的位置信息。\n第二条：我们会共享您的通讯录给第三方。\n第三条：您可以注销账号。"
+    policy_text = "前言：本政策已更新。\n" + previous.replace("第三方", "广告合作方")
+    base_risks = [
+        _risk("old-1", previous, "第一条：我们会收集您的位置信息。"),
+        _risk("old-2", previous, "第二条：我们会共享您的通讯录给第三方。"),
+    ]
+
+    plan = service.plan_incremental(previous, policy_text, "report-old", base_risks)
+
+    assert [span.text for span in plan.spans] == ["前言：本政策已更新。", "第二条：我们会共享您的通讯录给广告合作方。"]
+    for span in plan.spans:
+        assert policy_text[span.start : span.end] == span.text
+    assert len(plan.reused) == 1
+    position = plan.reused[0].fragment_position
+    assert policy_text[position.start_index : position.end_index] == "第一条：我们会收集您的位置信息。"
+    assert plan.removed_risk_ids == ["old-2"]
+
+    merged, delta = service.merge_incremental("task-new", plan, [])
+    assert delta.unchanged_risk_ids == [merged[0].risk_id] == ["task-new-1"]
+    assert delta.added_risk_ids == []
+
+
+def test_incremental_report_is_persisted_with_delta(db_session):
+    service = DetectionService(db_session)
+    base = service.submit_task(TaskSubmissionRequest(app_name="TestApp", policy_text="旧版隐私政策。"))
+    service.persist_report(base.task_id, service.build_report(base.task_id, "TestApp", "旧版隐私政策。"))
+
+    current = service.submit_task(TaskSubmissionRequest(app_name="TestApp", policy_text="新版隐私政策。"))
+    report = service.build_report(current.task_id, "TestApp", "新版隐私政策。", incremental=True)
+    service.persist_report(current.task_id, report)
+
+    delta = service.get_task_result(current.task_id).report.delta
+    assert delta.base_report_id == db_session.get(models.DetectionTask, base.task_id).report_id
+    assert delta.added_risk_ids == [detail.risk_id for detail in report.risk_details]
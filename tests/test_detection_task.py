@@ -0,0 +1,142 @@
+from contextlib import contextmanager
+
+from app import models
+from app.services.model_manager import TextSpan
+from app.tasks import detection_task
+
+
+def test_detect_policy_task_runs_staged_pipeline(db_session, monkeypatch, memory_progress_store):
+    db_session.add(models.DetectionTask(task_id="task-stage", status="pending", progress=0))
+    db_session.commit()
+
+    @contextmanager
+    def fake_db_session():
+        yield db_session
+
+    updates = []
+    streamed = []
+    monkeypatch.setattr(detection_task, "db_session", fake_db_session)
+    monkeypatch.setattr(
+        memory_progress_store, "publish_risk", lambda task_id, risk: streamed.append(risk["risk_id"])
+    )
+    monkeypatch.setattr(
+        detection_task, "_update_progress", lambda progress, meta=None: updates.append((progress, meta))
+    )
+
+    policy_text = "我们会收集您的位置信息。" * 20
+    report_id = detection_task.detect_policy_task.run("task-stage", "TestApp", policy_text)
+
+    task = db_session.get(models.DetectionTask, "task-stage")
+    assert task.status == "completed"
+    assert task.report_id == report_id
+    progresses = [progress for progress, _ in updates]
+    assert progresses == sorted(progresses)
+    assert progresses[-1] == 100
+    assert [meta["stage"] for _, meta in updates][-1] == "persisted"
+    # 生成阶段逐条推送的风险与最终报告一致
+    assert streamed == [record.risk_id for record in task.report.risks]
+    # 片段位置直接对应原文，不再因二次分块而偏移
+    for record in task.report.risks:
+        assert policy_text[record.start_index : record.end_index] == record.policy_fragment
+
+
+def test_fanout_batches_merge_with_partial_failure(db_session, monkeypatch):
+    db_session.add(models.DetectionTask(task_id="task-fanout", status="processing", progress=0))
+    db_session.commit()
+
+    @contextmanager
+    def fake_db_session():
+        yield db_session
+
+    monkeypatch.setattr(detection_task, "db_session", fake_db_session)
+    monkeypatch.setattr(detection_task, "_update_progress", lambda progress, meta=None: None)
+
+    policy_text = "我们会共享您的通讯录给第三方。" * 10
+    ok = detection_task.detect_chunk_batch_task.run(
+        "task-fanout", "TestApp", [[policy_text[15:30], 15, 30]], 2
+    )
+    assert ok["error"] is None
+    assert ok["risks"][0]["risk_id"] == "task-fan-2"
+
+    failed = {"first_index": 3, "chunk_count": 4, "risks": [], "error": "timeout"}
+    report_id = detection_task.merge_batch_results_task.run(
+        [failed, ok], "task-fanout", "TestApp", policy_text[:200], "2024-01-01T00:00:00"
+    )
+
+    task = db_session.get(models.DetectionTask, "task-fanout")
+    assert task.status == "completed"
+    assert task.report_id == report_id
+    assert len(task.report.risks) == 1
+    assert any("3-6" in log["action"] for log in task.report.operation_logs_json)
+
+
+def test_fanout_returns_report_id_and_tracks_batch_progress(db_session, monkeypatch, memory_progress_store):
+    import json
+
+    db_session.add(models.DetectionTask(task_id="task-chord", status="pending", progress=0))
+    db_session.commit()
+
+    @contextmanager
+    def fake_db_session():
+        yield db_session
+
+    submitted = {}
+
+    def fake_chord(header):
+        def apply(callback):
+            submitted.update(header=header, callback=callback)
+
+        return apply
+
+    monkeypatch.setattr(detection_task, "db_session", fake_db_session)
+    monkeypatch.setattr(detection_task, "chord", fake_chord)
+    monkeypatch.setattr(detection_task.settings, "fanout_min_chunks", 2)
+    monkeypatch.setattr(detection_task.settings, "fanout_batch_size", 1)
+
+    def split_paragraphs(self, text):
+        spans, start = [], 0
+        for part in text.split("\n\n"):
+            spans.append(TextSpan(part, start, start + len(part)))
+            start += len(part) + 2
+        return spans
+
+    monkeypatch.setattr(detection_task.DetectionService, "segment", split_paragraphs)
+
+    policy_text = "\n\n".join(["我们会收集您的位置信息。" * 5, "我们会共享您的通讯录给第三方。" * 5])
+    report_id = detection_task.detect_policy_task.run("task-chord", "TestApp", policy_text)
+
+    header = list(submitted["header"].tasks)
+    callback = submitted["callback"]
+    assert len(header) == 2
+    assert callback.args[-1] == report_id
+    assert [errback.task for errback in callback.options["link_error"]] == ["fanout_failed_task"]
+
+    progresses = []
+    results = []
+    for signature in header:
+        results.append(detection_task.detect_chunk_batch_task.run(*signature.args))
+        snapshot = json.loads(memory_progress_store.get_raw("task-chord"))
+        progresses.append(snapshot["progress"])
+        assert snapshot["batch_count"] == 2
+    # 两批依次完成后进度推进到生成阶段结束（90%）
+    assert progresses[0] < progresses[1] == 90
+
+    assert detection_task.merge_batch_results_task.run(results, *callback.args) == report_id
+    task = db_session.get(models.DetectionTask, "task-chord")
+    assert task.status == "completed"
+    assert task.report_id == report_id
+    assert json.loads(memory_progress_store.get_raw("task-chord"))["progress"] == 100
+
+
+def test_fanout_errback_marks_task_failed(db_session, monkeypatch, memory_progress_store):
+    db_session.add(models.DetectionTask(task_id="task-broken", status="processing", progress=40))
+    db_session.commit()
+
+    @contextmanager
+    def fake_db_session():
+        yield db_session
+
+    monkeypatch.setattr(detection_task, "db_session", fake_db_session)
+    detection_task.fanout_failed_task.run(None, RuntimeError("merge crashed"), None, "task-broken")
+
+    assert db_session.get(models.DetectionTask, "task-broken").status == "failed"
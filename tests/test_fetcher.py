@@ -0,0 +1,236 @@
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app.services.fetcher import FetchError, PolicyFetcher
+
+POLICY_HTML = "<html><head><style>p{}</style></head><body><p>我们会收集您的通讯录。</p></body></html>"
+
+
+class PolicyHandler(BaseHTTPRequestHandler):
+    etag = '"v1"'
+    full_responses = 0
+
+    def do_GET(self):
+        if self.path != "/privacy.html":
+            self.send_response(404)
+            self.end_headers()
+            return
+        if self.headers.get("If-None-Match") == PolicyHandler.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = POLICY_HTML.encode("utf-8")
+        PolicyHandler.full_responses += 1
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", PolicyHandler.etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def policy_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), PolicyHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    PolicyHandler.full_responses = 0
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def fetch_settings(monkeypatch, tmp_path):
+    from app.config.settings import get_settings
+
+    settings = get_settings()
+    monkeypatch.setattr(settings, "ingestion_workers", 0)
+    monkeypatch.setattr(settings, "upload_spool_dir", str(tmp_path / "spool"))
+    # 测试服务器监听在回环地址上
+    monkeypatch.setattr(settings, "fetch_allow_private_hosts", True)
+    return tmp_path / "pages"
+
+
+def test_refetch_revalidates_with_etag(policy_server, fetch_settings):
+    url = f"{policy_server}/privacy.html"
+
+    async def scenario():
+        fetcher = PolicyFetcher(str(fetch_settings), per_host_limit=2)
+        try:
+            first = await fetcher.fetch(url)
+            second = await fetcher.fetch(url)
+            # 模拟另一个进程：新的客户端同样命中磁盘缓存
+            other = PolicyFetcher(str(fetch_settings), per_host_limit=2)
+            third = await other.fetch(url)
+            await other.aclose()
+            return first, second, third
+        finally:
+            await fetcher.aclose()
+
+    first, second, third = asyncio.run(scenario())
+    assert first.status == "fetched"
+    assert first.text == "我们会收集您的通讯录。"
+    assert first.etag == '"v1"'
+    assert second.status == third.status == "revalidated"
+    assert second.text == first.text
+    assert PolicyHandler.full_responses == 1
+
+
+def test_fetch_errors(policy_server, fetch_settings):
+    async def scenario(url):
+        fetcher = PolicyFetcher(str(fetch_settings), per_host_limit=2)
+        try:
+            return await fetcher.fetch(url)
+        finally:
+            await fetcher.aclose()
+
+    with pytest.raises(FetchError):
+        asyncio.run(scenario(f"{policy_server}/missing.html"))
+    with pytest.raises(FetchError):
+        asyncio.run(scenario("file:///etc/passwd"))
+
+
+def _fetch_with(fetch_settings, transport, url):
+    import httpx
+
+    async def scenario():
+        fetcher = PolicyFetcher(str(fetch_settings), 2, client=httpx.AsyncClient(transport=transport))
+        try:
+            return await fetcher.fetch(url)
+        finally:
+            await fetcher.aclose()
+
+    return asyncio.run(scenario())
+
+
+def test_fetch_rejects_private_addresses_on_every_hop(fetch_settings, monkeypatch):
+    import httpx
+
+    from app.config.settings import get_settings
+    from app.services import fetcher
+
+    monkeypatch.setattr(get_settings(), "fetch_allow_private_hosts", False)
+    addresses = {"policy.example.com": ["93.184.216.34"], "metadata.example.com": ["169.254.169.254"]}
+
+    async def fake_resolve(host, port):
+        return addresses.get(host, ["127.0.0.1"])
+
+    monkeypatch.setattr(fetcher, "resolve_host", fake_resolve)
+    requested = []
+
+    def handler(request):
+        requested.append((request.url.host, request.headers["host"]))
+        if request.url.path == "/moved":
+            return httpx.Response(302, headers={"Location": "http://metadata.example.com/latest"})
+        return httpx.Response(200, html=POLICY_HTML)
+
+    transport = httpx.MockTransport(handler)
+    fetched = _fetch_with(fetch_settings, transport, "http://policy.example.com/privacy.html")
+    assert fetched.text == "我们会收集您的通讯录。"
+    assert requested == [("policy.example.com", "policy.example.com")]
+
+    with pytest.raises(FetchError, match="非公网"):
+        _fetch_with(fetch_settings, transport, "http://policy.example.com/moved")
+    with pytest.raises(FetchError, match="非公网"):
+        _fetch_with(fetch_settings, transport, "http://localhost:8000/privacy.html")
+    assert all(host == "policy.example.com" for host, _ in requested)
+
+
+def test_pinned_transport_keys_connections_by_hostname(fetch_settings, monkeypatch):
+    import httpcore
+    import httpx
+
+    from app.config.settings import get_settings
+    from app.services import fetcher
+
+    monkeypatch.setattr(get_settings(), "fetch_allow_private_hosts", False)
+
+    async def fake_resolve(host, port):
+        # 两个主机名解析到同一个 CDN 地址
+        return ["93.184.216.34"]
+
+    monkeypatch.setattr(fetcher, "resolve_host", fake_resolve)
+    body = POLICY_HTML.encode("utf-8")
+    response = (
+        b"HTTP/1.1 200 OK\r\nContent-Type: text/html; charset=utf-8\r\n"
+        + f"Content-Length: {len(body)}\r\n\r\n".encode("ascii")
+        + body
+    )
+
+    class RecordingBackend(httpcore.AsyncMockBackend):
+        def __init__(self):
+            super().__init__([response])
+            self.dialed = []
+
+        async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+            self.dialed.append((host, port))
+            return await super().connect_tcp(host, port, timeout, local_address, socket_options)
+
+    backend = RecordingBackend()
+    transport = fetcher.PinnedTransport(httpx.Limits(max_keepalive_connections=10), backend)
+
+    async def scenario():
+        client = fetcher.PolicyFetcher(str(fetch_settings), 2, client=httpx.AsyncClient(transport=transport))
+        try:
+            return [await client.fetch(f"http://{host}/privacy.html") for host in ("a.example", "b.example")]
+        finally:
+            await client.aclose()
+
+    first, second = asyncio.run(scenario())
+    assert first.text == second.text == "我们会收集您的通讯录。"
+    # 拨号到校验过的 IP，但 b.example 没有复用为 a.example 建立的保活连接
+    assert backend.dialed == [("93.184.216.34", 80), ("93.184.216.34", 80)]
+
+
+def test_host_slots_limit_concurrency_and_are_dropped_when_idle(fetch_settings):
+    import httpx
+
+    active = []
+    peak = []
+
+    async def handler(request):
+        active.append(request.url.path)
+        peak.append(len(active))
+        await asyncio.sleep(0.05)
+        active.remove(request.url.path)
+        return httpx.Response(200, html=POLICY_HTML)
+
+    async def scenario():
+        fetcher = PolicyFetcher(
+            str(fetch_settings), per_host_limit=1, client=httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        )
+        try:
+            await asyncio.gather(*(fetcher.fetch(f"http://127.0.0.1/p{idx}.html") for idx in range(3)))
+            return fetcher._host_slots, fetcher._host_users
+        finally:
+            await fetcher.aclose()
+
+    slots, users = asyncio.run(scenario())
+    assert max(peak) == 1
+    assert slots == {} and users == {}
+
+
+def test_fetch_follows_redirects_up_to_limit(fetch_settings, monkeypatch):
+    import httpx
+
+    from app.config.settings import get_settings
+
+    monkeypatch.setattr(get_settings(), "fetch_max_redirects", 2)
+
+    def handler(request):
+        hops = {"/a": "/b", "/b": "/privacy.html", "/loop": "/loop"}
+        if request.url.path in hops:
+            return httpx.Response(301, headers={"Location": hops[request.url.path]})
+        return httpx.Response(200, html=POLICY_HTML)
+
+    transport = httpx.MockTransport(handler)
+    assert _fetch_with(fetch_settings, transport, "http://127.0.0.1/a").text == "我们会收集您的通讯录。"
+    with pytest.raises(FetchError, match="重定向"):
+        _fetch_with(fetch_settings, transport, "http://127.0.0.1/loop")
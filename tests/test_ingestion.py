@@ -0,0 +1,126 @@
+from pathlib import Path
+
+from app.services.ingestion import decode_bytes, extract_document, html_to_text
+
+SAMPLE_HTML = Path(__file__).resolve().parent.parent / "隐私政策网页示例.html"
+
+
+def test_extract_html_drops_scripts_and_styles():
+    document = extract_document(str(SAMPLE_HTML), SAMPLE_HTML.name, "text/html")
+    assert document.format == "html"
+    assert document.encoding == "utf-8"
+    assert "<script" not in document.text
+    assert "font-family" not in document.text
+    assert "tailwindcss" not in document.text
+    assert "\n\n\n" not in document.text
+
+
+def test_html_block_tags_become_line_breaks():
+    text = html_to_text("<nav>首页</nav><p>第一条</p><p>第二条<script>x=1</script></p>")
+    assert text.split() == ["第一条", "第二条"]
+
+
+def test_decode_gbk_text(tmp_path):
+    raw = "我们会收集您的手机号码。".encode("gbk")
+    text, encoding = decode_bytes(raw)
+    assert text == "我们会收集您的手机号码。"
+    assert encoding.lower().replace("-", "") in ("gb18030", "gbk", "gb2312")
+
+    path = tmp_path / "policy.txt"
+    path.write_bytes(raw + b"\r\n\r\n\r\n" + "第二段".encode("gbk"))
+    document = extract_document(str(path), "policy.txt", "text/plain")
+    assert document.format == "txt"
+    assert document.text == "我们会收集您的手机号码。\n\n第二段"
+
+
+def _multipart(parts):
+    async def body():
+        for part in parts:
+            yield part
+
+    return body()
+
+
+def test_spool_multipart_writes_file_field_once(monkeypatch, tmp_path):
+    import asyncio
+
+    from app.config.settings import get_settings
+    from app.services.ingestion import spool_multipart
+
+    monkeypatch.setattr(get_settings(), "upload_spool_dir", str(tmp_path))
+    body = _multipart(
+        [
+            b'--b\r\nContent-Disposition: form-data; name="note"\r\n\r\nhello\r\n',
+            b'--b\r\nContent-Disposition: form-data; name="file"; filename="policy.txt"\r\n',
+            b"Content-Type: text/plain\r\n\r\n\xe7\xac\xac\xe4\xb8\x80",
+            b"\xe6\x9d\xa1\r\n--b--\r\n",
+        ]
+    )
+    upload = asyncio.run(spool_multipart(body, "multipart/form-data; boundary=b", 1024))
+
+    assert (upload.filename, upload.content_type, upload.size) == ("policy.txt", "text/plain", 9)
+    assert upload.path.read_bytes().decode("utf-8") == "第一条"
+    assert list(tmp_path.iterdir()) == [upload.path]
+
+
+def test_spool_multipart_stops_reading_once_over_limit(monkeypatch, tmp_path):
+    import asyncio
+
+    import pytest
+
+    from app.config.settings import get_settings
+    from app.services.ingestion import MULTIPART_OVERHEAD, UploadTooLarge, spool_multipart
+
+    monkeypatch.setattr(get_settings(), "upload_spool_dir", str(tmp_path))
+    read = []
+
+    async def body():
+        yield b'--b\r\nContent-Disposition: form-data; name="file"; filename="big.txt"\r\n\r\n'
+        for _ in range(100):
+            read.append(1)
+            yield b"a" * MULTIPART_OVERHEAD
+
+    with pytest.raises(UploadTooLarge):
+        asyncio.run(spool_multipart(body(), "multipart/form-data; boundary=b", 1024))
+    # 第一块文件内容已超过上限，不再继续读取请求体
+    assert len(read) == 1
+    assert list(tmp_path.iterdir()) == []
+
+
+def slow_extract(path, filename="", content_type=None):
+    import time
+
+    time.sleep(30)
+
+
+def test_extract_timeout_terminates_and_recreates_pool(monkeypatch, tmp_path):
+    import asyncio
+
+    import pytest
+
+    from app.config.settings import get_settings
+    from app.services import ingestion
+
+    settings = get_settings()
+    monkeypatch.setattr(settings, "ingestion_workers", 1)
+    monkeypatch.setattr(settings, "ingestion_timeout", 3.0)
+    monkeypatch.setattr(ingestion, "_pool", None)
+    path = tmp_path / "policy.txt"
+    path.write_text("第一条", encoding="utf-8")
+
+    monkeypatch.setattr(ingestion, "extract_document", slow_extract)
+    pool = ingestion._get_pool()
+    with pytest.raises(ingestion.ExtractionError, match="超时"):
+        asyncio.run(ingestion.extract_in_pool(path, "policy.txt", "text/plain"))
+    assert ingestion._pool is None
+    for process in pool._processes.values() if pool._processes else ():
+        process.join(timeout=5)
+        assert not process.is_alive()
+
+    monkeypatch.setattr(ingestion, "extract_document", extract_document)
+    try:
+        document = asyncio.run(ingestion.extract_in_pool(path, "policy.txt", "text/plain"))
+        assert document.text == "第一条"
+        assert ingestion._pool is not None and ingestion._pool is not pool
+    finally:
+        ingestion._pool.shutdown()
@@ -0,0 +1,181 @@
+import csv
+import json
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from app import models
+from app.services.kb_loader import Checkpoint, KnowledgeBaseLoader, split_articles, upsert_kb_items
+
+PIPL = "中华人民共和国个人信息保护法\n第一条 为了保护个人信息权益，制定本法。\n第二条 自然人的个人信息受法律保护。\n第三条 本法适用于境内处理活动。"
+
+
+class FakeCollection:
+    def __init__(self, auto_id=False):
+        self.schema = SimpleNamespace(auto_id=auto_id)
+        self.entities = {}
+        self.next_pk = 1000
+
+    def upsert(self, entities):
+        for entity in entities:
+            self.entities[entity["kb_id"]] = entity
+
+    def delete(self, expr):
+        for kb_id in json.loads(expr[len("kb_id in "):]):
+            self.entities.pop(kb_id, None)
+
+    def insert(self, entities):
+        keys = []
+        for entity in entities:
+            self.next_pk += 1
+            self.entities[entity["kb_id"]] = entity
+            keys.append(self.next_pk)
+        return SimpleNamespace(primary_keys=keys)
+
+
+def embed(texts):
+    return np.ones((len(texts), 4), dtype=np.float32)
+
+
+def test_split_articles():
+    records = split_articles({"kb_id": "pipl", "kb_type": "regulation", "content_text": PIPL})
+    assert [record.kb_id for record in records] == ["pipl-art1", "pipl-art2", "pipl-art3"]
+    assert records[1].content_text == "中华人民共和国个人信息保护法 第二条 自然人的个人信息受法律保护。"
+
+    case = split_articles({"kb_id": "case_1", "kb_type": "case", "content_text": PIPL})
+    assert len(case) == 1
+    with pytest.raises(ValueError):
+        split_articles({"kb_id": "x", "kb_type": "faq", "content_text": "内容"})
+
+
+def test_load_jsonl_and_csv(db_session, tmp_path):
+    regulations = tmp_path / "regulations.jsonl"
+    regulations.write_text(
+        json.dumps({"kb_id": "pipl", "kb_type": "regulation", "content_text": PIPL}, ensure_ascii=False)
+        + "\n"
+        + json.dumps({"kb_id": "csl_41", "kb_type": "regulation", "content_text": "网络安全法第四十一条"}, ensure_ascii=False)
+        + "\n",
+        encoding="utf-8",
+    )
+    cases = tmp_path / "cases.csv"
+    with open(cases, "w", encoding="utf-8", newline="") as out:
+        writer = csv.DictWriter(out, fieldnames=["kb_id", "content_text"])
+        writer.writeheader()
+        writer.writerow({"kb_id": "case_1", "content_text": "某社交软件违规收集通讯录被罚款。"})
+
+    collection = FakeCollection()
+    loader = KnowledgeBaseLoader(
+        db_session, embed_fn=embed, collection=collection, batch_size=2, checkpoint_dir=str(tmp_path / "ckpt")
+    )
+    stats = loader.load_file(str(regulations))
+    assert (stats.records, stats.rows) == (2, 4)
+    assert loader.load_file(str(cases), default_kb_type="case").rows == 1
+    # 已完成的文件重跑直接跳过
+    assert loader.load_file(str(regulations)).rows == 0
+
+    items = {item.kb_id: item for item in db_session.query(models.KnowledgeBaseItem).all()}
+    assert set(items) == {"pipl-art1", "pipl-art2", "pipl-art3", "csl_41", "case_1"}
+    assert items["case_1"].kb_type == "case"
+    assert all(item.milvus_vector_id == kb_id for kb_id, item in items.items())
+    assert set(collection.entities) == set(items)
+
+
+def test_resume_from_checkpoint_and_auto_id(db_session, tmp_path):
+    source = tmp_path / "cases.jsonl"
+    source.write_text(
+        "".join(
+            json.dumps({"kb_id": f"case_{idx}", "kb_type": "case", "content_text": f"案例 {idx}"}, ensure_ascii=False)
+            + "\n"
+            for idx in range(5)
+        ),
+        encoding="utf-8",
+    )
+    embedded = []
+
+    def failing_embed(texts):
+        if len(embedded) == 4:
+            raise RuntimeError("embedding service unavailable")
+        embedded.extend(texts)
+        return embed(texts)
+
+    collection = FakeCollection(auto_id=True)
+    loader = KnowledgeBaseLoader(
+        db_session, embed_fn=failing_embed, collection=collection, batch_size=2, checkpoint_dir=str(tmp_path)
+    )
+    with pytest.raises(RuntimeError):
+        loader.load_file(str(source))
+    checkpoint = Checkpoint(str(tmp_path), str(source)).load()
+    assert (checkpoint.records, checkpoint.completed) == (4, False)
+
+    embedded.clear()
+    loader.embed_fn = lambda texts: embedded.extend(texts) or embed(texts)
+    stats = loader.load_file(str(source))
+    assert stats.records == 1
+    assert embedded == ["案例 4"]
+    ids = [item.milvus_vector_id for item in db_session.query(models.KnowledgeBaseItem).order_by(models.KnowledgeBaseItem.kb_id)]
+    assert len(ids) == 5 and all(vector_id.isdigit() for vector_id in ids)
+    assert len(collection.entities) == 5
+
+
+def test_duplicate_kb_ids_in_one_batch_keep_last_row(db_session, tmp_path):
+    from datetime import datetime
+
+    collection = FakeCollection()
+    upserts = []
+    original_upsert = collection.upsert
+
+    def record_upsert(entities):
+        upserts.append([entity["kb_id"] for entity in entities])
+        original_upsert(entities)
+
+    collection.upsert = record_upsert
+    loader = KnowledgeBaseLoader(
+        db_session, embed_fn=embed, collection=collection, batch_size=10, checkpoint_dir=str(tmp_path)
+    )
+    loader.load_records(
+        [
+            {"kb_id": "case_1", "kb_type": "case", "content_text": "旧的案例描述"},
+            {"kb_id": "case_2", "kb_type": "case", "content_text": "另一条案例"},
+            {"kb_id": "case_1", "kb_type": "case", "content_text": "更正后的案例描述"},
+        ]
+    )
+    assert upserts == [["case_1", "case_2"]]
+    assert collection.entities["case_1"]["content"] == "更正后的案例描述"
+    assert db_session.get(models.KnowledgeBaseItem, "case_1").content_text == "更正后的案例描述"
+
+    now = datetime.utcnow()
+    row = {"kb_type": "case", "milvus_vector_id": "", "is_active": True, "created_at": now, "updated_at": now}
+    upsert_kb_items(
+        db_session,
+        [{**row, "kb_id": "case_3", "content_text": "第一版"}, {**row, "kb_id": "case_3", "content_text": "第二版"}],
+    )
+    assert db_session.get(models.KnowledgeBaseItem, "case_3").content_text == "第二版"
+
+
+def test_reload_deactivates_articles_missing_from_source(db_session, tmp_path):
+    collection = FakeCollection()
+    loader = KnowledgeBaseLoader(
+        db_session, embed_fn=embed, collection=collection, batch_size=10, checkpoint_dir=str(tmp_path)
+    )
+    other = {"kb_id": "pipl_2", "kb_type": "regulation", "content_text": PIPL}
+    loader.load_records([{"kb_id": "pipl", "kb_type": "regulation", "content_text": PIPL}, other])
+
+    # 删掉第三条后重新加载：pipl-art3 停用并删除向量，同前缀的 pipl_2 不受影响
+    shortened = PIPL.rsplit("\n", 1)[0]
+    loader.load_records([{"kb_id": "pipl", "kb_type": "regulation", "content_text": shortened}])
+    items = {item.kb_id: item for item in db_session.query(models.KnowledgeBaseItem).all()}
+    assert items["pipl-art3"].is_active is False
+    assert items["pipl-art3"].milvus_vector_id == ""
+    assert all(items[kb_id].is_active for kb_id in ("pipl-art1", "pipl-art2", "pipl_2-art3"))
+    assert "pipl-art3" not in collection.entities
+    assert "pipl_2-art3" in collection.entities
+
+    # 改为不分条后，所有 -artN 条目都被替换为单条
+    loader.load_records([{"kb_id": "pipl", "kb_type": "regulation", "content_text": "个人信息保护法摘要"}])
+    active = {
+        item.kb_id
+        for item in db_session.query(models.KnowledgeBaseItem).filter(models.KnowledgeBaseItem.is_active.is_(True))
+    }
+    assert {kb_id for kb_id in active if kb_id.startswith("pipl-") or kb_id == "pipl"} == {"pipl"}
+    assert {kb_id for kb_id in collection.entities if kb_id.startswith("pipl-")} == set()
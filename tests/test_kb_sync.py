@@ -0,0 +1,99 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from app import models
+from app.services.kb_sync import KnowledgeBaseSync
+from app.services.rag_retriever import RagRetriever
+from tests.test_kb_loader import FakeCollection
+
+
+def add_item(db, kb_id, content, updated_at, kb_type="regulation"):
+    db.add(
+        models.KnowledgeBaseItem(
+            kb_id=kb_id,
+            kb_type=kb_type,
+            content_text=content,
+            milvus_vector_id="",
+            created_at=updated_at,
+            updated_at=updated_at,
+        )
+    )
+
+
+def test_sync_only_processes_changes_since_watermark(db_session):
+    base = datetime(2026, 1, 1)
+    for idx in range(5):
+        add_item(db_session, f"reg_{idx}", f"法规 {idx}", base + timedelta(seconds=idx // 2))
+    db_session.commit()
+
+    embedded = []
+
+    def embed(texts):
+        embedded.extend(texts)
+        return np.ones((len(texts), 4), dtype=np.float32)
+
+    collection = FakeCollection()
+    sync = KnowledgeBaseSync(db_session, embed_fn=embed, collection=collection, batch_size=2)
+    now = base + timedelta(minutes=10)
+    result = sync.run(now=now)
+    assert (result.upserted, result.deleted, result.pending, result.lag_seconds) == (5, 0, 0, 0.0)
+    assert set(collection.entities) == {f"reg_{idx}" for idx in range(5)}
+    assert db_session.get(models.KnowledgeBaseItem, "reg_0").milvus_vector_id == "reg_0"
+
+    # 无变更时不重复嵌入
+    embedded.clear()
+    assert sync.run(now=now).upserted == 0
+    assert embedded == []
+
+    edited = db_session.get(models.KnowledgeBaseItem, "reg_1")
+    edited.content_text = "法规 1（修订）"
+    edited.updated_at = now + timedelta(seconds=1)
+    db_session.get(models.KnowledgeBaseItem, "reg_3").is_active = False
+    db_session.get(models.KnowledgeBaseItem, "reg_3").updated_at = now + timedelta(seconds=1)
+    add_item(db_session, "reg_new", "刚写入的法规", now + timedelta(minutes=10))
+    db_session.commit()
+
+    later = now + timedelta(minutes=10, seconds=2)
+    result = sync.run(now=later)
+    # 刚写入、仍在等待窗口内的行计入积压，下一轮再同步
+    assert (result.upserted, result.deleted, result.pending) == (1, 1, 1)
+    assert result.lag_seconds == 2.0
+    assert embedded == ["法规 1（修订）"]
+    assert "reg_3" not in collection.entities
+    assert collection.entities["reg_1"]["content"] == "法规 1（修订）"
+
+    hits = RagRetriever(db_session)._db_search("regulation", top_k=10)
+    assert "reg_3" not in {hit["kb_id"] for hit in hits}
+
+
+def test_sync_skips_rows_whose_vectors_the_loader_wrote(db_session, tmp_path):
+    from app.services.kb_loader import KnowledgeBaseLoader
+
+    embedded = []
+
+    def embed(texts):
+        embedded.extend(texts)
+        return np.ones((len(texts), 4), dtype=np.float32)
+
+    collection = FakeCollection()
+    loader = KnowledgeBaseLoader(
+        db_session, embed_fn=embed, collection=collection, batch_size=10, checkpoint_dir=str(tmp_path)
+    )
+    loader.load_records([{"kb_id": f"case_{idx}", "kb_type": "case", "content_text": f"案例 {idx}"} for idx in range(3)])
+    db_only = KnowledgeBaseLoader(
+        db_session, embed_fn=embed, use_milvus=False, batch_size=10, checkpoint_dir=str(tmp_path)
+    )
+    db_only.load_records([{"kb_id": "case_db", "kb_type": "case", "content_text": "只写入数据库的案例"}])
+    edited = db_session.get(models.KnowledgeBaseItem, "case_1")
+    edited.content_text = "案例 1（更新）"
+    edited.updated_at = datetime.utcnow()
+    db_session.commit()
+
+    embedded.clear()
+    sync = KnowledgeBaseSync(db_session, embed_fn=embed, collection=collection)
+    result = sync.run(now=datetime.utcnow() + timedelta(hours=1))
+    # 加载器已写好向量的行只推进水位线；之后手工修改的行与未写向量的行照常同步
+    assert (result.upserted, result.pending) == (2, 0)
+    assert sorted(embedded) == sorted(["案例 1（更新）", "只写入数据库的案例"])
+    assert collection.entities["case_db"]["content"] == "只写入数据库的案例"
@@ -0,0 +1,383 @@
+import contextlib
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from app.services import model_manager
+from app.services.cache import EmbeddingCache, GenerationCache, LRUCache, TieredCache
+from app.services.model_manager import ModelManager
+
+
+class CharTokenizer:
+    """按字符切分的 fast tokenizer 替身，仅提供 offset mapping。"""
+
+    is_fast = True
+
+    def __call__(self, text, add_special_tokens=False, return_offsets_mapping=False):
+        return {
+            "offset_mapping": [
+                (i, i + 1) for i, char in enumerate(text) if not char.isspace()
+            ]
+        }
+
+
+def test_segment_spans_match_original_text(monkeypatch):
+    manager = ModelManager()
+    monkeypatch.setattr(manager, "_load_transformers", lambda: (CharTokenizer(), None))
+    manager.settings = manager.settings.model_copy(update={"bert_max_chunk_tokens": 12})
+
+    text = "  我们收集位置信息。我们会共享给第三方！\n您可以删除账户；谢谢"
+    spans = manager.segment_policy_text(text)
+
+    assert spans
+    for span in spans:
+        assert text[span.start : span.end] == span.text
+    # 窗口结尾对齐句末标点
+    assert spans[0].text == "我们收集位置信息。"
+    assert spans[-1].end == len(text)
+
+
+def test_segment_with_stride_overlaps(monkeypatch):
+    manager = ModelManager()
+    monkeypatch.setattr(manager, "_load_transformers", lambda: (CharTokenizer(), None))
+    manager.settings = manager.settings.model_copy(update={"bert_max_chunk_tokens": 10})
+
+    text = "甲乙丙丁戊己庚辛壬癸子丑寅卯辰巳午未申酉"
+    spans = manager.segment_policy_text(text, stride=2)
+
+    assert len(spans) > 1
+    for prev, nxt in zip(spans, spans[1:]):
+        assert nxt.start < prev.end
+
+
+def test_segment_fallback_keeps_paragraph_positions(monkeypatch):
+    monkeypatch.setattr(model_manager, "HAS_TRANSFORMERS", False)
+    manager = ModelManager()
+
+    text = "第一段内容。\n\n  第二段内容。  \n\n"
+    spans = manager.segment_policy_text(text)
+
+    assert [span.text for span in spans] == ["第一段内容。", "第二段内容。"]
+    assert all(text[span.start : span.end] == span.text for span in spans)
+
+
+class _Inputs(dict):
+    def to(self, device):
+        return self
+
+
+class BatchTokenizer:
+    """记录每批输入的 tokenizer 替身，把文本长度作为模型输入。"""
+
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, texts, return_tensors=None, padding=None, truncation=None, max_length=None):
+        self.batches.append(list(texts))
+        return _Inputs(lengths=np.array([len(text) for text in texts], dtype=np.float32))
+
+
+class LengthModel:
+    """第 1 类 logit 等于长度的十分之一，分数随文本长度单调递增。"""
+
+    def __call__(self, lengths):
+        return SimpleNamespace(logits=np.stack([np.zeros_like(lengths), lengths / 10], axis=1))
+
+
+def _softmax(logits, dim):
+    exp = np.exp(logits - logits.max(axis=dim, keepdims=True))
+    return exp / exp.sum(axis=dim, keepdims=True)
+
+
+def test_classify_chunks_batches_by_length_and_restores_order(monkeypatch):
+    fake_torch = SimpleNamespace(
+        softmax=_softmax, no_grad=contextlib.nullcontext, inference_mode=contextlib.nullcontext
+    )
+    monkeypatch.setattr(model_manager, "torch", fake_torch)
+    tokenizer = BatchTokenizer()
+    manager = ModelManager()
+    manager.settings = manager.settings.model_copy(update={"bert_batch_size": 3})
+    monkeypatch.setattr(manager, "_load_transformers", lambda: (tokenizer, LengthModel()))
+
+    lengths = [7, 1, 12, 3, 3, 20, 5]
+    texts = ["字" * length for length in lengths]
+    results = manager.classify_chunks(texts)
+
+    expected = _softmax(np.stack([np.zeros(len(lengths)), np.array(lengths) / 10], axis=1), dim=-1)[:, 1]
+    assert [round(result["score"], 6) for result in results] == [round(float(score), 6) for score in expected]
+    # 7 条输入按 bert_batch_size=3 分成 3 批，批内与批间都按长度升序
+    assert len(tokenizer.batches) == 3
+    assert [len(batch) for batch in tokenizer.batches] == [3, 3, 1]
+    flattened = [len(text) for batch in tokenizer.batches for text in batch]
+    assert flattened == sorted(lengths)
+
+
+class FakeTorch:
+    """记录线程数、量化与推理上下文调用的 torch 替身。"""
+
+    qint8 = "qint8"
+    nn = SimpleNamespace(Linear="Linear")
+    cuda = SimpleNamespace(is_available=lambda: False)
+
+    def __init__(self):
+        self.threads = []
+        self.quantized = []
+        self.quantization = SimpleNamespace(quantize_dynamic=self._quantize_dynamic)
+
+    def set_num_threads(self, threads):
+        self.threads.append(threads)
+
+    def _quantize_dynamic(self, model, layers, dtype):
+        self.quantized.append((model, layers, dtype))
+        return SimpleNamespace(quantized=model)
+
+    def inference_mode(self):
+        return contextlib.nullcontext("inference_mode")
+
+    def no_grad(self):
+        return contextlib.nullcontext("no_grad")
+
+
+def _stub_torch(monkeypatch):
+    fake_torch = FakeTorch()
+    monkeypatch.setattr(model_manager, "torch", fake_torch)
+    monkeypatch.setattr(model_manager, "HAS_TRANSFORMERS", True)
+    return fake_torch
+
+
+def test_configure_threads_divides_cores_by_worker_concurrency(monkeypatch):
+    fake_torch = _stub_torch(monkeypatch)
+    monkeypatch.setattr(model_manager.os, "cpu_count", lambda: 8)
+    manager = ModelManager()
+    manager.settings = manager.settings.model_copy(
+        update={"bert_inference_profile": "int8", "torch_num_threads": 0, "celery_worker_concurrency": 3}
+    )
+
+    assert manager.configure_threads(4) == 2
+    # 未显式传入时按 celery_worker_concurrency 划分，并发数超过核数时至少保留 1 个线程
+    assert manager.configure_threads() == 8 // 3
+    assert manager.configure_threads(16) == 1
+    assert fake_torch.threads == [2, 2, 1]
+
+    manager.settings = manager.settings.model_copy(update={"bert_inference_profile": "fp32"})
+    assert manager.configure_threads(4) == 0
+    assert fake_torch.threads == [2, 2, 1]
+    manager.settings = manager.settings.model_copy(update={"torch_num_threads": 5})
+    assert manager.configure_threads(4) == 5
+    assert fake_torch.threads == [2, 2, 1, 5]
+
+
+@pytest.mark.parametrize(
+    "profile, device, quantized",
+    [("int8", "cpu", True), ("int8", "cuda", False), ("fp32", "cpu", False)],
+)
+def test_load_transformers_quantizes_only_int8_on_cpu(monkeypatch, profile, device, quantized):
+    fake_torch = _stub_torch(monkeypatch)
+    model = SimpleNamespace(to=lambda target: model)
+    monkeypatch.setattr(
+        model_manager, "AutoTokenizer", SimpleNamespace(from_pretrained=lambda name: "tokenizer")
+    )
+    monkeypatch.setattr(
+        model_manager,
+        "AutoModelForSequenceClassification",
+        SimpleNamespace(from_pretrained=lambda name, num_labels: model),
+    )
+    manager = ModelManager()
+    manager.device = device
+    manager.settings = manager.settings.model_copy(update={"bert_inference_profile": profile})
+
+    tokenizer, loaded = manager._load_transformers()
+
+    assert tokenizer == "tokenizer"
+    if quantized:
+        assert fake_torch.quantized == [(model, {"Linear"}, "qint8")]
+        assert loaded.quantized is model
+    else:
+        assert fake_torch.quantized == []
+        assert loaded is model
+
+
+def test_inference_context_prefers_inference_mode_for_int8(monkeypatch):
+    _stub_torch(monkeypatch)
+    manager = ModelManager()
+
+    manager.settings = manager.settings.model_copy(update={"bert_inference_profile": "int8"})
+    with manager._inference_context() as mode:
+        assert mode == "inference_mode"
+    manager.settings = manager.settings.model_copy(update={"bert_inference_profile": "fp32"})
+    with manager._inference_context() as mode:
+        assert mode == "no_grad"
+
+
+class FakeEmbeddingsAPI:
+    def __init__(self):
+        self.calls = []
+
+    def with_options(self, **kwargs):
+        return self
+
+    @property
+    def embeddings(self):
+        return self
+
+    def create(self, model, input):
+        self.calls.append(list(input))
+        if len(input) > 2:
+            error = Exception("batch too large")
+            error.status_code = 400
+            raise error
+        data = [
+            SimpleNamespace(index=i, embedding=[float(len(text)), 1.0])
+            for i, text in enumerate(input)
+        ]
+        return SimpleNamespace(data=data)
+
+
+def test_embed_texts_splits_rejected_batches_and_dedups():
+    manager = ModelManager()
+    client = FakeEmbeddingsAPI()
+    manager._openai_client = client
+    manager._get_openai_client = lambda: client
+    manager._embedding_cache = EmbeddingCache(TieredCache(LRUCache(1024)))
+
+    texts = ["一", "二二", "三三三", "一", "四四四四"]
+    matrix = manager.embed_texts(texts)
+
+    assert matrix.dtype == np.float32
+    assert matrix[:, 0].tolist() == [1.0, 2.0, 3.0, 1.0, 4.0]
+    # 重复文本只请求一次，超限批次被对半拆分
+    assert client.calls[0] == ["一", "二二", "三三三", "四四四四"]
+    assert all(len(call) <= 2 for call in client.calls[1:])
+
+    client.calls.clear()
+    manager.embed_texts(["二二"])
+    assert client.calls == []
+
+
+def test_embed_texts_raises_other_bad_requests_without_splitting():
+    class InvalidModelAPI(FakeEmbeddingsAPI):
+        def create(self, model, input):
+            self.calls.append(list(input))
+            error = Exception("Model not exist.")
+            error.status_code = 400
+            error.code = "model_not_found"
+            raise error
+
+    manager = ModelManager()
+    client = InvalidModelAPI()
+    manager._get_openai_client = lambda: client
+    manager._embedding_cache = EmbeddingCache(TieredCache(LRUCache(1024)))
+
+    with pytest.raises(Exception, match="Model not exist"):
+        manager.embed_texts(["一", "二二", "三三三", "四四四四"])
+    assert client.calls == [["一", "二二", "三三三", "四四四四"]]
+
+
+class FakeChatAPI:
+    def __init__(self):
+        self.failed = set()
+
+    def with_options(self, **kwargs):
+        return self
+
+    @property
+    def chat(self):
+        return self
+
+    @property
+    def completions(self):
+        return self
+
+    def create(self, model, messages, temperature):
+        prompt = messages[-1]["content"]
+        if prompt == "p1" and prompt not in self.failed:
+            self.failed.add(prompt)
+            error = Exception("server busy")
+            error.status_code = 503
+            raise error
+        # 越靠前的 prompt 返回越慢，检验结果按输入顺序返回
+        time.sleep(0.05 / (int(prompt[1:]) + 1))
+        message = SimpleNamespace(content=f"answer-{prompt}")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+def test_generate_texts_keeps_order_and_retries():
+    manager = ModelManager()
+    manager.settings = manager.settings.model_copy(update={"llm_retry_backoff": 0.0})
+    client = FakeChatAPI()
+    manager._get_openai_client = lambda: client
+    manager._generation_cache = GenerationCache(TieredCache(LRUCache(1024)))
+
+    prompts = [f"p{i}" for i in range(6)]
+    assert manager.generate_texts(prompts) == [f"answer-{p}" for p in prompts]
+
+
+def test_generate_texts_uses_cache_unless_bypassed():
+    manager = ModelManager()
+    client = FakeChatAPI()
+    client.failed.add("p1")
+    manager._get_openai_client = lambda: client
+    manager._generation_cache = GenerationCache(TieredCache(LRUCache(1024)), ttl=60)
+
+    manager.generate_texts(["p1", "p2"])
+    client.create = lambda **kwargs: (_ for _ in ()).throw(AssertionError("cache miss"))
+    assert manager.generate_texts(["p2", "p1"]) == ["answer-p2", "answer-p1"]
+    assert manager.cache_stats()["generation"]["hits"] == 2
+
+    calls = []
+    client.create = lambda **kwargs: calls.append(kwargs) or SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content="fresh"))]
+    )
+    assert manager.generate_text("p2", use_cache=False) == "fresh"
+    assert len(calls) == 1
+
+
+def test_predict_risk_levels_matches_single_row_prediction():
+    manager = ModelManager()
+    matrix = np.array([[0.9, 0.8, 1.0], [0.5, 0.4, 0.4], [0.1, 0.0, 0.2]], dtype=np.float32)
+
+    levels = manager.predict_risk_levels(matrix)
+
+    assert levels == ["high", "medium", "low"]
+    assert levels == [manager.predict_risk_level(row.tolist()) for row in matrix]
+    assert manager.predict_risk_levels(np.zeros((0, 3))) == []
+
+
+class StubBooster:
+    """只实现 inplace_predict 的风险模型替身，以第一列特征作为预测概率。"""
+
+    def __init__(self):
+        self.calls = []
+
+    def inplace_predict(self, matrix):
+        self.calls.append(matrix)
+        return matrix[:, 0]
+
+
+def test_predict_risk_levels_maps_booster_probabilities():
+    manager = ModelManager()
+    booster = StubBooster()
+    manager._load_risk_model = lambda: booster
+    matrix = np.array([[0.9, 0.0], [0.66, 1.0], [0.5, 1.0], [0.33, 1.0], [0.1, 1.0]], dtype=np.float32)
+
+    levels = manager.predict_risk_levels(matrix)
+
+    # 模型路径的阈值为 high > 0.66、medium > 0.33，与回退路径的 0.7 / 0.4 不同
+    assert levels == ["high", "medium", "medium", "low", "low"]
+    assert len(booster.calls) == 1
+    assert booster.calls[0].dtype == np.float32
+    assert booster.calls[0].shape == (5, 2)
+
+
+def test_warm_up_reports_readiness_and_timings():
+    manager = ModelManager()
+    assert manager.readiness()["ready"] is False
+
+    timings = manager.warm_up()
+
+    readiness = manager.readiness()
+    assert readiness["ready"] is True
+    assert set(timings) == {"bert_load", "bert_forward", "risk_model_load", "risk_model_predict"}
+    assert readiness["timings"] == timings
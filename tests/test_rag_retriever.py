@@ -0,0 +1,136 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from app import models
+from app.services import rag_retriever
+from app.services.rag_retriever import MilvusRegistry, RagRetriever
+from app.services.vector_index import LocalVectorIndex
+
+
+class FakeMilvus:
+    def __init__(self):
+        self.connects = 0
+        self.loads = 0
+        self.healthy = True
+
+    def connect(self, **kwargs):
+        self.connects += 1
+
+    def disconnect(self, alias):
+        pass
+
+    def has_collection(self, name, using=None):
+        return self.healthy
+
+    def collection(self, name, using=None):
+        milvus = self
+
+        class _Collection:
+            def load(self):
+                milvus.loads += 1
+
+        return _Collection()
+
+
+@pytest.fixture
+def fake_milvus(monkeypatch):
+    milvus = FakeMilvus()
+    monkeypatch.setattr(rag_retriever, "HAS_MILVUS", True)
+    monkeypatch.setattr(
+        rag_retriever,
+        "connections",
+        SimpleNamespace(connect=milvus.connect, disconnect=milvus.disconnect),
+    )
+    monkeypatch.setattr(rag_retriever, "utility", SimpleNamespace(has_collection=milvus.has_collection))
+    monkeypatch.setattr(rag_retriever, "Collection", milvus.collection)
+    return milvus
+
+
+def test_registry_connects_once_and_reconnects_after_failure(fake_milvus):
+    registry = MilvusRegistry()
+    registry.settings = registry.settings.model_copy(
+        update={"milvus_health_check_interval": 0.0, "milvus_reconnect_backoff": 0.0}
+    )
+
+    first = registry.get_collection()
+    assert registry.get_collection() is first
+    assert (fake_milvus.connects, fake_milvus.loads) == (1, 1)
+
+    fake_milvus.healthy = False
+    assert registry.get_collection() is None
+    fake_milvus.healthy = True
+    assert registry.get_collection() is not None
+    assert fake_milvus.connects == 3
+
+
+class RecordingCollection:
+    def __init__(self):
+        self.calls = []
+
+    def search(self, data, anns_field, param, limit, expr, output_fields):
+        self.calls.append((len(data), expr))
+        hit = lambda kb_id: SimpleNamespace(entity={"kb_id": kb_id, "content": expr})
+        # 第二个向量在 Milvus 中没有命中
+        return [[hit(f"{expr}-{i}")] if i != 1 else [] for i in range(len(data))]
+
+
+def test_search_batch_issues_one_query_per_kb_type(db_session, monkeypatch):
+    db_session.add(
+        models.KnowledgeBaseItem(
+            kb_id="case_db", kb_type="case", milvus_vector_id="v1", content_text="数据库案例"
+        )
+    )
+    db_session.flush()
+    collection = RecordingCollection()
+    retriever = RagRetriever(db_session)
+    retriever.settings = retriever.settings.model_copy(update={"local_index_enabled": False})
+    monkeypatch.setattr(RagRetriever, "collection", property(lambda self: collection))
+
+    results = retriever.search_batch([[0.1, 0.2]] * 3, ["regulation", "case"], top_k=2)
+
+    assert [count for count, _ in collection.calls] == [3, 3]
+    assert len(results) == 3
+    assert results[0]["regulation"][0]["kb_id"] == 'kb_type == "regulation"-0'
+    assert results[2]["case"][0]["kb_id"] == 'kb_type == "case"-2'
+    assert results[1]["case"][0]["kb_id"] == "case_db"
+    assert results[1]["regulation"] == []
+
+
+def test_local_index_ranks_by_similarity_and_refreshes_incrementally(db_session, tmp_path):
+    vectors = {"定位": [1.0, 0.0], "共享": [0.0, 1.0], "存储": [0.7, 0.7]}
+    embedded = []
+
+    def embed(texts):
+        embedded.extend(texts)
+        return np.asarray([vectors[text] for text in texts], dtype=np.float32)
+
+    for kb_id, content in [("reg_a", "定位"), ("reg_b", "共享")]:
+        db_session.add(
+            models.KnowledgeBaseItem(
+                kb_id=kb_id, kb_type="regulation", milvus_vector_id=kb_id, content_text=content
+            )
+        )
+    db_session.flush()
+
+    index = LocalVectorIndex(str(tmp_path), embed, signature="test")
+    index.refresh(db_session, force=True)
+    assert index.search([[0.9, 0.1], [0.0, 2.0]], "regulation", top_k=1) == [
+        [("reg_a", pytest.approx(1.0, abs=0.02))],
+        [("reg_b", pytest.approx(1.0))],
+    ]
+
+    item = db_session.get(models.KnowledgeBaseItem, "reg_b")
+    item.content_text = "存储"
+    item.updated_at = datetime.utcnow() + timedelta(seconds=5)
+    db_session.flush()
+    embedded.clear()
+    index.refresh(db_session, force=True)
+    assert embedded == ["存储"]
+
+    # 新进程从 memmap 文件加载，无需重新嵌入
+    reloaded = LocalVectorIndex(str(tmp_path), embed, signature="test")
+    ranked = reloaded.search([[0.6, 0.8]], "regulation", top_k=2)[0]
+    assert [kb_id for kb_id, _ in ranked] == ["reg_b", "reg_a"]
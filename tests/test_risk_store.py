@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta
+
+from app import models
+from app.schemas import CaseItem, FragmentPosition, RegulationItem, RiskDetail
+from app.services.risk_store import RiskStore, backfill_risk_details
+
+
+def _risk(risk_id, level, category, kb_id):
+    return RiskDetail(
+        risk_id=risk_id,
+        category=category,
+        level=level,
+        policy_fragment=f"片段 {risk_id}",
+        fragment_position=FragmentPosition(start_index=0, end_index=5),
+        violated_regulations=[RegulationItem(kb_id=kb_id, title="法规", excerpt="条文")],
+        related_cases=[CaseItem(kb_id="case_001", title="案例", penalty="参考案例")],
+        risk_description="描述",
+        rectification_suggestion="建议",
+    )
+
+
+def _report(db_session, report_id, app_name, detection_time, **extra):
+    db_session.add(
+        models.Report(
+            report_id=report_id,
+            app_name=app_name,
+            detection_time=detection_time,
+            basic_info={"app_name": extra.pop("basic_app_name", app_name)},
+            statistics={},
+            operation_logs_json=[],
+            **extra,
+        )
+    )
+    db_session.flush()
+
+
+def test_search_filters_across_reports(db_session):
+    store = RiskStore(db_session)
+    now = datetime.utcnow()
+    _report(db_session, "report-old", "AppA", now - timedelta(days=60))
+    _report(db_session, "report-new", "AppB", now)
+    store.save("report-old", [_risk("a-1", "high", "信息共享", "reg_001")])
+    store.save(
+        "report-new",
+        [
+            _risk("b-1", "high", "信息共享", "reg_001"),
+            _risk("b-2", "low", "信息收集", "reg_001"),
+            _risk("b-3", "high", "信息存储", "reg_002"),
+        ],
+    )
+
+    total, items = store.search(level="high", kb_id="reg_001", since=now - timedelta(days=30))
+    assert total == 1
+    assert (items[0].risk_id, items[0].report_id, items[0].app_name) == ("b-1", "report-new", "AppB")
+
+    total, items = store.search(kb_id="case_001", offset=1, limit=2)
+    assert total == 4
+    assert [item.risk_id for item in items] == ["b-2", "b-3"]
+
+    total, page = store.page_for_report("report-new", category="信息存储")
+    assert total == 1
+    assert page[0].violated_regulations[0].kb_id == "reg_002"
+
+
+def test_backfill_moves_legacy_json_into_tables(db_session):
+    legacy = [_risk("legacy-1", "medium", "用户权利", "reg_003").model_dump(mode="json")]
+    _report(
+        db_session,
+        "report-legacy",
+        None,
+        datetime.utcnow(),
+        basic_app_name="LegacyApp",
+        risk_details_json=legacy,
+    )
+
+    assert backfill_risk_details(db_session) == 1
+    assert backfill_risk_details(db_session) == 0
+    assert RiskStore(db_session).load("report-legacy")[0].model_dump(mode="json") == legacy[0]
+    assert db_session.get(models.Report, "report-legacy").app_name == "LegacyApp"